@@ -0,0 +1,71 @@
+"""
+Block decoding benchmark for the notification of stored blocks.
+
+A subscriber that is notified of a block typically reads only its type and dot. Compares,
+per notified block, the time and the peak memory allocated to read it, of:
+ - unpacking the full block, which also packs it again to compute its hash (before),
+ - a lazy block view over the blob, decoding only the fields that are read,
+ - a lazy block view over a buffer borrowed from the LMDB block store.
+
+Usage: python -m simulations.plexus.block_view_benchmark [num_blocks]
+"""
+from functools import partial
+import sys
+import tempfile
+from typing import List
+
+from bami.plexus.backbone.block import PlexusBlock, PlexusBlockView
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+from simulations.plexus.utils import (
+    create_community_blocks,
+    measure,
+    peak_allocation,
+    report,
+)
+
+
+def read_unpacked(store: LMDBLockStore, hashes: List[bytes]) -> None:
+    for block_hash in hashes:
+        block = PlexusBlock.unpack(store.get_block_by_hash(block_hash))
+        block.type, block.com_dot
+
+
+def read_view(store: LMDBLockStore, hashes: List[bytes]) -> None:
+    for block_hash in hashes:
+        block = PlexusBlockView(store.get_block_by_hash(block_hash), block_hash)
+        block.type, block.com_dot
+
+
+def read_buffer_view(store: LMDBLockStore, hashes: List[bytes]) -> None:
+    for block_hash in hashes:
+        with store.get_block_buffer(block_hash) as buffer:
+            block = PlexusBlockView(buffer, block_hash)
+            block.type, block.com_dot
+
+
+def main(num_blocks: int = 10_000) -> None:
+    blocks = create_community_blocks(num_blocks)
+    hashes = [block.hash for block in blocks]
+    with tempfile.TemporaryDirectory() as work_dir:
+        store = LMDBLockStore(work_dir)
+        with store.write_batch():
+            for block in blocks:
+                store.add_block(block.hash, block.pack())
+        for name, read in (
+            ("unpack (before)", read_unpacked),
+            ("lazy view", read_view),
+            ("lazy view, store buffer", read_buffer_view),
+        ):
+            report(name, num_blocks, measure(read, store, hashes))
+            # Trace the allocations of a sample, tracing slows down the reads
+            print(
+                "{name:<40} {size:>9.1f} bytes allocated/block".format(
+                    name="",
+                    size=peak_allocation(partial(read, store), hashes[:1000]),
+                )
+            )
+        store.close()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,105 @@
+"""
+In-order block delivery benchmark with an LMDB block store.
+
+Persists a community chain in batches with DBManager.add_blocks, with an in-order subscriber
+of the chain that spends subscriber_us microseconds per block. Compares:
+ - reading and delivering every block when its batch is persisted (before),
+ - delivering the decoded blocks of the OrderedDelivery when their batch is persisted,
+ - queueing the blocks when persisted, and delivering them afterwards, as the delivery
+   task does with async_block_delivery.
+Reports the time to persist the blocks, which includes the delivery when it is inline,
+and the time to deliver the queued blocks.
+
+Usage: python -m simulations.plexus.delivery_benchmark [num_blocks] [subscriber_us]
+"""
+import sys
+import tempfile
+import time
+from typing import List
+
+from bami.plexus.backbone.block import PlexusBlock, PlexusBlockView
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+from bami.plexus.backbone.datastore.chain_store import ChainFactory
+from bami.plexus.backbone.datastore.database import DBManager
+from bami.plexus.backbone.delivery import OrderedDelivery
+from bami.plexus.backbone.utils import Dot
+from simulations.plexus.utils import create_community_blocks, measure, report
+
+BATCH_SIZE = 100
+MAP_SIZE = 2**30
+
+
+def subscriber(delay: float):
+    def received_block_in_order(block: PlexusBlock) -> None:
+        # Stands for the processing of the application, e.g. a payment state update
+        block.com_dot
+        end = time.perf_counter() + delay
+        while time.perf_counter() < end:
+            pass
+
+    return received_block_in_order
+
+
+def persist(dbms: DBManager, blocks: List[PlexusBlock], delivery=None) -> None:
+    for i in range(0, len(blocks), BATCH_SIZE):
+        batch = blocks[i : i + BATCH_SIZE]
+        if delivery:
+            for block in batch:
+                delivery.remember(block)
+        dbms.add_blocks([(block.pack(), block) for block in batch])
+
+
+def run(num_blocks: int, delay: float) -> None:
+    blocks = create_community_blocks(num_blocks)
+    chain_id = blocks[0].com_id
+    callback = subscriber(delay)
+    for name in ("read per block (before)", "decoded", "queued"):
+        with tempfile.TemporaryDirectory() as work_dir:
+            dbms = DBManager(ChainFactory(), LMDBLockStore(work_dir, MAP_SIZE))
+
+            def load_block(c_id: bytes, dot: Dot) -> PlexusBlockView:
+                return PlexusBlockView(dbms.get_block_blob_by_dot(c_id, dot))
+
+            delivery = OrderedDelivery(load_block)
+            delivery.add_block_callback(chain_id, callback)
+            if name == "read per block (before)":
+
+                def block_notify(chain_id: bytes, dots: List[Dot]) -> None:
+                    for dot in dots:
+                        callback(load_block(chain_id, dot))
+
+                dbms.add_observer(chain_id, block_notify)
+                report(name + ", persist", num_blocks, measure(persist, dbms, blocks))
+            elif name == "decoded":
+
+                def block_notify(chain_id: bytes, dots: List[Dot]) -> None:
+                    delivery.put(chain_id, dots)
+                    delivery.deliver(chain_id)
+
+                dbms.add_observer(chain_id, block_notify)
+                report(
+                    name + ", persist",
+                    num_blocks,
+                    measure(persist, dbms, blocks, delivery),
+                )
+            else:
+                dbms.add_observer(chain_id, delivery.put)
+                report(
+                    name + ", persist",
+                    num_blocks,
+                    measure(persist, dbms, blocks, delivery),
+                )
+                report(
+                    name + ", deliver",
+                    num_blocks,
+                    measure(delivery.deliver, chain_id),
+                )
+            dbms.close()
+
+
+def main(num_blocks: int = 10_000, subscriber_us: int = 100) -> None:
+    run(num_blocks, subscriber_us / 10**6)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
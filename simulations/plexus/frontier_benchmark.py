@@ -0,0 +1,115 @@
+"""
+Frontier wire format benchmark for a node gossiping 1000 chains.
+
+Every gossip round the node sends the frontier of each chain to a peer, while a fraction of
+the chains grow. Compares, per frontier message, the size and the encoding plus decoding
+time of:
+ - the msgpack encoding used before the compact format,
+ - the compact format with full frontiers,
+ - the compact format with deltas to the frontier sent in the previous round.
+
+Usage: python -m simulations.plexus.frontier_benchmark [num_chains] [num_rounds]
+"""
+from hashlib import sha256
+import random
+import sys
+from typing import List
+
+from bami.plexus.backbone.datastore.frontiers import Frontier
+from bami.plexus.backbone.utils import decode_raw, encode_raw, Links, Ranges, shorten
+from simulations.plexus.utils import measure, report
+
+# Fraction of the chains that get new blocks between two gossip rounds
+ACTIVE_FRACTION = 0.05
+
+
+def random_dot(rnd: random.Random, seq_num: int):
+    return seq_num, shorten(sha256(rnd.getrandbits(64).to_bytes(8, "big")).digest())
+
+
+def create_frontier(rnd: random.Random) -> Frontier:
+    """Frontier of a chain with a few forks, and possibly holes and inconsistencies"""
+    max_seq = rnd.randint(10, 10**6)
+    terminal = [random_dot(rnd, max_seq - i) for i in range(rnd.randint(1, 3))]
+    holes = []
+    inconsistencies = []
+    if rnd.random() < 0.2:
+        start = rnd.randint(1, max_seq - 5)
+        holes.append((start, start + rnd.randint(0, 3)))
+        inconsistencies.append(random_dot(rnd, start - 1))
+    return Frontier(
+        Links(tuple(sorted(terminal))),
+        Ranges(tuple(holes)),
+        Links(tuple(inconsistencies)),
+    )
+
+
+def grow(rnd: random.Random, frontier: Frontier) -> Frontier:
+    """Frontier after new blocks are added on top of the chain"""
+    max_seq = max(frontier.terminal)[0] + rnd.randint(1, 10)
+    return Frontier(
+        Links((random_dot(rnd, max_seq),)), frontier.holes, frontier.inconsistencies
+    )
+
+
+def create_rounds(num_chains: int, num_rounds: int) -> List[List[Frontier]]:
+    rnd = random.Random(42)
+    frontiers = [create_frontier(rnd) for _ in range(num_chains)]
+    rounds = [frontiers]
+    for _ in range(num_rounds - 1):
+        frontiers = [
+            grow(rnd, f) if rnd.random() < ACTIVE_FRACTION else f for f in frontiers
+        ]
+        rounds.append(frontiers)
+    return rounds
+
+
+def legacy_round_trip(rounds: List[List[Frontier]], sizes: List[int]) -> None:
+    for frontiers in rounds:
+        for f in frontiers:
+            raw = encode_raw({b"t": f.terminal, b"h": f.holes, b"i": f.inconsistencies})
+            front_dict = decode_raw(raw)
+            Frontier(front_dict[b"t"], front_dict[b"h"], front_dict[b"i"])
+            sizes.append(len(raw))
+
+
+def full_round_trip(rounds: List[List[Frontier]], sizes: List[int]) -> None:
+    for frontiers in rounds:
+        for f in frontiers:
+            raw = f.to_bytes()
+            Frontier.from_bytes(raw)
+            sizes.append(len(raw))
+
+
+def delta_round_trip(rounds: List[List[Frontier]], sizes: List[int]) -> None:
+    sent = rounds[0]
+    received = [Frontier.from_bytes(f.to_bytes()) for f in sent]
+    for frontiers in rounds[1:]:
+        for i, f in enumerate(frontiers):
+            raw = f.to_bytes(sent[i])
+            received[i] = Frontier.from_bytes(raw, received[i])
+            sizes.append(len(raw))
+        sent = frontiers
+
+
+def main(num_chains: int = 1000, num_rounds: int = 20) -> None:
+    rounds = create_rounds(num_chains, num_rounds)
+    for name, round_trip in (
+        ("msgpack (before)", legacy_round_trip),
+        ("compact, full", full_round_trip),
+        ("compact, delta", delta_round_trip),
+    ):
+        sizes = []
+        elapsed = measure(round_trip, rounds, sizes)
+        report(name, len(sizes), elapsed, "msgs")
+        print(
+            "{name:<40} {size:>9.1f} bytes/msg {total:>9} bytes/round".format(
+                name="",
+                size=sum(sizes) / len(sizes),
+                total=sum(sizes) * num_chains // len(sizes),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,88 @@
+"""
+Frontier gossip simulation of bundled gossip against a packet per chain and peer.
+
+A node is member of num_subcoms sub-communities, each with a community chain and a witness
+chain. Every gossip round, the frontier of each chain is sent to fanout peers sampled from
+the members of its sub-community, which are drawn from a shared pool of peers. Reports,
+for one round, the number of signed packets and the bytes sent, including the IPv8 headers
+and signatures, and the time spent signing the packets.
+
+Usage: python -m simulations.plexus.frontier_bundle_simulation [num_subcoms] [num_peers]
+"""
+import random
+import sys
+from typing import Dict, List, Tuple
+
+from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.messaging.serialization import default_serializer
+
+from bami.plexus.backbone.datastore.frontiers import Frontier
+from bami.plexus.backbone.gossip import bundle_frontiers
+from bami.plexus.backbone.payload import FrontierPayload, MultiFrontierPayload
+from bami.plexus.backbone.settings import BamiSettings
+from simulations.plexus.utils import measure
+
+SUBCOM_SIZE = 30
+# Community prefix, message id, public key, global time and signature of a signed packet
+SIGNED_HEADER = 22 + 1 + 2 + 74 + 8 + 64
+
+
+def gossip_round(
+    num_subcoms: int, num_peers: int, seed: int = 42
+) -> Dict[int, List[Tuple[bytes, bytes]]]:
+    """The (chain_id, frontier) pairs sent to each peer in one round"""
+    rng = random.Random(seed)
+    fanout = BamiSettings().frontier_gossip_fanout
+    peer_frontiers = {}
+    for _ in range(num_subcoms):
+        subcom_id = default_eccrypto.generate_key("curve25519").pub().key_to_bin()
+        members = rng.sample(range(num_peers), SUBCOM_SIZE)
+        seq_num = rng.randint(1, 10_000)
+        frontier = Frontier(((seq_num, rng.randbytes(8)),), (), ()).to_bytes()
+        for chain_id in (subcom_id, b"w" + subcom_id):
+            for peer in rng.sample(members, fanout):
+                peer_frontiers.setdefault(peer, []).append((chain_id, frontier))
+    return peer_frontiers
+
+
+def sign_all(key, packets: List[bytes]) -> None:
+    for packet in packets:
+        key.signature(packet)
+
+
+def main(num_subcoms: int = 200, num_peers: int = 300) -> None:
+    peer_frontiers = gossip_round(num_subcoms, num_peers)
+    max_bytes = BamiSettings().frontier_bundle_max_bytes
+    per_chain = [
+        default_serializer.pack_serializable(FrontierPayload(chain_id, frontier))
+        for frontiers in peer_frontiers.values()
+        for chain_id, frontier in frontiers
+    ]
+    bundled = [
+        default_serializer.pack_serializable(MultiFrontierPayload(bundle))
+        for frontiers in peer_frontiers.values()
+        for bundle in bundle_frontiers(frontiers, max_bytes)
+    ]
+    key = default_eccrypto.generate_key("curve25519")
+    print(
+        "{} chains, {} peers, {} frontiers sent per round".format(
+            2 * num_subcoms, num_peers, len(per_chain)
+        )
+    )
+    for name, packets in (
+        ("packet per chain (before)", per_chain),
+        ("bundled", bundled),
+    ):
+        print(
+            "{name:<30} {num:>7} packets/signatures {size:>10} bytes "
+            "{elapsed:>8.3f} s signing".format(
+                name=name,
+                num=len(packets),
+                size=sum(len(p) + SIGNED_HEADER for p in packets),
+                elapsed=measure(sign_all, key, packets),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
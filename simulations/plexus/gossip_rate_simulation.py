@@ -0,0 +1,109 @@
+"""
+Frontier gossip simulation of the adaptive gossip rate against the fixed schedule.
+
+Nodes share one community chain and learn its blocks only through frontier gossip. Every
+tick, each node that is due sends its frontier to fanout random peers. A peer that is
+behind requests the missing blocks, and responds with its own frontier. Blocks are created
+in bursts separated by idle periods. Reports, for the fixed schedule and the adaptive rate
+of the GossipController, the frontier messages sent per node and second, and the time for
+a block to reach all nodes. The adaptive rate is enabled in a community with the
+frontier_gossip_adaptive setting.
+
+Usage: python -m simulations.plexus.gossip_rate_simulation [num_nodes] [duration]
+"""
+import random
+import sys
+from typing import Dict, List
+
+from bami.plexus.backbone.datastore.frontiers import Frontier
+from bami.plexus.backbone.gossip import GossipController
+
+CHAIN_ID = b"chain"
+TICK = 0.5
+BURST = 30
+IDLE = 120
+# Probability that a block is created during a tick of a burst
+BLOCK_RATE = 0.5
+
+
+class Node(object):
+    def __init__(self, controller: GossipController) -> None:
+        self.controller = controller
+        self.controller.add_chain(CHAIN_ID)
+        self.known = 0
+
+    @property
+    def frontier(self) -> Frontier:
+        return Frontier(((self.known, self.known.to_bytes(8, "big")),), (), ())
+
+    def add_blocks(self, seq_num: int) -> None:
+        if seq_num > self.known:
+            self.known = seq_num
+            self.controller.on_activity(CHAIN_ID)
+
+
+def simulate(
+    num_nodes: int, duration: int, adaptive: bool, seed: int = 42
+) -> Dict[str, float]:
+    rng = random.Random(seed)
+    # Same workload for both schedules
+    workload = random.Random(seed)
+    if adaptive:
+        nodes = [Node(GossipController(TICK)) for _ in range(num_nodes)]
+    else:
+        nodes = [Node(GossipController(TICK, TICK, 1, 6, 6)) for _ in range(num_nodes)]
+    created: List[float] = []
+    converged: Dict[int, float] = {}
+    messages = 0
+
+    for step in range(int(duration / TICK)):
+        now = step * TICK
+        if now % (BURST + IDLE) < BURST and workload.random() < BLOCK_RATE:
+            created.append(now)
+            workload.choice(nodes).add_blocks(len(created))
+
+        # Blocks requested in this tick arrive in the next one
+        arrivals = []
+        for node in nodes:
+            if not node.controller.is_due(CHAIN_ID, now):
+                continue
+            frontier = node.frontier
+            fanout = node.controller.fanout(CHAIN_ID)
+            for peer in rng.sample([n for n in nodes if n is not node], fanout):
+                messages += 2
+                if peer.known < node.known:
+                    arrivals.append((peer, node.known))
+                    node.controller.on_activity(CHAIN_ID)
+                elif peer.known > node.known:
+                    arrivals.append((node, peer.known))
+                    peer.controller.on_activity(CHAIN_ID)
+            node.controller.on_round(CHAIN_ID, frontier, now)
+        for node, seq_num in arrivals:
+            node.add_blocks(seq_num)
+
+        min_known = min(node.known for node in nodes)
+        for seq_num in range(len(converged) + 1, min_known + 1):
+            converged[seq_num] = now + TICK - created[seq_num - 1]
+
+    times = sorted(converged.values())
+    return {
+        "blocks": len(created),
+        "converged": len(times),
+        "messages": messages / num_nodes / duration,
+        "mean": sum(times) / len(times) if times else float("nan"),
+        "p99": times[int(len(times) * 0.99)] if times else float("nan"),
+    }
+
+
+def main(num_nodes: int = 50, duration: int = 1500) -> None:
+    for name, adaptive in (("fixed (before)", False), ("adaptive", True)):
+        result = simulate(num_nodes, duration, adaptive)
+        print(
+            "{name:<20} {messages:>8.2f} frontiers/node/s "
+            "convergence mean {mean:>6.2f} s p99 {p99:>6.2f} s "
+            "({converged}/{blocks} blocks)".format(name=name, **result)
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
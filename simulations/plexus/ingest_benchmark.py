@@ -0,0 +1,111 @@
+"""
+Block ingestion benchmark for the Plexus DBManager with an LMDB block store.
+
+Compares the throughput of:
+ - one write transaction per block store call (how blocks were persisted before batching),
+ - one write transaction per block (DBManager.add_block),
+ - one write transaction per batch of blocks (DBManager.write_batch).
+
+Also compares the time and the peak memory allocated per block to decode a received block
+and pack it as the validation and the persistence do, when the block packs itself on every
+call (before) and when it reuses its wire bytes. Signature verification is left out.
+
+Usage: python -m simulations.plexus.ingest_benchmark [num_blocks] [batch_size]
+"""
+from functools import partial
+import sys
+import tempfile
+from typing import Any, List
+
+from ipv8.messaging.serialization import default_serializer
+
+from bami.plexus.backbone.block import PlexusBlock
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+from bami.plexus.backbone.datastore.chain_store import ChainFactory
+from bami.plexus.backbone.datastore.database import DBManager
+from bami.plexus.backbone.payload import BlockPayload
+from simulations.plexus.utils import (
+    create_community_blocks,
+    measure,
+    peak_allocation,
+    report,
+)
+
+
+class RepackingBlock(PlexusBlock):
+    """Block that packs itself on every call, as before the packed bytes were cached"""
+
+    def pack(self, signature: bool = True) -> bytes:
+        return self.serializer.pack_serializable(self.to_block_payload(signature))
+
+    @classmethod
+    def unpack(
+        cls, block_blob: bytes, serializer: Any = default_serializer
+    ) -> PlexusBlock:
+        payload, _ = serializer.unpack_serializable(BlockPayload, block_blob)
+        return cls.from_payload(payload, serializer)
+
+
+def receive(block_class, blobs: List[bytes]) -> None:
+    for blob in blobs:
+        block = block_class.unpack(blob)
+        # Packed by the invariants check, for the persisted blob, and by a duplicate check
+        block.pack(signature=False)
+        block.pack()
+        block == block
+
+
+def ingest_unbatched(dbms: DBManager, blocks: List[PlexusBlock]) -> None:
+    # Without an open batch every block store call commits its own transaction
+    for block in blocks:
+        dbms._add_block(block.pack(), block)
+
+
+def ingest_per_block(dbms: DBManager, blocks: List[PlexusBlock]) -> None:
+    for block in blocks:
+        dbms.add_block(block.pack(), block)
+
+
+def ingest_batched(dbms: DBManager, blocks: List[PlexusBlock], batch_size: int) -> None:
+    for i in range(0, len(blocks), batch_size):
+        with dbms.write_batch():
+            for block in blocks[i : i + batch_size]:
+                dbms.add_block(block.pack(), block)
+
+
+def run(name: str, ingest, blocks: List[PlexusBlock], *args) -> None:
+    with tempfile.TemporaryDirectory() as work_dir:
+        dbms = DBManager(ChainFactory(), LMDBLockStore(work_dir))
+        report(name, len(blocks), measure(ingest, dbms, blocks, *args))
+        dbms.close()
+
+
+def run_receive(name: str, block_class, blobs: List[bytes]) -> None:
+    elapsed = measure(receive, block_class, blobs)
+    report(name, len(blobs), elapsed)
+    print(
+        "{name:<40} {time:>9.2f} us/block {size:>9.1f} bytes allocated/block".format(
+            name="",
+            time=elapsed * 10**6 / len(blobs),
+            size=peak_allocation(partial(receive, block_class), blobs[:1000]),
+        )
+    )
+
+
+def main(num_blocks: int = 10_000, batch_size: int = 100) -> None:
+    blocks = create_community_blocks(num_blocks)
+    blobs = [block.pack() for block in blocks]
+    run_receive("receive, repack (before)", RepackingBlock, blobs)
+    run_receive("receive, reuse wire bytes", PlexusBlock, blobs)
+    run("transaction per store call (before)", ingest_unbatched, blocks)
+    run("transaction per block", ingest_per_block, blocks)
+    run(
+        "transaction per %d blocks" % batch_size,
+        ingest_batched,
+        blocks,
+        batch_size,
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,141 @@
+"""
+Block dissemination simulation of multi-hop push gossip against pull gossip alone.
+
+Nodes share one community chain. Blocks are created at random nodes, one per second, and
+reach the other nodes through push gossip and frontier gossip. Every gossip interval, a node
+sends its frontier to fanout random peers, and a peer that is behind requests the missing
+blocks. A pushed block is sent to push_gossip_fanout peers and, while its ttl is above 1,
+relayed once by every node that receives it to peers other than the sender. Every message
+takes a random network latency. Reports, for pull gossip alone and for push gossip with
+growing ttl, the latency percentiles for a block to reach a node, and the block messages
+sent per block.
+
+Usage: python -m simulations.plexus.push_relay_simulation [num_nodes] [num_blocks]
+"""
+import heapq
+import random
+import sys
+from typing import Dict, List, Optional, Set
+
+from bami.plexus.backbone.settings import BamiSettings
+
+LATENCY = (0.02, 0.1)
+# Time to gossip after the last block is created
+TAIL = 30
+
+
+class Simulation(object):
+    def __init__(self, num_nodes: int, ttl: Optional[int], seed: int = 42) -> None:
+        settings = BamiSettings()
+        self.rng = random.Random(seed)
+        self.num_nodes = num_nodes
+        # Ttl of the pushed blocks, or None for pull gossip alone
+        self.ttl = ttl
+        self.push_fanout = settings.push_gossip_fanout
+        self.frontier_fanout = settings.frontier_gossip_fanout
+        self.interval = settings.frontier_gossip_interval
+        self.known: List[Set[int]] = [set() for _ in range(num_nodes)]
+        self.relayed: List[Set[int]] = [set() for _ in range(num_nodes)]
+        self.created: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.block_messages = 0
+        self.events = []
+        self.counter = 0
+
+    def schedule(self, at: float, action, *args) -> None:
+        self.counter += 1
+        heapq.heappush(self.events, (at, self.counter, action, args))
+
+    def send(self, now: float, action, *args) -> None:
+        self.schedule(now + self.rng.uniform(*LATENCY), action, *args)
+
+    def sample_peers(self, node: int, fanout: int, exclude: int = None) -> List[int]:
+        peers = [p for p in range(self.num_nodes) if p != node and p != exclude]
+        return self.rng.sample(peers, min(fanout, len(peers)))
+
+    def deliver(self, now: float, node: int, block: int) -> bool:
+        if block in self.known[node]:
+            return False
+        self.known[node].add(block)
+        self.latencies.append(now - self.created[block])
+        return True
+
+    def create_block(self, now: float, block: int) -> None:
+        node = self.rng.randrange(self.num_nodes)
+        self.created[block] = now
+        self.known[node].add(block)
+        if self.ttl is not None:
+            self.relayed[node].add(block)
+            self.push(now, node, block, self.ttl, None)
+
+    def push(self, now: float, node: int, block: int, ttl: int, sender: int) -> None:
+        for peer in self.sample_peers(node, self.push_fanout, sender):
+            self.block_messages += 1
+            self.send(now, self.received_push, peer, block, ttl, node)
+
+    def received_push(
+        self, now: float, node: int, block: int, ttl: int, sender: int
+    ) -> None:
+        self.deliver(now, node, block)
+        if ttl > 1 and block not in self.relayed[node]:
+            self.relayed[node].add(block)
+            self.push(now, node, block, ttl - 1, sender)
+
+    def gossip_round(self, now: float, node: int) -> None:
+        for peer in self.sample_peers(node, self.frontier_fanout):
+            self.send(now, self.received_frontier, peer, node, set(self.known[node]))
+        self.schedule(now + self.interval, self.gossip_round, node)
+
+    def received_frontier(
+        self, now: float, node: int, sender: int, frontier: Set[int]
+    ) -> None:
+        missing = frontier - self.known[node]
+        if missing:
+            # Block request, and the blocks in response
+            self.block_messages += len(missing)
+            delay = self.rng.uniform(*LATENCY) + self.rng.uniform(*LATENCY)
+            for block in missing:
+                self.schedule(now + delay, self.received_pulled, node, block)
+
+    def received_pulled(self, now: float, node: int, block: int) -> None:
+        self.deliver(now, node, block)
+
+    def run(self, num_blocks: int) -> Dict[str, float]:
+        for node in range(self.num_nodes):
+            self.schedule(self.rng.uniform(0, self.interval), self.gossip_round, node)
+        for block in range(num_blocks):
+            self.schedule(block + 1.0, self.create_block, block)
+        end = num_blocks + TAIL
+        while self.events and self.events[0][0] < end:
+            now, _, action, args = heapq.heappop(self.events)
+            action(now, *args)
+
+        times = sorted(self.latencies)
+        expected = num_blocks * (self.num_nodes - 1)
+        return {
+            "delivered": 100 * len(times) / expected,
+            "p50": times[len(times) // 2],
+            "p90": times[int(len(times) * 0.9)],
+            "p99": times[int(len(times) * 0.99)],
+            "messages": self.block_messages / num_blocks,
+        }
+
+
+def main(num_nodes: int = 200, num_blocks: int = 60) -> None:
+    for name, ttl in (
+        ("pull only", None),
+        ("push ttl 1 (before)", 1),
+        ("push ttl 2", 2),
+        ("push ttl 3", 3),
+    ):
+        result = Simulation(num_nodes, ttl).run(num_blocks)
+        print(
+            "{name:<20} latency p50 {p50:>6.3f} s p90 {p90:>6.3f} s p99 {p99:>6.3f} s "
+            "{messages:>8.1f} block msgs/block ({delivered:.1f}% delivered)".format(
+                name=name, **result
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
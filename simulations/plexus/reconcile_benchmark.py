@@ -0,0 +1,96 @@
+"""
+Frontier reconciliation micro-benchmark for the in-memory Chain.
+
+Measures Chain.reconcile against the frontier of a peer that is in sync, and of a peer
+that has one hole, for chain lengths from 10^3 to 10^7. The chain history below the tip
+is not inserted block by block: reconciliation only reads the holes and the blocks near
+the frontier, so the chains are built with the state of a fully inserted chain at the tip.
+For comparison, the missing sequence numbers are also computed with int sets, as
+reconcile did before.
+
+Usage: python -m simulations.plexus.reconcile_benchmark [repeat] [chain_length ...]
+"""
+from hashlib import sha256
+import sys
+
+from bami.plexus.backbone.datastore.chain_store import Chain
+from bami.plexus.backbone.datastore.frontiers import Frontier
+from bami.plexus.backbone.utils import (
+    expand_ranges,
+    GENESIS_LINK,
+    Links,
+    ranges,
+    Ranges,
+    shorten,
+)
+from simulations.plexus.utils import measure, report
+
+TIP_LENGTH = 10
+
+
+def seq_hash(seq_num: int) -> bytes:
+    return sha256(seq_num.to_bytes(8, "big")).digest()
+
+
+def create_chain(length: int) -> Chain:
+    """Linear chain of the given length, with only the last blocks inserted"""
+    chain = Chain()
+    base_seq = max(length - TIP_LENGTH, 1)
+    base_dot = (base_seq, shorten(seq_hash(base_seq)))
+    # Consistent base block, as if all blocks before it were inserted
+    chain.versions[base_seq] = {base_dot[1]}
+    chain.back_pointers[base_dot] = GENESIS_LINK
+    chain.max_known_seq_num = base_seq
+    chain.terminal_dots = {base_dot}
+    chain.const_terminal_dots = {base_dot}
+
+    links = Links((base_dot,))
+    for seq_num in range(base_seq + 1, length + 1):
+        chain.add_block(links, seq_num, seq_hash(seq_num))
+        links = Links(((seq_num, shorten(seq_hash(seq_num))),))
+    return chain
+
+
+def set_missing(chain: Chain, frontier: Frontier) -> Ranges:
+    """Missing sequence numbers computed by materialising int sets"""
+    f_holes = set(expand_ranges(frontier.holes))
+    max_term_seq = max(frontier.terminal)[0]
+    front_known_seq = set(range(1, max_term_seq + 1)) - f_holes
+    peer_known_seq = set(range(1, chain.max_known_seq_num + 1)) - set(chain.holes)
+    return ranges(front_known_seq - peer_known_seq)
+
+
+def repeat(func, num: int, *args) -> None:
+    for _ in range(num):
+        func(*args)
+
+
+def main(num_repeat: int = 1000, *lengths: int) -> None:
+    for length in lengths or (10**3, 10**4, 10**5, 10**6, 10**7):
+        chain = create_chain(length)
+        in_sync = chain.frontier
+        one_hole = Frontier(in_sync.terminal, Ranges(((length // 2, length // 2),)), ())
+        assert chain.reconcile(in_sync).is_empty()
+
+        name = "reconcile, in sync, len %d" % length
+        report(
+            name,
+            num_repeat,
+            measure(repeat, chain.reconcile, num_repeat, in_sync),
+            "calls",
+        )
+        name = "reconcile, peer hole, len %d" % length
+        report(
+            name,
+            num_repeat,
+            measure(repeat, chain.reconcile, num_repeat, one_hole),
+            "calls",
+        )
+        if length <= 10**6:
+            # Too slow and memory hungry beyond
+            name = "int sets (before), len %d" % length
+            report(name, 1, measure(set_missing, chain, in_sync), "calls")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
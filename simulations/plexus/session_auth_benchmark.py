@@ -0,0 +1,121 @@
+"""
+Authentication benchmark of the gossip messages: signatures against session key MACs.
+
+Packs, authenticates and checks frontier and pulled block messages, as they are sent and
+received: with a curve25519 signature of the sender (before), and with the MAC of the
+session key the sender negotiated with the receiver.
+
+Usage: python -m simulations.plexus.session_auth_benchmark [num_messages]
+"""
+import hmac
+import sys
+from typing import List
+
+from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.messaging.payload_headers import BinMemberAuthenticationPayload
+from ipv8.messaging.serialization import default_serializer
+from ipv8.peer import Peer
+
+from bami.plexus.backbone.datastore.frontiers import Frontier
+from bami.plexus.backbone.payload import (
+    FrontierPayload,
+    RawBlockPayload,
+    SessionPacketPayload,
+)
+from bami.plexus.backbone.session import MAC_SIZE, SessionKeys
+from simulations.plexus.utils import create_community_blocks, measure, report
+
+PREFIX = b"\x00" * 22
+
+
+def signed_round_trip(sender: Peer, payloads: List) -> None:
+    auth = BinMemberAuthenticationPayload(sender.public_key.key_to_bin())
+    for payload in payloads:
+        packet = (
+            PREFIX
+            + bytes([payload.msg_id])
+            + default_serializer.pack_serializable_list((auth, payload))
+        )
+        packet += default_eccrypto.create_signature(sender.key, packet)
+        # Receiver
+        signature_length = sender.public_key.get_signature_length()
+        assert default_eccrypto.is_valid_signature(
+            sender.public_key, packet[:-signature_length], packet[-signature_length:]
+        )
+
+
+def session_round_trip(
+    sender: Peer,
+    receiver: Peer,
+    sender_keys: SessionKeys,
+    receiver_keys: SessionKeys,
+    payloads: List,
+) -> None:
+    key = sender_keys.get_send_key(receiver, 0)
+    for payload in payloads:
+        packet = (
+            PREFIX
+            + bytes([SessionPacketPayload.msg_id])
+            + default_serializer.pack_serializable(
+                SessionPacketPayload(
+                    sender.mid,
+                    sender_keys.next_counter(receiver),
+                    payload.msg_id,
+                    default_serializer.pack_serializable(payload),
+                )
+            )
+        )
+        packet += SessionKeys.mac(key, packet)
+        # Receiver
+        _, receive_key, window = receiver_keys.get_receive_key(sender.mid)
+        assert hmac.compare_digest(
+            SessionKeys.mac(receive_key, packet[:-MAC_SIZE]), packet[-MAC_SIZE:]
+        )
+        assert window.accept(
+            default_serializer.unpack_serializable(
+                SessionPacketPayload, packet, offset=len(PREFIX) + 1
+            )[0].counter
+        )
+
+
+def main(num_messages: int = 10_000) -> None:
+    sender = Peer(default_eccrypto.generate_key("curve25519"))
+    receiver = Peer(default_eccrypto.generate_key("curve25519"))
+    sender_keys, receiver_keys = SessionKeys(sender.key), SessionKeys(receiver.key)
+    nonce = sender_keys.start(receiver, 0)
+    receiver_keys.accept(sender, nonce, 0, 0)
+    sender_keys.complete(receiver, nonce, 0)
+
+    chain_id = receiver.public_key.key_to_bin()
+    frontier = Frontier(((1000, b"12345678"),), ((10, 12),), ()).to_bytes()
+    blocks = create_community_blocks(100)
+    for name, payloads in (
+        ("frontier", [FrontierPayload(chain_id, frontier)] * num_messages),
+        (
+            "pulled block",
+            [RawBlockPayload(blocks[i % 100].pack()) for i in range(num_messages)],
+        ),
+    ):
+        report(
+            name + ", signature (before)",
+            num_messages,
+            measure(signed_round_trip, sender, payloads),
+            "msgs",
+        )
+        report(
+            name + ", session MAC",
+            num_messages,
+            measure(
+                session_round_trip,
+                sender,
+                receiver,
+                sender_keys,
+                receiver_keys,
+                payloads,
+            ),
+            "msgs",
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
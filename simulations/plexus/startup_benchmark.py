@@ -0,0 +1,72 @@
+"""
+Startup benchmark for the Plexus DBManager with an LMDB block store.
+
+Compares the time to construct a DBManager on an existing block store when:
+ - every stored block is replayed into the chains (how startup worked before checkpoints),
+ - the chains are restored from the checkpoint written on close,
+ - the chains are restored from the checkpoint and 1% of the blocks are added after it.
+
+Usage: python -m simulations.plexus.startup_benchmark [num_blocks ...]
+"""
+import sys
+import tempfile
+from typing import Optional, Tuple
+
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+from bami.plexus.backbone.datastore.chain_store import ChainFactory
+from bami.plexus.backbone.datastore.database import DBManager
+from simulations.plexus.utils import create_community_blocks, measure, report
+
+MAP_SIZE = 2**34
+BATCH_SIZE = 1000
+
+
+class ReplayBlockStore(LMDBLockStore):
+    """Block store that ignores the checkpoint, so that all blocks are replayed"""
+
+    def load_checkpoint(self) -> Optional[Tuple]:
+        return None
+
+
+def ingest(dbms: DBManager, blocks) -> None:
+    for i in range(0, len(blocks), BATCH_SIZE):
+        with dbms.write_batch():
+            for block in blocks[i : i + BATCH_SIZE]:
+                dbms.add_block(block.pack(), block)
+
+
+def fill_store(work_dir: str, num_blocks: int, num_after_checkpoint: int) -> None:
+    blocks = create_community_blocks(num_blocks)
+    last_checkpointed = num_blocks - num_after_checkpoint
+    dbms = DBManager(ChainFactory(), LMDBLockStore(work_dir, map_size=MAP_SIZE))
+    ingest(dbms, blocks[:last_checkpointed])
+    dbms.checkpoint()
+    ingest(dbms, blocks[last_checkpointed:])
+    # Close without a new checkpoint, as if the node stopped abruptly
+    dbms.block_store.close()
+
+
+def start(store_class, work_dir: str) -> None:
+    dbms = DBManager(ChainFactory(), store_class(work_dir, map_size=MAP_SIZE))
+    dbms.block_store.close()
+
+
+def main(*num_blocks: int) -> None:
+    for num in num_blocks or (100_000, 1_000_000):
+        with tempfile.TemporaryDirectory() as work_dir:
+            fill_store(work_dir, num, 0)
+            report(
+                "full replay (before)", num, measure(start, ReplayBlockStore, work_dir)
+            )
+            report("from checkpoint", num, measure(start, LMDBLockStore, work_dir))
+        with tempfile.TemporaryDirectory() as work_dir:
+            fill_store(work_dir, num, num // 100)
+            report(
+                "from checkpoint, 1% after it",
+                num,
+                measure(start, LMDBLockStore, work_dir),
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,144 @@
+"""
+Chain ingestion benchmark for the terminal node tracking.
+
+Compares the incremental terminal tracker of Chain with the recursive terminal
+calculation with a LRU cache of the previous implementation, for DAGs of shape:
+ - linear: every block links to the previous block,
+ - forked: blocks extend one of a few branches, which are merged from time to time,
+ - concurrent: many writers link to several random recent blocks.
+
+Usage: python -m simulations.plexus.terminal_benchmark [num_blocks]
+"""
+from hashlib import sha256
+import random
+import sys
+from typing import List, Set, Tuple
+
+import cachetools
+
+from bami.plexus.backbone.datastore.chain_store import Chain
+from bami.plexus.backbone.utils import Dot, GENESIS_DOT, Links, shorten
+from simulations.plexus.utils import measure, report
+
+BlockInfo = Tuple[Links, int, bytes]
+
+
+class TermCacheChain(Chain):
+    """Chain with the recursive terminal calculation used before the incremental tracker"""
+
+    def __init__(self, terminal_cache_size: int = 10_000, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.term_cache = cachetools.LRUCache(terminal_cache_size)
+
+    def _calc_cached_terminal(
+        self, current: Links, make_consistent_step: bool = False
+    ) -> Set[Dot]:
+        terminal = set()
+        for blk_link in current:
+            if blk_link not in self.forward_pointers:
+                terminal.add(blk_link)
+            else:
+                cached_next = self.term_cache.get(blk_link, default=None)
+                if cached_next:
+                    new_cache = None
+                    for cached_val in cached_next:
+                        if not make_consistent_step or cached_val[1]:
+                            term_next = self.get_next_links(cached_val[0])
+                            if not term_next:
+                                terminal.update({s[0] for s in cached_next})
+                            else:
+                                new_val = self._calc_cached_terminal(
+                                    term_next, make_consistent_step
+                                )
+                                if not new_cache:
+                                    new_cache = set()
+                                new_cache.update(
+                                    (dot, self._is_block_dot_consistent(dot))
+                                    for dot in new_val
+                                )
+                                terminal.update(new_val)
+                    if new_cache:
+                        self.term_cache[blk_link] = new_cache
+                else:
+                    next_blk = self.get_next_links(blk_link)
+                    new_term = self._calc_cached_terminal(
+                        next_blk, make_consistent_step
+                    )
+                    self.term_cache[blk_link] = {
+                        (dot, self._is_block_dot_consistent(dot)) for dot in new_term
+                    }
+                    terminal.update(new_term)
+        return terminal
+
+    def _update_terminal(
+        self,
+        block_dot: Dot,
+        block_links: Links,
+        block_consistent: bool,
+        new_consistent: List[Dot],
+    ) -> Set[Dot]:
+        if new_consistent:
+            last_dot = new_consistent[-1]
+            for dot in new_consistent[:-1]:
+                self.term_cache[Links((dot,))] = (Links((last_dot,)), True)
+        old_const_terminal = self.const_terminal_dots
+
+        new_term = self._calc_cached_terminal(Links((block_dot,)))
+        if block_consistent:
+            const_step = self._calc_cached_terminal(
+                self.consistent_terminal, make_consistent_step=True
+            )
+            const_step.update(new_term)
+            self.const_terminal_dots = const_step
+            self._const_terminal = None
+        new_term.update(self._calc_cached_terminal(self.terminal))
+        self.terminal_dots = new_term
+        self._terminal = None
+        return self.const_terminal_dots - old_const_terminal
+
+
+def create_dag(
+    num_blocks: int, num_tips: int, max_links: int, merge_prob: float = 1.0
+) -> List[BlockInfo]:
+    """Create blocks in topological order, each linking to random tips of the DAG.
+    A linked tip stays a tip, to be forked later, while there are less than num_tips tips."""
+    rnd = random.Random(42)
+    tips = [GENESIS_DOT]
+    blocks = []
+    for i in range(num_blocks):
+        num_links = 1
+        if rnd.random() < merge_prob:
+            num_links = rnd.randint(1, min(max_links, len(tips)))
+        links = sorted(rnd.sample(tips, num_links))
+        seq_num = max(links)[0] + 1
+        block_hash = sha256(i.to_bytes(8, "big")).digest()
+        for dot in links:
+            if len(tips) >= num_tips:
+                tips.remove(dot)
+        tips.append((seq_num, shorten(block_hash)))
+        blocks.append((Links(tuple(links)), seq_num, block_hash))
+    return blocks
+
+
+def ingest(chain: Chain, blocks: List[BlockInfo]) -> None:
+    for block_links, seq_num, block_hash in blocks:
+        chain.add_block(block_links, seq_num, block_hash)
+
+
+def main(num_blocks: int = 10_000) -> None:
+    shapes = {
+        "linear": create_dag(num_blocks, 1, 1),
+        "forked": create_dag(num_blocks, 4, 2, merge_prob=0.05),
+        "concurrent": create_dag(num_blocks, 64, 4),
+    }
+    for name, blocks in shapes.items():
+        report(
+            name + ", term cache (before)",
+            num_blocks,
+            measure(ingest, TermCacheChain(), blocks),
+        )
+        report(name + ", incremental", num_blocks, measure(ingest, Chain(), blocks))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
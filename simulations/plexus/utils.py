@@ -0,0 +1,87 @@
+import time
+import tracemalloc
+from typing import Any, Callable, List
+
+from ipv8.keyvault.crypto import default_eccrypto
+
+from bami.plexus.backbone.block import PlexusBlock
+from bami.plexus.backbone.utils import (
+    EMPTY_SIG,
+    encode_links,
+    encode_raw,
+    GENESIS_LINK,
+    Links,
+)
+
+
+def create_block(key, com_id: bytes, links: Links, previous: Links) -> PlexusBlock:
+    """Create a signed block that links to the given community and personal dots"""
+    block = PlexusBlock(
+        [
+            b"bench",
+            encode_raw({b"id": 42}),
+            key.pub().key_to_bin(),
+            max(previous)[0] + 1,
+            encode_links(previous),
+            encode_links(links),
+            b"",
+            com_id,
+            max(links)[0] + 1,
+            EMPTY_SIG,
+            int(time.time() * 1000),
+            0,
+        ]
+    )
+    block.sign(key)
+    return block
+
+
+def create_community_blocks(
+    num_blocks: int, num_authors: int = 10, com_id: bytes = None
+) -> List[PlexusBlock]:
+    """Create a linear community chain with blocks of num_authors round-robin authors"""
+    keys = [default_eccrypto.generate_key("curve25519") for _ in range(num_authors)]
+    if not com_id:
+        com_id = default_eccrypto.generate_key("curve25519").pub().key_to_bin()
+    last_personal = [GENESIS_LINK for _ in range(num_authors)]
+    last_com = GENESIS_LINK
+    blocks = []
+    for i in range(num_blocks):
+        author = i % num_authors
+        block = create_block(keys[author], com_id, last_com, last_personal[author])
+        last_com = Links((block.com_dot,))
+        last_personal[author] = Links((block.pers_dot,))
+        blocks.append(block)
+    return blocks
+
+
+def measure(func: Callable, *args, **kwargs) -> float:
+    """Run the function once and return the elapsed wall time in seconds"""
+    start_time = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start_time
+
+
+def peak_allocation(func: Callable[[List[Any]], Any], items: List[Any]) -> float:
+    """Average of the peak memory, in bytes, allocated to process one of the items"""
+    tracemalloc.start()
+    total = 0
+    for item in items:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func([item])
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return total / len(items)
+
+
+def report(name: str, num_items: int, elapsed: float, unit: str = "blocks") -> None:
+    print(
+        "{name:<40} {num:>9} {unit} {elapsed:>9.3f} s {rate:>12.1f} {unit}/s".format(
+            name=name,
+            num=num_items,
+            unit=unit,
+            elapsed=elapsed,
+            rate=num_items / elapsed if elapsed else float("inf"),
+        )
+    )
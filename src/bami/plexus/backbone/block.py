@@ -2,10 +2,12 @@ from __future__ import annotations
 
 from binascii import hexlify
 from collections import namedtuple
+from functools import cached_property
 from hashlib import sha256
 import logging
+import struct
 import time
-from typing import Any, List
+from typing import Any, List, Optional, Tuple, Union
 
 from ipv8.keyvault.crypto import default_eccrypto
 from ipv8.messaging.serialization import default_serializer, PackError
@@ -26,6 +28,43 @@ from bami.plexus.backbone.utils import (
 )
 from bami.plexus.backbone.payload import BlockPayload
 
+# Layout of a packed BlockPayload: None for a field with a ">I" length prefix,
+# else the struct format of the fixed size field
+BLOCK_LAYOUT = (
+    None,
+    None,
+    "74s",
+    ">I",
+    None,
+    None,
+    None,
+    "74s",
+    ">I",
+    "64s",
+    ">Q",
+)
+
+# Attributes packed in the block: setting one drops the cached packed bytes
+PACKED_ATTRIBUTES = frozenset(
+    {
+        "type",
+        "transaction",
+        "public_key",
+        "sequence_number",
+        "_previous",
+        "_links",
+        "com_prefix",
+        "com_id",
+        "com_seq_num",
+        "signature",
+        "timestamp",
+    }
+)
+
+# The signature is followed only by the timestamp in a packed block
+SIGNATURE_START = -struct.calcsize(BLOCK_LAYOUT[9]) - struct.calcsize(BLOCK_LAYOUT[10])
+SIGNATURE_END = -struct.calcsize(BLOCK_LAYOUT[10])
+
 SKIP_ATTRIBUTES = {
     "key",
     "serializer",
@@ -41,6 +80,30 @@ class PlexusBlock(object):
     Container for Bami block information
     """
 
+    __slots__ = (
+        "type",
+        "transaction",
+        "public_key",
+        "sequence_number",
+        "previous",
+        "_previous",
+        "links",
+        "_links",
+        "com_prefix",
+        "com_id",
+        "com_seq_num",
+        "timestamp",
+        "signature",
+        "insert_time",
+        "hash",
+        "serializer",
+        "_packed",
+        "_packed_unsigned",
+    )
+
+    crypto = default_eccrypto
+    _logger = logging.getLogger("PlexusBlock")
+
     Data = namedtuple(
         "Data",
         [
@@ -59,7 +122,12 @@ class PlexusBlock(object):
         ],
     )
 
-    def __init__(self, data: List = None, serializer=default_serializer) -> None:
+    def __init__(
+        self,
+        data: List = None,
+        serializer=default_serializer,
+        block_blob: Optional[bytes] = None,
+    ) -> None:
         """
         Create a new PlexusBlock or load from an existing database entry.
 
@@ -67,6 +135,8 @@ class PlexusBlock(object):
         :type data: Block.Data or list
         :param serializer: An optional custom serializer to use for this block.
         :type serializer: Serializer
+        :param block_blob: Optional packed data, if known, to reuse instead of packing again.
+        :type block_blob: bytes
         """
         super(PlexusBlock, self).__init__()
         self.serializer = serializer
@@ -137,9 +207,15 @@ class PlexusBlock(object):
                 else bytes(self.signature)
             )
 
+        self._packed = block_blob
+        self._packed_unsigned = None
         self.hash = self.calculate_hash()
-        self.crypto = default_eccrypto
-        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in PACKED_ATTRIBUTES:
+            object.__setattr__(self, "_packed", None)
+            object.__setattr__(self, "_packed_unsigned", None)
+        object.__setattr__(self, name, value)
 
     def __str__(self):
         # This makes debugging and logging easier
@@ -181,7 +257,7 @@ class PlexusBlock(object):
         return sha256(self.pack()).digest()
 
     def __eq__(self, other: object) -> bool:
-        if not isinstance(other, PlexusBlock):
+        if not isinstance(other, (PlexusBlock, PlexusBlockView)):
             return False
         return self.pack() == other.pack()
 
@@ -216,22 +292,37 @@ class PlexusBlock(object):
         Returns:
             Block bytes
         """
-        return self.serializer.pack_serializable(self.to_block_payload(signature))
+        if self._packed is None:
+            self._packed = self.serializer.pack_serializable(self.to_block_payload())
+        if signature:
+            return self._packed
+        if self._packed_unsigned is None:
+            self._packed_unsigned = (
+                self._packed[:SIGNATURE_START]
+                + EMPTY_SIG
+                + self._packed[SIGNATURE_END:]
+            )
+        return self._packed_unsigned
 
     @classmethod
     def unpack(
         cls, block_blob: bytes, serializer: Any = default_serializer
     ) -> PlexusBlock:
-        payload = serializer.unpack_serializable(BlockPayload, block_blob)
-        return PlexusBlock.from_payload(payload[0])
+        payload, size = serializer.unpack_serializable(BlockPayload, block_blob)
+        # Bytes after the block are not part of it, nor of its hash
+        return PlexusBlock.from_payload(payload, serializer, block_blob[:size])
 
     @classmethod
     def from_payload(
-        cls, payload: BlockPayload, serializer=default_serializer
+        cls,
+        payload: BlockPayload,
+        serializer=default_serializer,
+        block_blob: Optional[bytes] = None,
     ) -> PlexusBlock:
         """
         Create a block according to a given payload and serializer.
         This method can be used when receiving a block from the network.
+        The packed payload, if known, is reused instead of packing the block again.
         """
         return cls(
             [
@@ -249,6 +340,7 @@ class PlexusBlock(object):
                 time.time(),
             ],
             serializer,
+            block_blob,
         )
 
     def sign(self, key):
@@ -378,3 +470,165 @@ class PlexusBlock(object):
                 self._logger.error("Cannot pack the block, or signature is not valid")
                 return False
         return True
+
+
+class PlexusBlockView(object):
+    """
+    Read-only view of a packed block. Only the field offsets are parsed on creation,
+    every field is decoded on first access.
+    """
+
+    def __init__(
+        self,
+        block_blob: Union[bytes, memoryview],
+        block_hash: Optional[bytes] = None,
+        serializer=default_serializer,
+    ) -> None:
+        """
+        Args:
+            block_blob: The packed block. A memoryview must stay valid while the view is used.
+            block_hash: The hash of the block if known, such as the block store key
+            serializer: Serializer to use when the view is turned into a block
+        """
+        self._blob = memoryview(block_blob)
+        self._offsets = self.parse_offsets(self._blob)
+        if block_hash is not None:
+            self.hash = block_hash
+        self.serializer = serializer
+
+    @staticmethod
+    def parse_offsets(buffer: memoryview) -> Tuple[Tuple[int, int], ...]:
+        """Get the (start, end) offsets of the block fields in the buffer"""
+        offsets = []
+        pos = 0
+        try:
+            for fmt in BLOCK_LAYOUT:
+                if fmt is None:
+                    (size,) = struct.unpack_from(">I", buffer, pos)
+                    pos += 4
+                else:
+                    size = struct.calcsize(fmt)
+                offsets.append((pos, pos + size))
+                pos += size
+        except struct.error as e:
+            raise PackError("Block blob is truncated") from e
+        if pos > len(buffer):
+            raise PackError("Block blob is truncated")
+        return tuple(offsets)
+
+    def _field(self, index: int) -> bytes:
+        start, end = self._offsets[index]
+        return bytes(self._blob[start:end])
+
+    def _int_field(self, index: int) -> int:
+        return struct.unpack_from(
+            BLOCK_LAYOUT[index], self._blob, self._offsets[index][0]
+        )[0]
+
+    @cached_property
+    def type(self) -> bytes:
+        return self._field(0)
+
+    @cached_property
+    def transaction(self) -> bytes:
+        return self._field(1)
+
+    @cached_property
+    def public_key(self) -> bytes:
+        return self._field(2)
+
+    @cached_property
+    def sequence_number(self) -> int:
+        return self._int_field(3)
+
+    @cached_property
+    def _previous(self) -> BytesLinks:
+        return BytesLinks(self._field(4))
+
+    @cached_property
+    def previous(self) -> Links:
+        return decode_links(self._previous)
+
+    @cached_property
+    def _links(self) -> BytesLinks:
+        return BytesLinks(self._field(5))
+
+    @cached_property
+    def links(self) -> Links:
+        return decode_links(self._links)
+
+    @cached_property
+    def com_prefix(self) -> bytes:
+        return self._field(6)
+
+    @cached_property
+    def com_id(self) -> bytes:
+        return self._field(7)
+
+    @cached_property
+    def com_seq_num(self) -> int:
+        return self._int_field(8)
+
+    @cached_property
+    def signature(self) -> bytes:
+        return self._field(9)
+
+    @cached_property
+    def timestamp(self) -> int:
+        return self._int_field(10)
+
+    @cached_property
+    def hash(self) -> bytes:
+        # The blob is the packed block, no need to pack it again
+        return sha256(self._blob).digest()
+
+    insert_time = None
+
+    def __str__(self):
+        return str(self.to_block())
+
+    @property
+    def short_hash(self):
+        return shorten(self.hash)
+
+    def __hash__(self):
+        return self.hash_number
+
+    @property
+    def pers_dot(self) -> Dot:
+        return Dot((self.sequence_number, self.short_hash))
+
+    @property
+    def com_dot(self) -> Dot:
+        return Dot((self.com_seq_num, self.short_hash))
+
+    @property
+    def hash_number(self):
+        return int(hexlify(self.hash), 16) % 100000000
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, (PlexusBlock, PlexusBlockView)):
+            return False
+        return self.pack() == other.pack()
+
+    @property
+    def is_peer_genesis(self) -> bool:
+        return self.sequence_number == GENESIS_SEQ and self.previous == GENESIS_LINK
+
+    def block_args(self, signature: bool = True) -> List[Any]:
+        return self.to_block().block_args(signature)
+
+    def to_block_payload(self, signature: bool = True) -> BlockPayload:
+        return BlockPayload(*self.block_args(signature))
+
+    def pack(self, signature: bool = True) -> bytes:
+        if signature:
+            return bytes(self._blob)
+        return self.to_block().pack(signature)
+
+    def block_invariants_valid(self) -> bool:
+        return self.to_block().block_invariants_valid()
+
+    def to_block(self) -> PlexusBlock:
+        """Decode the full block"""
+        return PlexusBlock.unpack(bytes(self._blob), self.serializer)
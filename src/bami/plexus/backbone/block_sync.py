@@ -1,6 +1,9 @@
 from abc import ABCMeta, abstractmethod
-from typing import Union, Iterable, Optional
+from hashlib import sha256
+import random
+from typing import Union, Iterable, Optional, Tuple
 
+import cachetools
 from ipv8.lazy_community import lazy_wrapper
 from ipv8.peer import Peer
 from bami.plexus.backbone.block import PlexusBlock
@@ -8,7 +11,7 @@ from bami.plexus.backbone.community_routines import (
     CommunityRoutines,
     MessageStateMachine,
 )
-from bami.plexus.backbone.utils import Links, encode_raw
+from bami.plexus.backbone.utils import DuplicateFilter, Links, encode_raw
 from bami.plexus.backbone.exceptions import InvalidBlockException
 from bami.plexus.backbone.payload import (
     RawBlockBroadcastPayload,
@@ -16,10 +19,28 @@ from bami.plexus.backbone.payload import (
     RawBlockPayload,
     BlockPayload,
 )
+from bami.plexus.backbone.verification import BlockVerifier
 
 
 class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
+    PERSIST_PULLED_BLOCKS_TASK = "persist_pulled_blocks"
+    VERIFY_BLOCKS_TASK = "verify_blocks"
+
     def setup_messages(self) -> None:
+        # Blocks received with pull gossip that wait to be persisted in one batch
+        self.pending_pulled_blocks = []
+        # Blocks received with push gossip that wait for verification, in arrival order
+        self.pending_pushed_blocks = []
+        self.block_verifier = BlockVerifier(
+            self.settings.verification_workers, self.settings.verification_cache_size
+        )
+        # Hashes of the recently received blocks, to drop copies from other peers early
+        self.recent_blocks = DuplicateFilter(self.settings.duplicate_filter_size)
+        # Hashes of the broadcast blocks relayed recently, to relay each block only once
+        self.relayed_broadcasts = cachetools.TTLCache(
+            self.settings.push_gossip_seen_size, self.settings.push_gossip_seen_time
+        )
+
         self.add_message_handler(RawBlockPayload, self.received_raw_block)
         self.add_message_handler(BlockPayload, self.received_block)
         self.add_message_handler(
@@ -27,6 +48,9 @@ class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
         )
         self.add_message_handler(BlockBroadcastPayload, self.received_block_broadcast)
 
+    def unload_mixin(self) -> None:
+        self.block_verifier.close()
+
     def send_block(
         self, block: Union[PlexusBlock, bytes], peers: Iterable[Peer], ttl: int = 1
     ) -> None:
@@ -53,41 +77,132 @@ class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
         for p in peers:
             self.send_packet(p, packet)
 
+    def is_duplicate_block(self, block_hash: bytes, peer: Peer) -> bool:
+        """Check if the block was received recently, counting the duplicate if so"""
+        return self.recent_blocks.is_duplicate(block_hash, peer.mid)
+
+    def unpack_received_block(
+        self, block_bytes: bytes, peer: Peer
+    ) -> Optional[PlexusBlock]:
+        """Decode a received block, or return None if it is a recent duplicate.
+        The raw bytes are checked before decoding."""
+        if self.is_duplicate_block(sha256(block_bytes).digest(), peer):
+            return None
+        block = PlexusBlock.unpack(block_bytes, self.serializer)
+        self.recent_blocks.add(block.hash, block.com_prefix + block.com_id)
+        return block
+
+    def filter_received_block(self, block: PlexusBlock, peer: Peer) -> bool:
+        """Check that a decoded block is not a recent duplicate, and remember it"""
+        if self.is_duplicate_block(block.hash, peer):
+            return False
+        self.recent_blocks.add(block.hash, block.com_prefix + block.com_id)
+        return True
+
     @lazy_wrapper(RawBlockPayload)
     def received_raw_block(self, peer: Peer, payload: RawBlockPayload) -> None:
-        block = PlexusBlock.unpack(payload.block_bytes, self.serializer)
+        self.process_raw_block(peer, payload)
+
+    def process_raw_block(self, peer: Peer, payload: RawBlockPayload) -> None:
+        block = self.unpack_received_block(payload.block_bytes, peer)
+        if not block:
+            return
         self.logger.debug(
             "Received block from pull gossip %s from peer %s", block.com_dot, peer
         )
-        self.validate_persist_block(block, peer)
+        self.pending_pulled_blocks.append((block, peer))
+        if not self.is_pending_task_active(self.PERSIST_PULLED_BLOCKS_TASK):
+            self.register_task(
+                self.PERSIST_PULLED_BLOCKS_TASK, self.persist_pulled_blocks
+            )
+
+    async def persist_pulled_blocks(self) -> None:
+        """Verify and persist all blocks received with pull gossip since the last call,
+        in one write batch per verified batch"""
+        while self.pending_pulled_blocks:
+            blocks, self.pending_pulled_blocks = self.pending_pulled_blocks, []
+            await self.block_verifier.verify(block for block, _ in blocks)
+            self.validate_persist_blocks(blocks)
+
+    def queue_pushed_block(
+        self, block: PlexusBlock, peer: Peer, ttl: Optional[int] = None
+    ) -> None:
+        """Queue a block received with push gossip. It is persisted once verified,
+        in arrival order, and then processed as a broadcast if it has a ttl."""
+        self.pending_pushed_blocks.append((block, peer, ttl))
+        if not self.is_pending_task_active(self.VERIFY_BLOCKS_TASK):
+            self.register_task(self.VERIFY_BLOCKS_TASK, self.persist_pushed_blocks)
+
+    async def persist_pushed_blocks(self) -> None:
+        batch_size = self.settings.verification_batch_size
+        while self.pending_pushed_blocks:
+            blocks = self.pending_pushed_blocks[:batch_size]
+            del self.pending_pushed_blocks[:batch_size]
+            await self.block_verifier.verify(block for block, _, _ in blocks)
+            for block, peer, ttl in blocks:
+                try:
+                    self.validate_persist_block(block, peer)
+                except InvalidBlockException as e:
+                    self.logger.warning("Invalid block from %s: %s", peer, e)
+                    continue
+                except Exception as e:
+                    # Accept copies of the block later on
+                    self.recent_blocks.discard(block.hash)
+                    self.logger.warning("Failed to persist block from %s: %s", peer, e)
+                    continue
+                if ttl is not None:
+                    self.process_broadcast_block(block, ttl, peer)
 
     @lazy_wrapper(BlockPayload)
     def received_block(self, peer: Peer, payload: BlockPayload):
         block = PlexusBlock.from_payload(payload, self.serializer)
+        if not self.filter_received_block(block, peer):
+            return
         self.logger.debug(
             "Received block from push gossip %s from peer %s", block.com_dot, peer
         )
-        self.validate_persist_block(block, peer)
+        self.queue_pushed_block(block, peer)
 
     @lazy_wrapper(RawBlockBroadcastPayload)
     def received_raw_block_broadcast(
         self, peer: Peer, payload: RawBlockBroadcastPayload
     ) -> None:
-        block = PlexusBlock.unpack(payload.block_bytes, self.serializer)
-        self.validate_persist_block(block, peer)
-        self.process_broadcast_block(block, payload.ttl)
+        block = self.unpack_received_block(payload.block_bytes, peer)
+        if block:
+            self.queue_pushed_block(block, peer, payload.ttl)
 
     @lazy_wrapper(BlockBroadcastPayload)
     def received_block_broadcast(self, peer: Peer, payload: BlockBroadcastPayload):
         block = PlexusBlock.from_payload(payload, self.serializer)
-        self.validate_persist_block(block, peer)
-        self.process_broadcast_block(block, payload.ttl)
+        if self.filter_received_block(block, peer):
+            self.queue_pushed_block(block, peer, payload.ttl)
 
-    def process_broadcast_block(self, block: PlexusBlock, ttl: int):
-        """Process broadcast block and relay further"""
-        if block.hash not in self.relayed_broadcasts and ttl > 1:
-            # self.send_block(block, ttl=ttl - 1)
-            pass
+    def get_push_gossip_fanout(self, chain_id: bytes) -> int:
+        return self.settings.push_gossip_chain_fanout.get(
+            chain_id, self.settings.push_gossip_fanout
+        )
+
+    def get_relay_peers(self, block: PlexusBlock) -> Iterable[Peer]:
+        """The peers to relay a broadcast block to"""
+        return self.get_peers()
+
+    def mark_broadcast_relayed(self, block_hash: bytes) -> bool:
+        """Remember that the block was relayed. Returns False if it was relayed recently."""
+        if block_hash in self.relayed_broadcasts:
+            return False
+        self.relayed_broadcasts[block_hash] = True
+        return True
+
+    def process_broadcast_block(
+        self, block: PlexusBlock, ttl: int, peer: Peer = None
+    ) -> None:
+        """Relay a broadcast block with one hop less to fanout peers, other than the peer
+        it was received from. A block is relayed once, even if received from many peers."""
+        if ttl <= 1 or not self.mark_broadcast_relayed(block.hash):
+            return
+        peers = [p for p in self.get_relay_peers(block) if p != peer]
+        fanout = self.get_push_gossip_fanout(block.com_prefix + block.com_id)
+        self.send_block(block, random.sample(peers, min(fanout, len(peers))), ttl - 1)
 
     @abstractmethod
     def process_block_unordered(self, blk: PlexusBlock, peer: Peer) -> None:
@@ -110,6 +225,29 @@ class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
     def validate_persist_block(self, block: PlexusBlock, peer: Peer = None) -> bool:
         """
         Validate a block and if it's valid, persist it.
+        Returns:
+            True if the block is new and persisted, False if it is already known
+        Raises:
+            InvalidBlockException - if block is not valid
+        """
+        new_block = self.validate_new_block(block, peer)
+        if not new_block:
+            return False
+        if self.async_persistence:
+            self.register_anonymous_task(
+                "persist_block", self.async_persistence.add_block, *new_block
+            )
+        else:
+            self.persistence.add_block(*new_block)
+        return True
+
+    def validate_new_block(
+        self, block: PlexusBlock, peer: Peer = None
+    ) -> Optional[Tuple[bytes, PlexusBlock]]:
+        """
+        Validate a block and process it unordered if it is not known yet.
+        Returns:
+            Blob and block to persist, or None if the block is already persisted
         Raises:
             InvalidBlockException - if block is not valid
         """
@@ -120,30 +258,61 @@ class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
         )
         block_blob = block if type(block) is bytes else block.pack()
 
-        if not block.block_invariants_valid():
+        if not self.block_verifier.is_valid(block):
             # React on invalid block
             raise InvalidBlockException("Block invalid", str(block), peer)
-        else:
-            if not self.persistence.has_block(block.hash):
-                self.process_block_unordered(block, peer)
-                chain_id = block.com_id
-                prefix = block.com_prefix
-                if (
-                    self.persistence.get_chain(prefix + chain_id)
-                    and self.persistence.get_chain(prefix + chain_id).versions.get(
-                        block.com_seq_num
-                    )
-                    and block.short_hash
-                    in self.persistence.get_chain(prefix + chain_id).versions[
-                        block.com_seq_num
-                    ]
-                ):
-                    raise Exception(
-                        "Inconsisistency between block store and chain store",
-                        self.persistence.get_chain(prefix + chain_id).versions,
-                        block.com_dot,
-                    )
-                self.persistence.add_block(block_blob, block)
+        if self.persistence.has_block(block.hash) or (
+            self.async_persistence
+            and self.async_persistence.is_block_pending(block.hash)
+        ):
+            return None
+        self.process_block_unordered(block, peer)
+        chain_id = block.com_id
+        prefix = block.com_prefix
+        if (
+            self.persistence.get_chain(prefix + chain_id)
+            and self.persistence.get_chain(prefix + chain_id).versions.get(
+                block.com_seq_num
+            )
+            and block.short_hash
+            in self.persistence.get_chain(prefix + chain_id).versions[block.com_seq_num]
+        ):
+            raise Exception(
+                "Inconsisistency between block store and chain store",
+                self.persistence.get_chain(prefix + chain_id).versions,
+                block.com_dot,
+            )
+        return block_blob, block
+
+    def validate_persist_blocks(
+        self, blocks: Iterable[Tuple[PlexusBlock, Peer]]
+    ) -> None:
+        """
+        Validate blocks and persist the valid ones in a single batch, in any order.
+        A block that fails is logged and skipped, so it does not hold back the rest of the batch.
+        """
+        new_blocks = {}
+        for block, peer in blocks:
+            try:
+                new_block = self.validate_new_block(block, peer)
+            except InvalidBlockException as e:
+                self.logger.warning("Invalid block from %s: %s", peer, e)
+                continue
+            except Exception as e:
+                # Accept copies of the block later on
+                self.recent_blocks.discard(block.hash)
+                self.logger.warning("Failed to persist block from %s: %s", peer, e)
+                continue
+            if new_block and new_block[1].hash not in new_blocks:
+                new_blocks[new_block[1].hash] = new_block
+        if new_blocks and self.async_persistence:
+            self.register_anonymous_task(
+                "persist_blocks",
+                self.async_persistence.add_blocks,
+                list(new_blocks.values()),
+            )
+        elif new_blocks:
+            self.persistence.add_blocks(new_blocks.values())
 
     def create_signed_block(
         self,
@@ -183,5 +352,8 @@ class BlockSyncMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
             use_consistent_links=use_consistent_links,
         )
         block.sign(self.my_peer_key)
-        self.validate_persist_block(block, self.my_peer)
+        # Own blocks are persisted right away: the next block links to them
+        new_block = self.validate_new_block(block, self.my_peer)
+        if new_block:
+            self.persistence.add_block(*new_block)
         return block
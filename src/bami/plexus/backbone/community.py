@@ -6,21 +6,24 @@ from asyncio import (
     ensure_future,
     Future,
     iscoroutinefunction,
-    Queue,
     sleep,
     Task,
 )
 from binascii import hexlify, unhexlify
+from functools import partial
+from hashlib import sha256
 import random
 from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
 
-from bami.plexus.backbone.block import PlexusBlock
+from bami.plexus.backbone.block import PlexusBlock, PlexusBlockView
 from bami.plexus.backbone.block_sync import BlockSyncMixin
 from bami.plexus.backbone.community_routines import MessageStateMachine
+from bami.plexus.backbone.datastore.async_db import AsyncDB
 from bami.plexus.backbone.datastore.block_store import LMDBLockStore
-from bami.plexus.backbone.datastore.chain_store import ChainFactory
+from bami.plexus.backbone.datastore.chain_store import ChainFactory, LMDBChainFactory
 from bami.plexus.backbone.datastore.database import BaseDB, ChainTopic, DBManager
 from bami.plexus.backbone.datastore.frontiers import Frontier
+from bami.plexus.backbone.delivery import OrderedDelivery
 from bami.plexus.backbone.discovery import (
     RandomWalkDiscoveryStrategy,
     SubCommunityDiscoveryStrategy,
@@ -31,8 +34,19 @@ from bami.plexus.backbone.exceptions import (
     SubCommunityEmptyException,
     UnknownChainException,
 )
-from bami.plexus.backbone.gossip import SubComGossipMixin
-from bami.plexus.backbone.payload import SubscriptionsPayload
+from bami.plexus.backbone.gossip import (
+    FrontierScheduler,
+    GossipController,
+    SubComGossipMixin,
+)
+from bami.plexus.backbone.payload import (
+    BlocksRequestPayload,
+    FrontierPayload,
+    FrontierResponsePayload,
+    RawBlockPayload,
+    SubscriptionsPayload,
+)
+from bami.plexus.backbone.session import SessionAuthMixin
 from bami.plexus.backbone.settings import BamiSettings
 from bami.plexus.backbone.sub_community import (
     BaseSubCommunity,
@@ -62,6 +76,7 @@ class PlexusCommunity(
     BlockSyncMixin,
     SubComGossipMixin,
     SubCommunityMixin,
+    SessionAuthMixin,
     BaseSubCommunityFactory,
     metaclass=ABCMeta,
 ):
@@ -70,6 +85,7 @@ class PlexusCommunity(
     """
 
     community_id = unhexlify("5789fd5555d60c425694ac139d1d8d7ea37d009e")
+    DELIVER_BLOCKS_TASK = "deliver_blocks"
 
     async def flex_runner(
         self,
@@ -141,9 +157,26 @@ class PlexusCommunity(
         if not work_dir:
             work_dir = self.settings.work_directory
         if not db:
-            self._persistence = DBManager(ChainFactory(), LMDBLockStore(work_dir))
+            block_store = LMDBLockStore(work_dir)
+            if self.settings.on_disk_chains:
+                chain_factory = LMDBChainFactory(
+                    block_store, self.settings.chain_cache_size
+                )
+            else:
+                chain_factory = ChainFactory()
+            self._persistence = DBManager(
+                chain_factory,
+                block_store,
+                self.settings.blob_cache_size,
+                self.settings.block_indexes,
+            )
         else:
             self._persistence = db
+        self._async_persistence = (
+            AsyncDB(self._persistence, self.settings.persistence_readers)
+            if self.settings.async_persistence
+            else None
+        )
         if not max_peers:
             max_peers = self.settings.main_max_peers
         self._ipv8 = ipv8
@@ -162,8 +195,6 @@ class PlexusCommunity(
             "The Plexus community started with Public Key: %s",
             hexlify(self.my_peer.public_key.key_to_bin()),
         )
-        self.relayed_broadcasts = set()
-
         self.shutting_down = False
 
         # Sub-Communities logic
@@ -176,10 +207,32 @@ class PlexusCommunity(
 
         self.periodic_sync_lc = {}
 
-        self.incoming_frontier_queues = {}
-        self.processing_queue_tasks = {}
-
-        self.ordered_notifier = Notifier()
+        self._frontier_scheduler = FrontierScheduler()
+        if self.settings.frontier_gossip_adaptive:
+            self._gossip_controller = GossipController(
+                self.settings.frontier_gossip_interval,
+                self.settings.frontier_gossip_max_interval,
+                self.settings.frontier_gossip_backoff,
+                self.settings.frontier_gossip_min_fanout,
+                self.settings.frontier_gossip_fanout,
+            )
+        else:
+            # Fixed schedule: every interval, to the full fanout
+            self._gossip_controller = GossipController(
+                self.settings.frontier_gossip_interval,
+                self.settings.frontier_gossip_interval,
+                min_fanout=self.settings.frontier_gossip_fanout,
+                max_fanout=self.settings.frontier_gossip_fanout,
+            )
+        # Gossip the frontier of a chain sooner when it has new blocks
+        self.persistence.add_observer(ChainTopic.GROUP, self.on_new_chain_dots)
+        self._gossip_chains = {}
+
+        self.block_delivery = OrderedDelivery(
+            self.get_block_view_by_dot,
+            self.settings.block_delivery_cache_size,
+            self.settings.block_delivery_batch_size,
+        )
         self.unordered_notifier = Notifier()
 
         # Setup and add message handlers
@@ -192,6 +245,38 @@ class PlexusCommunity(
                 base.setup_mixin(self)
 
         self.add_message_handler(SubscriptionsPayload, self.received_peer_subs)
+        # Payloads that can be authenticated with a session key: frontiers are advisory, and
+        # blocks carry their own signature. Replaying them only repeats idempotent work.
+        self.add_session_handler(
+            FrontierPayload,
+            partial(self.process_frontier_payload, should_respond=True),
+        )
+        self.add_session_handler(
+            FrontierResponsePayload,
+            partial(self.process_frontier_payload, should_respond=False),
+        )
+        self.add_session_handler(BlocksRequestPayload, self.process_blocks_request)
+        self.add_session_handler(RawBlockPayload, self.process_raw_block)
+
+        if self.settings.frontier_gossip_bundled:
+            self.register_task(
+                "frontier_gossip_bundle",
+                self.frontier_gossip_bundle_task,
+                delay=random.random() * self.settings.frontier_gossip_sync_max_delay,
+                interval=self.settings.frontier_gossip_interval,
+            )
+        self.register_task(
+            "process_frontiers",
+            self.process_frontiers,
+            interval=self.settings.frontier_scheduler_interval,
+        )
+        self.register_task(
+            "checkpoint",
+            self.async_persistence.checkpoint
+            if self.async_persistence
+            else self.persistence.checkpoint,
+            interval=self.settings.checkpoint_interval,
+        )
 
     def create_subcom(self, *args, **kwargs) -> BaseSubCommunity:
         """
@@ -243,32 +328,92 @@ class PlexusCommunity(
     ) -> Tuple[bytes, PlexusBlock]:
         """Get blob and serialized block and by the chain_id and dot.
         Can raise DatabaseDesynchronizedException if no block found."""
-        blk_blob = self.persistence.get_block_blob_by_dot(chain_id, dot)
-        if not blk_blob:
+        blk_blob = self._get_block_blob_by_dot(chain_id, dot)
+        block = PlexusBlock.unpack(blk_blob, self.serializer)
+        return blk_blob, block
+
+    def _get_block_blob_by_dot(self, chain_id: bytes, dot: Dot) -> bytes:
+        return self._get_block_hash_and_blob_by_dot(chain_id, dot)[1]
+
+    def _get_block_hash_and_blob_by_dot(
+        self, chain_id: bytes, dot: Dot
+    ) -> Tuple[bytes, bytes]:
+        val = self.persistence.get_block_hash_and_blob_by_dot(chain_id, dot)
+        if not val:
             raise DatabaseDesynchronizedException(
                 "Block is not found in db: {chain_id}, {dot}".format(
                     chain_id=chain_id, dot=dot
                 )
             )
-        block = PlexusBlock.unpack(blk_blob, self.serializer)
-        return blk_blob, block
+        return val
 
     def get_block_by_dot(self, chain_id: bytes, dot: Dot) -> PlexusBlock:
         """Get block by the chain_id and dot. Can raise DatabaseDesynchronizedException"""
         return self.get_block_and_blob_by_dot(chain_id, dot)[1]
 
+    def get_block_view_by_dot(self, chain_id: bytes, dot: Dot) -> PlexusBlockView:
+        """Get a lazily decoded view of the block by the chain_id and dot.
+        Can raise DatabaseDesynchronizedException"""
+        block_hash, blk_blob = self._get_block_hash_and_blob_by_dot(chain_id, dot)
+        # The hash is the store key, it is not computed again from the blob
+        return PlexusBlockView(blk_blob, block_hash, serializer=self.serializer)
+
+    def validate_new_block(
+        self, block: PlexusBlock, peer: Peer = None
+    ) -> Optional[Tuple[bytes, PlexusBlock]]:
+        new_block = super().validate_new_block(block, peer)
+        if new_block:
+            # Delivered in order without decoding the block again
+            self.block_delivery.remember(new_block[1])
+        return new_block
+
     def block_notify(self, chain_id: bytes, dots: List[Dot]):
         self.logger.info("Processing dots %s on chain: %s", dots, chain_id)
-        for dot in dots:
-            block = self.get_block_by_dot(chain_id, dot)
-            self.ordered_notifier.notify(chain_id, block)
+        self.block_delivery.put(chain_id, dots)
+        if not self.settings.async_block_delivery:
+            self.block_delivery.deliver(chain_id)
+        elif not self.is_pending_task_active(self.DELIVER_BLOCKS_TASK):
+            self.register_task(self.DELIVER_BLOCKS_TASK, self.deliver_blocks)
+
+    async def deliver_blocks(self) -> None:
+        """Deliver the queued blocks of all chains, a batch per chain in turn, and let the
+        event loop run between the batches"""
+        batch_size = self.settings.block_delivery_batch_size
+        while True:
+            chain_ids = self.block_delivery.pending_chains()
+            if not chain_ids:
+                break
+            for chain_id in chain_ids:
+                try:
+                    self.block_delivery.deliver(chain_id, batch_size)
+                except Exception as e:
+                    self.logger.exception(
+                        "Failed to deliver blocks of %s: %s", chain_id, e
+                    )
+            await sleep(0)
+
+    def is_delivery_congested(self, chain_id: bytes) -> bool:
+        return (
+            self.block_delivery.backlog(chain_id)
+            >= self.settings.block_delivery_max_backlog
+        )
 
     def subscribe_in_order_block(
         self, topic: Union[bytes, ChainTopic], callback: Callable[[PlexusBlock], None]
     ):
         """Subscribe on block updates received in-order. Callable will receive the block."""
         self._persistence.add_unique_observer(topic, self.block_notify)
-        self.ordered_notifier.add_observer(topic, callback)
+        self.block_delivery.add_block_callback(topic, callback)
+
+    def subscribe_in_order_blocks(
+        self,
+        topic: Union[bytes, ChainTopic],
+        callback: Callable[[List[PlexusBlock]], None],
+    ):
+        """Subscribe on batches of block updates received in-order.
+        Callable will receive the list of blocks."""
+        self._persistence.add_unique_observer(topic, self.block_notify)
+        self.block_delivery.add_batch_callback(topic, callback)
 
     def subscribe_out_order_block(
         self, topic: Union[bytes, ChainTopic], callback: Callable[[PlexusBlock], None]
@@ -283,14 +428,12 @@ class PlexusCommunity(
                 terminal=Links((blk.com_dot,)), holes=(), inconsistencies=()
             )
             subcom_id = blk.com_prefix + blk.com_id
-            processing_queue = self.incoming_frontier_queue(subcom_id)
-            if not processing_queue:
+            if not self.frontier_scheduler.put(subcom_id, peer, frontier, True):
                 raise UnknownChainException(
                     "Cannot process block received block with unknown chain. {subcom_id}".format(
                         subcom_id=subcom_id
                     )
                 )
-            processing_queue.put_nowait((peer, frontier, True))
 
     # ---- Introduction handshakes => Exchange your subscriptions ----------------
     def create_introduction_request(
@@ -346,15 +489,15 @@ class PlexusCommunity(
             if "unload_mixin" in base.__dict__.keys():
                 base.unload_mixin(self)
 
-        for mid in self.processing_queue_tasks:
-            if not self.processing_queue_tasks[mid].done():
-                self.processing_queue_tasks[mid].cancel()
         for subcom_id in self.my_subscriptions:
             await self.my_subscriptions[subcom_id].unload()
         await super(PlexusCommunity, self).unload()
 
         # Close the persistence layer
-        self.persistence.close()
+        if self.async_persistence:
+            await self.async_persistence.close()
+        else:
+            self.persistence.close()
 
     @property
     def settings(self) -> BamiSettings:
@@ -364,11 +507,17 @@ class PlexusCommunity(
     def persistence(self) -> BaseDB:
         return self._persistence
 
+    @property
+    def async_persistence(self) -> Optional[AsyncDB]:
+        return self._async_persistence
+
     @property
     def my_pub_key_bin(self) -> bytes:
         return self.my_peer.public_key.key_to_bin()
 
     def send_packet(self, peer: Peer, packet: Any, sig: bool = True) -> None:
+        if sig and self.send_with_session(peer, packet):
+            return
         self.ez_send(peer, packet, sig=sig)
 
     @property
@@ -429,40 +578,51 @@ class PlexusCommunity(
         delay: Callable[[], float] = None,
         interval: Callable[[], float] = None,
     ) -> None:
+        """Start gossiping the frontier of the chain. Bundled gossip runs on its own
+        schedule: then delay and interval are not used."""
         full_com_id = prefix + subcom_id
         self.logger.debug("Starting gossip with frontiers on chain %s", full_com_id)
-        self.periodic_sync_lc[full_com_id] = self.register_flexible_task(
-            "gossip_sync_" + str(full_com_id),
-            self.frontier_gossip_sync_task,
-            subcom_id,
-            prefix,
-            delay=delay
-            if delay
-            else lambda: random.random()
-            * self._settings.frontier_gossip_sync_max_delay,
-            interval=interval
-            if interval
-            else lambda: self._settings.frontier_gossip_interval,
-        )
-        self.incoming_frontier_queues[full_com_id] = Queue()
-        self.processing_queue_tasks[full_com_id] = ensure_future(
-            self.process_frontier_queue(full_com_id)
-        )
+        if self._settings.frontier_gossip_bundled:
+            self.gossip_chains[full_com_id] = (subcom_id, prefix)
+        else:
+            self.periodic_sync_lc[full_com_id] = self.register_flexible_task(
+                "gossip_sync_" + str(full_com_id),
+                self.frontier_gossip_tick,
+                subcom_id,
+                prefix,
+                delay=delay
+                if delay
+                else lambda: random.random()
+                * self._settings.frontier_gossip_sync_max_delay,
+                interval=interval
+                if interval
+                else lambda: self._settings.frontier_gossip_interval,
+            )
+        self.frontier_scheduler.add_chain(full_com_id)
+        self.gossip_controller.add_chain(full_com_id)
+
+    @property
+    def frontier_scheduler(self) -> FrontierScheduler:
+        return self._frontier_scheduler
 
-    def incoming_frontier_queue(self, subcom_id: bytes) -> Optional[Queue]:
-        return self.incoming_frontier_queues.get(subcom_id)
+    @property
+    def gossip_controller(self) -> GossipController:
+        return self._gossip_controller
+
+    @property
+    def gossip_chains(self) -> Dict[bytes, Tuple[bytes, bytes]]:
+        return self._gossip_chains
 
     def get_peer_by_key(
         self, peer_key: bytes, subcom_id: bytes = None
     ) -> Optional[Peer]:
         if subcom_id:
-            subcom_peers = self.get_subcom(subcom_id).get_known_peers()
-            for peer in subcom_peers:
-                if peer.public_key.key_to_bin() == peer_key:
-                    return peer
-        for peer in self.get_peers():
-            if peer.public_key.key_to_bin() == peer_key:
+            peer = self.get_subcom(subcom_id).get_peer(peer_key)
+            if peer:
                 return peer
+        peer = self.network.get_verified_by_public_key_bin(peer_key)
+        if peer and self.community_id in self.network.get_services_for_peer(peer):
+            return peer
         return None
 
     def choose_community_peers(
@@ -471,6 +631,15 @@ class PlexusCommunity(
         rand = random.Random(current_seed)
         return rand.sample(com_peers, min(commitee_size, len(com_peers)))
 
+    def get_subcom_peers(self, subcom_id: Optional[bytes]) -> Iterable[Peer]:
+        """Known peers of the sub-community, or of the main community if not joined"""
+        if not subcom_id or not self.get_subcom(subcom_id):
+            return self.get_peers()
+        return self.get_subcom(subcom_id).get_known_peers()
+
+    def get_relay_peers(self, block: PlexusBlock) -> Iterable[Peer]:
+        return self.get_subcom_peers(block.com_id)
+
     def share_in_community(
         self,
         block: Union[PlexusBlock, bytes],
@@ -488,16 +657,18 @@ class PlexusCommunity(
             fanout: of the gossip, if not specified the default settings will be used
             seed: seed for the peers selection, if not specified a random value will be used
         """
-        if not subcom_id or not self.get_subcom(subcom_id):
-            subcom_peers = self.get_peers()
-        else:
-            subcom_peers = self.get_subcom(subcom_id).get_known_peers()
+        subcom_peers = self.get_subcom_peers(subcom_id)
         if not seed:
             seed = random.random()
         if not fanout:
-            fanout = self.settings.push_gossip_fanout
+            fanout = self.get_push_gossip_fanout(subcom_id or b"")
         if not ttl:
             ttl = self.settings.push_gossip_ttl
+        if ttl > 1:
+            # Do not relay the copies sent back by the peers
+            self.mark_broadcast_relayed(
+                sha256(block).digest() if type(block) is bytes else block.hash
+            )
         if subcom_peers:
             selected_peers = self.choose_community_peers(subcom_peers, seed, fanout)
             self.send_block(block, selected_peers, ttl)
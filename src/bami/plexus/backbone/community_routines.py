@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Callable, Type
+from typing import Callable, Optional, Type
 
+from bami.plexus.backbone.datastore.async_db import AsyncDB
 from bami.plexus.backbone.datastore.database import BaseDB
 from bami.plexus.backbone.settings import BamiSettings
 from ipv8.keyvault.keys import Key
@@ -27,6 +28,11 @@ class CommunityRoutines(ABC):
     def persistence(self) -> BaseDB:
         pass
 
+    @property
+    def async_persistence(self) -> Optional[AsyncDB]:
+        """Awaitable facade of the persistence, if the off-loop code paths are enabled"""
+        return None
+
     @property
     @abstractmethod
     def settings(self) -> BamiSettings:
@@ -0,0 +1,101 @@
+"""
+Awaitable facade of the persistence layer, to keep the block store I/O off the event loop.
+"""
+from asyncio import get_event_loop
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from bami.plexus.backbone.block import PlexusBlock
+from bami.plexus.backbone.datastore.database import BaseDB
+from bami.plexus.backbone.datastore.frontiers import FrontierDiff
+from bami.plexus.backbone.utils import Dot
+
+
+class AsyncDB:
+    """Run the operations of a BaseDB on a thread pool.
+
+    Reads of the block store run concurrently on the reader threads. Writes, and reads of
+    the chains, run one at a time on a single writer thread, in the order they are awaited.
+    The database serializes them with the writes still made directly on the event loop.
+    Notifications of the database are delivered on the thread of the event loop.
+    """
+
+    def __init__(self, db: BaseDB, num_readers: int = 4) -> None:
+        """
+        Args:
+            db: The database. Create the facade in the thread running the event loop.
+            num_readers: The number of threads reading the block store
+        """
+        self.db = db
+        self.db.deliver_on(get_event_loop())
+        self.readers = ThreadPoolExecutor(num_readers, "bami-db-read")
+        self.writer = ThreadPoolExecutor(1, "bami-db-write")
+        # Hashes of the blocks queued for writing, not committed yet
+        self.pending_blocks = set()
+
+    async def read(self, func: Callable, *args: Any) -> Any:
+        """Call a function that reads only the block store on a reader thread"""
+        return await get_event_loop().run_in_executor(self.readers, func, *args)
+
+    async def write(self, func: Callable, *args: Any) -> Any:
+        """Call a function that writes, or reads the chains, on the writer thread"""
+        return await get_event_loop().run_in_executor(self.writer, func, *args)
+
+    def is_block_pending(self, block_hash: bytes) -> bool:
+        return block_hash in self.pending_blocks
+
+    async def add_block(self, block_blob: bytes, block: PlexusBlock) -> None:
+        await self.add_blocks(((block_blob, block),))
+
+    async def add_blocks(self, blocks: Iterable[Tuple[bytes, PlexusBlock]]) -> None:
+        blocks = [b for b in blocks if b[1].hash not in self.pending_blocks]
+        hashes = {block.hash for _, block in blocks}
+        self.pending_blocks.update(hashes)
+        try:
+            await self.write(self.db.add_blocks, blocks)
+        finally:
+            self.pending_blocks.difference_update(hashes)
+
+    async def has_block(self, block_hash: bytes) -> bool:
+        return await self.read(self.db.has_block, block_hash)
+
+    async def get_block_blob_by_dot(
+        self, chain_id: bytes, block_dot: Dot
+    ) -> Optional[bytes]:
+        return await self.read(self.db.get_block_blob_by_dot, chain_id, block_dot)
+
+    async def get_block_hash_and_blob_by_dot(
+        self, chain_id: bytes, block_dot: Dot
+    ) -> Optional[Tuple[bytes, bytes]]:
+        return await self.read(
+            self.db.get_block_hash_and_blob_by_dot, chain_id, block_dot
+        )
+
+    async def get_block_blobs_page(
+        self,
+        chain_id: bytes,
+        frontier_diff: FrontierDiff,
+        vals_to_request: Set,
+        max_bytes: int,
+        max_count: int,
+    ) -> Tuple[List[bytes], Optional[FrontierDiff]]:
+        return await self.write(
+            self.db.get_block_blobs_page,
+            chain_id,
+            frontier_diff,
+            vals_to_request,
+            max_bytes,
+            max_count,
+        )
+
+    async def checkpoint(self) -> None:
+        await self.write(self.db.checkpoint)
+
+    async def prune(self, finalized: Dict[bytes, int]) -> int:
+        return await self.write(self.db.prune, finalized)
+
+    async def close(self) -> None:
+        """Wait for the queued writes, then close the database"""
+        await self.write(self.db.close)
+        self.readers.shutdown()
+        self.writer.shutdown()
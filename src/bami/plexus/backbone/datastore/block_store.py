@@ -1,8 +1,35 @@
 from abc import ABC, abstractmethod
-from typing import Iterator, Optional, Tuple
+from asyncio import get_event_loop
+from contextlib import contextmanager
+from functools import partial
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 import lmdb
 
+CHECKPOINT_KEY = b"checkpoint"
+# Seconds a compaction waits for no transaction to be in progress
+COMPACT_IDLE_TIMEOUT = 5.0
+
+# Secondary indexes of the blocks
+INDEX_PUBLIC_KEY = b"index_public_key"
+INDEX_COMMUNITY = b"index_community"
+INDEX_TYPE = b"index_type"
+INDEXES = (INDEX_PUBLIC_KEY, INDEX_COMMUNITY, INDEX_TYPE)
+
 
 class BaseBlockStore(ABC):
     """Store interface for block blobs"""
@@ -12,13 +39,30 @@ class BaseBlockStore(ABC):
         pass
 
     @abstractmethod
-    def iterate_blocks(self) -> Iterator[Tuple[bytes, bytes]]:
+    def iterate_blocks(self, buffers: bool = False) -> Iterator[Tuple[bytes, bytes]]:
+        """Iterate over the (block hash, block blob) pairs. With buffers, the blobs can be
+        memoryviews of the store, only valid until the next iteration step."""
+        pass
+
+    @abstractmethod
+    def iterate_blocks_since(
+        self, position: int, buffers: bool = False
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        """Iterate over blocks added after the block log position, in insertion order.
+        With buffers, the blobs can be memoryviews as in iterate_blocks."""
         pass
 
     @abstractmethod
     def get_block_by_hash(self, block_hash: bytes) -> Optional[bytes]:
         pass
 
+    @abstractmethod
+    def get_block_buffer(
+        self, block_hash: bytes
+    ) -> ContextManager[Optional[memoryview]]:
+        """Borrow the block blob without copying it. The buffer is only valid within the context."""
+        pass
+
     @abstractmethod
     def add_tx(self, block_hash: bytes, tx_blob: bytes) -> None:
         pass
@@ -43,6 +87,71 @@ class BaseBlockStore(ABC):
     def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
         pass
 
+    @abstractmethod
+    def delete_block(self, block_hash: bytes) -> None:
+        """Delete the block blob, the transaction and the extra data of the block"""
+        pass
+
+    @abstractmethod
+    def delete_dot(self, dot: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def add_index_key(self, index: bytes, key: bytes, block_hash: bytes) -> None:
+        """Add the block hash to the index under the key. Keys are kept in byte order."""
+        pass
+
+    @abstractmethod
+    def delete_index_key(self, index: bytes, key: bytes, block_hash: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def iterate_index(
+        self,
+        index: bytes,
+        prefix: bytes,
+        start: bytes = b"",
+        end: Optional[bytes] = None,
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        """Iterate in key order over the (key, block hash) pairs of the index with a key
+        that starts with prefix, and with prefix + start <= key < prefix + end"""
+        pass
+
+    @abstractmethod
+    def write_batch(self) -> ContextManager[None]:
+        """Group all writes made within the context into one atomic write"""
+        pass
+
+    @abstractmethod
+    def read_batch(self) -> ContextManager[None]:
+        """Serve all reads made within the context from one snapshot of the store"""
+        pass
+
+    @abstractmethod
+    def save_checkpoint(
+        self, chain_states: Dict[bytes, bytes], chain_deltas: Dict[bytes, bytes] = None
+    ) -> None:
+        """Store the chain states, and the changes of chains to their last stored state,
+        together with the current block log position. A chain state replaces its changes."""
+        pass
+
+    @abstractmethod
+    def load_checkpoint(self) -> Optional[Tuple[Dict[bytes, bytes], int]]:
+        """Get the stored chain states and the block log position they include.
+        Returns None if no checkpoint was saved."""
+        pass
+
+    @abstractmethod
+    def load_chain_deltas(self, chain_id: bytes) -> List[bytes]:
+        """Get the changes stored after the state of the chain, in order"""
+        pass
+
+    @abstractmethod
+    async def compact(self) -> bool:
+        """Reclaim the space of deleted data without blocking the event loop.
+        Returns True if the store was compacted."""
+        pass
+
     @abstractmethod
     def close(self) -> None:
         pass
@@ -51,55 +160,334 @@ class BaseBlockStore(ABC):
 class LMDBLockStore(BaseBlockStore):
     """BlockStore implementation based on LMBD"""
 
-    def __init__(self, block_dir: str) -> None:
-        # Change the directory
-        self.env = lmdb.open(block_dir, subdir=True, max_dbs=5, map_async=True)
+    def __init__(self, block_dir: str, map_size: int = None) -> None:
+        self.block_dir = block_dir
+        self.map_size = map_size
+        # Sub-databases opened by users of the store, such as the chain maps
+        self._dbs = {}
+        # Number of ended write transactions, to detect writes during a compaction
+        self._writes = 0
+        # Transactions in progress in all threads. The environment is replaced by a compaction
+        # only when none is, and no transaction starts while it is being replaced.
+        self._active = 0
+        self._env_cond = threading.Condition()
+        # A compaction copies the environment meanwhile, and does not once the store is closed
+        self._copying = False
+        self._closed = False
+        # Write and read transactions shared by a batch, kept per thread
+        self._batch = threading.local()
+        self._open()
+
+    def _open(self) -> None:
+        kwargs = {"map_size": self.map_size} if self.map_size else {}
+        self.env = lmdb.open(
+            self.block_dir, subdir=True, max_dbs=32, map_async=True, **kwargs
+        )
         self.blocks = self.env.open_db(key=b"blocks")
         self.txs = self.env.open_db(key=b"txs")
         self.dots = self.env.open_db(key=b"dots")
         self.extra = self.env.open_db(key=b"extra")
-        # add sub dbs if required
+        # Block hashes in insertion order, keyed by the log position
+        self.log = self.env.open_db(key=b"log")
+        # Checkpointed chain states
+        self.chains = self.env.open_db(key=b"chains")
+        # Checkpointed chain changes, keyed by the length and id of the chain and their order
+        self.chain_deltas = self.env.open_db(key=b"chain_deltas")
+        self.meta = self.env.open_db(key=b"meta")
+        # Secondary indexes: an entry per block, keyed by the index key and the block hash
+        self.indexes = {index: self.env.open_db(key=index) for index in INDEXES}
+        self._dbs = {name: self.env.open_db(key=name) for name in self._dbs}
+
+    def open_db(self, name: bytes) -> Any:
+        """Get the handle of a named sub-database, creating it if needed. Open new sub-databases
+        before any transaction uses them. Handles change when the store is compacted."""
+        db = self._dbs.get(name)
+        if db is None:
+            db = self._dbs[name] = self.env.open_db(key=name)
+        return db
+
+    @contextmanager
+    def _in_use(self, write: bool = False) -> Iterator[None]:
+        """Keep the environment open while the context uses it"""
+        with self._env_cond:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._env_cond:
+                self._active -= 1
+                # Counted once done: a copy started meanwhile can miss the write
+                self._writes += write
+                if not self._active:
+                    self._env_cond.notify_all()
+
+    @contextmanager
+    def begin(
+        self, write: bool = False, buffers: bool = False
+    ) -> Iterator[lmdb.Transaction]:
+        """Use the open batch transaction, or start a new one for a single operation.
+        With buffers, a new transaction returns memoryviews valid until it ends or writes."""
+        txn = getattr(self._batch, "txn", None)
+        if txn is None and not write:
+            txn = getattr(self._batch, "read_txn", None)
+        if txn is not None:
+            yield txn
+        else:
+            with self._in_use(write), self.env.begin(
+                write=write, buffers=buffers
+            ) as txn:
+                yield txn
+
+    @contextmanager
+    def write_batch(self) -> Iterator[None]:
+        """Commit every write made within the context in a single LMDB transaction.
+        Nested batches join the outer one. Reads within the batch see the uncommitted writes."""
+        if getattr(self._batch, "txn", None) is not None:
+            yield
+            return
+        self._batch.on_end = []
+        committed = False
+        try:
+            with self._in_use(write=True), self.env.begin(write=True) as txn:
+                self._batch.txn = txn
+                try:
+                    yield
+                finally:
+                    self._batch.txn = None
+            committed = True
+        finally:
+            callbacks, self._batch.on_end = self._batch.on_end, []
+            for callback in callbacks:
+                callback(committed)
+
+    def in_write_batch(self) -> bool:
+        return getattr(self._batch, "txn", None) is not None
+
+    def on_batch_end(self, callback: Callable[[bool], None]) -> None:
+        """Call back once the open write batch ends, with True if it was committed"""
+        self._batch.on_end.append(callback)
+
+    @contextmanager
+    def read_batch(self) -> Iterator[None]:
+        """Serve every read made within the context from a single LMDB read transaction.
+        Within a write batch, the reads use the write transaction."""
+        if getattr(self._batch, "txn", None) or getattr(self._batch, "read_txn", None):
+            yield
+            return
+        with self._in_use(), self.env.begin() as txn:
+            self._batch.read_txn = txn
+            try:
+                yield
+            finally:
+                self._batch.read_txn = None
 
-    def iterate_blocks(self) -> Iterator[Tuple[bytes, bytes]]:
-        with self.env.begin() as txn:
+    def iterate_blocks(self, buffers: bool = False) -> Iterator[Tuple[bytes, bytes]]:
+        with self._in_use(), self.env.begin(buffers=buffers) as txn:
             for k, v in txn.cursor(db=self.blocks):
-                yield k, v
+                yield bytes(k), v
+
+    def _log_position(self, txn: lmdb.Transaction) -> int:
+        cursor = txn.cursor(db=self.log)
+        return struct.unpack(">Q", cursor.key())[0] if cursor.last() else 0
+
+    def iterate_blocks_since(
+        self, position: int, buffers: bool = False
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        with self._in_use(), self.env.begin(buffers=buffers) as txn:
+            cursor = txn.cursor(db=self.log)
+            if cursor.set_range(struct.pack(">Q", position + 1)):
+                for block_hash in cursor.iternext(keys=False):
+                    block_hash = bytes(block_hash)
+                    block_blob = txn.get(block_hash, db=self.blocks)
+                    # Pruned blocks stay in the log
+                    if block_blob is not None:
+                        yield block_hash, block_blob
 
     def add_block(self, block_hash: bytes, block_blob: bytes) -> None:
-        with self.env.begin(write=True) as txn:
-            txn.put(block_hash, block_blob, db=self.blocks)
+        with self.begin(write=True) as txn:
+            if txn.put(block_hash, block_blob, db=self.blocks, overwrite=False):
+                # New block: append it to the block log
+                log_key = struct.pack(">Q", self._log_position(txn) + 1)
+                txn.put(log_key, block_hash, db=self.log, append=True)
 
     def add_tx(self, block_hash: bytes, tx_blob: bytes) -> None:
-        with self.env.begin(write=True) as txn:
+        with self.begin(write=True) as txn:
             txn.put(block_hash, tx_blob, db=self.txs)
 
     def get_block_by_hash(self, block_hash: bytes) -> Optional[bytes]:
-        with self.env.begin() as txn:
+        with self.begin() as txn:
             val = txn.get(block_hash, db=self.blocks)
         return val
 
+    @contextmanager
+    def get_block_buffer(self, block_hash: bytes) -> Iterator[Optional[memoryview]]:
+        with self.begin(buffers=True) as txn:
+            val = txn.get(block_hash, db=self.blocks)
+            yield memoryview(val) if val is not None else None
+
     def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
-        with self.env.begin() as txn:
+        with self.begin() as txn:
             val = txn.get(block_hash, db=self.txs)
         return val
 
     def add_dot(self, dot: bytes, block_hash: bytes) -> None:
-        with self.env.begin(write=True) as txn:
+        with self.begin(write=True) as txn:
             txn.put(dot, block_hash, db=self.dots)
 
     def get_hash_by_dot(self, dot: bytes) -> Optional[bytes]:
-        with self.env.begin() as txn:
+        with self.begin() as txn:
             val = txn.get(dot, db=self.dots)
         return val
 
     def add_extra(self, block_hash: bytes, extra: bytes) -> None:
-        with self.env.begin(write=True) as txn:
+        with self.begin(write=True) as txn:
             txn.put(block_hash, extra, db=self.extra)
 
     def get_extra(self, block_hash: bytes) -> Optional[bytes]:
-        with self.env.begin() as txn:
+        with self.begin() as txn:
             val = txn.get(block_hash, db=self.extra)
         return val
 
+    def delete_block(self, block_hash: bytes) -> None:
+        with self.begin(write=True) as txn:
+            txn.delete(block_hash, db=self.blocks)
+            txn.delete(block_hash, db=self.txs)
+            txn.delete(block_hash, db=self.extra)
+
+    def delete_dot(self, dot: bytes) -> None:
+        with self.begin(write=True) as txn:
+            txn.delete(dot, db=self.dots)
+
+    def add_index_key(self, index: bytes, key: bytes, block_hash: bytes) -> None:
+        with self.begin(write=True) as txn:
+            # The block hash makes the entries of blocks with the same key unique
+            txn.put(key + block_hash, block_hash, db=self.indexes[index])
+
+    def delete_index_key(self, index: bytes, key: bytes, block_hash: bytes) -> None:
+        with self.begin(write=True) as txn:
+            txn.delete(key + block_hash, db=self.indexes[index])
+
+    def iterate_index(
+        self,
+        index: bytes,
+        prefix: bytes,
+        start: bytes = b"",
+        end: Optional[bytes] = None,
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        end_key = prefix + end if end is not None else None
+        with self.begin() as txn:
+            cursor = txn.cursor(db=self.indexes[index])
+            if not cursor.set_range(prefix + start):
+                return
+            for key, block_hash in cursor:
+                if not key.startswith(prefix) or (
+                    end_key is not None and key >= end_key
+                ):
+                    break
+                yield key, block_hash
+
+    def _chain_delta_keys(self, txn: lmdb.Transaction, chain_id: bytes) -> List[bytes]:
+        prefix = struct.pack(">H", len(chain_id)) + chain_id
+        cursor = txn.cursor(db=self.chain_deltas)
+        if not cursor.set_range(prefix):
+            return []
+        keys = []
+        for key in cursor.iternext(values=False):
+            if not key.startswith(prefix):
+                break
+            keys.append(key)
+        return keys
+
+    def save_checkpoint(
+        self, chain_states: Dict[bytes, bytes], chain_deltas: Dict[bytes, bytes] = None
+    ) -> None:
+        with self.begin(write=True) as txn:
+            for chain_id, chain_state in chain_states.items():
+                txn.put(chain_id, chain_state, db=self.chains)
+                for key in self._chain_delta_keys(txn, chain_id):
+                    txn.delete(key, db=self.chain_deltas)
+            for chain_id, delta in (chain_deltas or {}).items():
+                num_deltas = len(self._chain_delta_keys(txn, chain_id))
+                key = struct.pack(">H", len(chain_id)) + chain_id
+                txn.put(
+                    key + struct.pack(">I", num_deltas), delta, db=self.chain_deltas
+                )
+            position = struct.pack(">Q", self._log_position(txn))
+            txn.put(CHECKPOINT_KEY, position, db=self.meta)
+
+    def load_checkpoint(self) -> Optional[Tuple[Dict[bytes, bytes], int]]:
+        with self.begin() as txn:
+            position = txn.get(CHECKPOINT_KEY, db=self.meta)
+            if not position:
+                return None
+            chain_states = dict(txn.cursor(db=self.chains))
+        return chain_states, struct.unpack(">Q", position)[0]
+
+    def load_chain_deltas(self, chain_id: bytes) -> List[bytes]:
+        with self.begin() as txn:
+            return [
+                txn.get(key, db=self.chain_deltas)
+                for key in self._chain_delta_keys(txn, chain_id)
+            ]
+
+    async def compact(self) -> bool:
+        """Copy the store without its free pages in a background thread, from a read snapshot.
+        The store is replaced with the copy only if nothing was written meanwhile."""
+        if self._closed:
+            return False
+        if getattr(self._batch, "txn", None) or getattr(self._batch, "read_txn", None):
+            # The replacement would wait for the batch of this thread
+            return False
+        writes = self._writes
+        copy_dir = tempfile.mkdtemp(prefix="compact", dir=self.block_dir)
+        try:
+            if not await get_event_loop().run_in_executor(None, self._copy, copy_dir):
+                return False
+            return await get_event_loop().run_in_executor(
+                None, self._replace, copy_dir, writes
+            )
+        finally:
+            shutil.rmtree(copy_dir, ignore_errors=True)
+
+    def _copy(self, copy_dir: str) -> bool:
+        """Copy the store without its free pages, unless it is closed. Closing the store waits
+        for the copy."""
+        with self._env_cond:
+            if self._closed:
+                return False
+            self._copying = True
+        try:
+            self.env.copy(copy_dir, compact=True)
+        finally:
+            with self._env_cond:
+                self._copying = False
+                self._env_cond.notify_all()
+        return True
+
+    def _replace(self, copy_dir: str, writes: int) -> bool:
+        """Replace the store with the compacted copy, once no transaction uses it. New
+        transactions are not held back meanwhile: they could hold locks a transaction in
+        progress waits for. A store that is never idle within the timeout is not replaced."""
+        with self._env_cond:
+            self._env_cond.wait_for(
+                lambda: self._closed or not self._active or self._writes != writes,
+                COMPACT_IDLE_TIMEOUT,
+            )
+            if self._closed or self._active or self._writes != writes:
+                return False
+            # New transactions wait for the lock of the condition
+            self.env.close()
+            os.replace(
+                os.path.join(copy_dir, "data.mdb"),
+                os.path.join(self.block_dir, "data.mdb"),
+            )
+            self._open()
+            return True
+
     def close(self) -> None:
-        self.env.close()
+        with self._env_cond:
+            self._closed = True
+            self._env_cond.wait_for(lambda: not self._copying)
+            self.env.close()
+            # A replacement waiting for the store to be idle gives up
+            self._env_cond.notify_all()
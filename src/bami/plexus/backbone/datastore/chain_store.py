@@ -1,25 +1,29 @@
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
 import threading
-from typing import Iterable, List, Optional, Set, Tuple
+from typing import Any, Iterable, Iterator, List, Optional, Set, Tuple
 
 import cachetools
 
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
 from bami.plexus.backbone.datastore.frontiers import Frontier, FrontierDiff
 from bami.plexus.backbone.utils import (
+    decode_raw,
     Dot,
+    encode_raw,
     expand_ranges,
     GENESIS_DOT,
-    GENESIS_HASH,
+    GENESIS_SEQ,
+    IntervalSet,
     Links,
     ranges,
-    Ranges,
     shorten,
     ShortKey,
 )
 
-
-def _get_first(set_val):
-    return {s[0] for s in set_val}
+# Number of checkpoints of the changes of a chain after which its full state is checkpointed
+MAX_CHECKPOINT_DELTAS = 60
 
 
 class BaseChain(ABC):
@@ -29,6 +33,12 @@ class BaseChain(ABC):
     ) -> Iterable[Dot]:
         pass
 
+    @abstractmethod
+    def add_blocks(self, blocks: Iterable[Tuple[Links, int, bytes]]) -> List[Dot]:
+        """Add a batch of blocks given as (links, sequence number, hash), in any order.
+        Returns the dots that became consistent, in insertion order."""
+        pass
+
     @abstractmethod
     def reconcile(
         self, frontier: Frontier, last_reconcile_point: int = None
@@ -67,19 +77,66 @@ class BaseChain(ABC):
     def get_all_short_hash_by_seq_num(self, seq_num: int) -> Optional[Set[ShortKey]]:
         pass
 
+    @abstractmethod
+    def prune(self, seq_num: int) -> List[Dot]:
+        """Drop the versions and pointers of the blocks with a sequence number below seq_num,
+        as far as the chain has no holes or inconsistencies there.
+
+        Returns:
+            The dots of the pruned blocks
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def pruned_seq_num(self) -> int:
+        """The blocks with a lower sequence number are final and pruned"""
+        pass
+
+    @abstractmethod
+    def known_seq_nums(self) -> IntervalSet:
+        """The sequence numbers with at least one known block"""
+        pass
+
+    @abstractmethod
+    def to_bytes(self) -> bytes:
+        """Serialize the chain state to restore it later with BaseChainFactory.load_chain"""
+        pass
+
+    def checkpoint_state(self, full: bool = False) -> Tuple[bool, bytes]:
+        """Serialize the chain for a checkpoint: the full state, as with to_bytes, or only the
+        changes since the previous checkpoint, to restore with apply_delta.
+
+        Args:
+            full: Serialize the full state, e.g. if the previous checkpoint was lost
+
+        Returns:
+            True if the full state is serialized, and the serialized state
+        """
+        return True, self.to_bytes()
+
+    def apply_delta(self, delta: bytes) -> None:
+        """Apply the changes serialized with checkpoint_state to the restored chain"""
+        raise NotImplementedError
+
 
 class BaseChainFactory(ABC):
     @abstractmethod
-    def create_chain(self, **kwargs) -> BaseChain:
+    def create_chain(self, chain_id: bytes, **kwargs) -> BaseChain:
+        pass
+
+    @abstractmethod
+    def load_chain(self, chain_id: bytes, chain_state: bytes, **kwargs) -> BaseChain:
+        """Restore the chain from the state serialized with BaseChain.to_bytes"""
         pass
 
 
 class Chain(BaseChain):
-    def __init__(self, terminal_cache_size=10_000, max_extra_dots=5):
+    def __init__(self, max_extra_dots=5):
         """DAG-Chain of one community based on in-memory dicts.
 
         Args:
-            terminal_cache_size: The maximum amount of terminal nodes stored in the cache.
+            max_extra_dots: The maximum amount of extra dots sent to resolve a conflict.
         """
         # Internal chain store of short hashes
         self.versions = dict()
@@ -93,17 +150,25 @@ class Chain(BaseChain):
 
         self.inconsistent_blocks = set()
         # Unknown blocks in the data structure
-        self.holes = set()
-        # Current terminal nodes in the DAG
-        self._terminal = Links(((0, shorten(GENESIS_HASH)),))
-
-        self.const_terminal = self.terminal
+        self.holes = IntervalSet()
+        # Current terminal nodes in the DAG: blocks without next blocks
+        self.terminal_dots = {GENESIS_DOT}
+        # Consistent blocks without consistent next blocks
+        self.const_terminal_dots = {GENESIS_DOT}
+        # Sorted terminal links, built on first use after a change
+        self._terminal = None
+        self._const_terminal = None
+        # Frontier of the current chain version, shared until the next change
+        self._frontier = None
 
         self.max_known_seq_num = 0
         self.max_extra_dots = max_extra_dots
-
-        # Cache to speed up bfs on links
-        self.term_cache = cachetools.LRUCache(terminal_cache_size)
+        # Blocks below this sequence number are final: their versions and pointers are dropped
+        self._pruned_seq_num = GENESIS_SEQ
+        # Versions and pointers added since the last checkpoint, by state key. None until the
+        # full state is checkpointed, and after pruning: the next checkpoint is a full one.
+        self._changes = None
+        self._num_deltas = 0
 
         self.lock = threading.Lock()
 
@@ -118,11 +183,15 @@ class Chain(BaseChain):
 
     @property
     def terminal(self) -> Links:
+        if self._terminal is None:
+            self._terminal = Links(tuple(sorted(self.terminal_dots)))
         return self._terminal
 
     @property
     def consistent_terminal(self) -> Links:
-        return self.const_terminal
+        if self._const_terminal is None:
+            self._const_terminal = Links(tuple(sorted(self.const_terminal_dots)))
+        return self._const_terminal
 
     def get_next_links(self, dot: Dot) -> Optional[Links]:
         """Get forward link from the point.
@@ -143,16 +212,26 @@ class Chain(BaseChain):
     def _update_holes(self, block_seq_num: int) -> None:
         """Fix known holes, or add any new"""
         # Check if this block fixes known holes
-        if block_seq_num in self.holes:
-            self.holes.remove(block_seq_num)
+        self.holes.discard(block_seq_num)
         # Check if block introduces new holes
-        self.holes.update({i for i in range(self.max_known_seq_num + 1, block_seq_num)})
+        self.holes.add_range(self.max_known_seq_num + 1, block_seq_num - 1)
         self.max_known_seq_num = max(self.max_known_seq_num, block_seq_num)
 
+    @property
+    def pruned_seq_num(self) -> int:
+        return self._pruned_seq_num
+
+    def _is_pruned(self, dot: Dot) -> bool:
+        return GENESIS_SEQ <= dot[0] < self._pruned_seq_num
+
     def _is_block_links_consistent(self, block_links: Links) -> bool:
         # Add to inconsistencies any unknown back pointers. If any block is not consistent
         return all(
-            (dot == GENESIS_DOT or self.get_prev_links(dot) is not None)
+            (
+                dot == GENESIS_DOT
+                or self._is_pruned(dot)
+                or self.get_prev_links(dot) is not None
+            )
             and dot not in self.inconsistent_blocks
             for dot in block_links
         )
@@ -186,7 +265,11 @@ class Chain(BaseChain):
         is_block_consistent = True
         # Add to inconsistencies any unknown back pointers. If any block is not consistent
         for dot in block_links:
-            if dot != GENESIS_DOT and not self.get_prev_links(dot):
+            if (
+                dot != GENESIS_DOT
+                and not self._is_pruned(dot)
+                and not self.get_prev_links(dot)
+            ):
                 self.inconsistencies.add(dot)
                 is_block_consistent = False
 
@@ -212,122 +295,111 @@ class Chain(BaseChain):
                     if self._is_block_dot_consistent(next_dot):
                         yield from self.consistency_fix(next_dot)
 
-    def __calc_terminal(
-        self, current: Links, make_consistent_step: bool = False
-    ) -> Set[Tuple[int, ShortKey]]:
-        """Recursive iteration through the block links"""
+    def _calc_terminal(self, current: Links) -> Set[Dot]:
+        """Blocks without next blocks reachable from the current links"""
         terminal = set()
-        for blk_link in current:
-            if blk_link not in self.forward_pointers:
+        visited = set(current)
+        to_visit = list(current)
+        while to_visit:
+            blk_link = to_visit.pop()
+            next_links = self.get_next_links(blk_link)
+            if not next_links:
                 # Terminal nodes achieved
                 terminal.add(blk_link)
-            else:
-                # Next blocks are available, check if there is cache
-                cached_next = self.term_cache.get(blk_link, default=None)
-                if cached_next:
-                    # Cached next exits
-                    new_cache = None
-
-                    for cached_val in cached_next:
-                        if not make_consistent_step or cached_val[1]:
-                            term_next = self.get_next_links(cached_val[0])
-                            if not term_next:
-                                # This is terminal node - update
-                                terminal.update(_get_first(cached_next))
-                            else:
-                                # This is not terminal, make next step and invalidate the cache
-                                new_val = self.__calc_terminal(
-                                    term_next, make_consistent_step
-                                )
-                                if not new_cache:
-                                    new_cache = set()
-                                val_with_const = {
-                                    (dot, self._is_block_dot_consistent(dot))
-                                    for dot in new_val
-                                }
-                                new_cache.update(val_with_const)
-                                terminal.update(new_val)
-                    if new_cache:
-                        self.term_cache[blk_link] = new_cache
-                else:
-                    # No cache, make step and update cache
-                    next_blk = self.get_next_links(blk_link)
-                    new_term = self.__calc_terminal(next_blk, make_consistent_step)
-                    val_with_const = {
-                        (dot, self._is_block_dot_consistent(dot)) for dot in new_term
-                    }
-                    self.term_cache[blk_link] = val_with_const
-                    terminal.update(new_term)
+                continue
+            for dot in next_links:
+                if dot not in visited:
+                    visited.add(dot)
+                    to_visit.append(dot)
         return terminal
 
-    # noinspection PyTypeChecker
     def _update_terminal(
         self,
-        block_seq_num: int,
-        block_short_hash: ShortKey,
-        consistent_update: bool = True,
-    ) -> None:
-        """Update current terminal nodes wrt new block"""
+        block_dot: Dot,
+        block_links: Links,
+        block_consistent: bool,
+        new_consistent: List[Dot],
+    ) -> Set[Dot]:
+        """Update current terminal nodes wrt new block, in O(out-degree) of the changed blocks.
 
-        # Check if the terminal nodes changed
-        current_links = Links(((block_seq_num, block_short_hash),))
-        # Start traversal from the block
-        new_term = self.__calc_terminal(current_links)
-        # Traversal from the current terminal nodes. Block can change the current terminal
+        Args:
+            block_dot: Dot of the new block
+            block_links: Links of the new block
+            block_consistent: True if the new block is consistent
+            new_consistent: Blocks that became consistent with the new block
 
-        if consistent_update:
-            const_step = self.__calc_terminal(
-                self.const_terminal, make_consistent_step=True
-            )
-            const_step.update(new_term)
-            const_step = sorted(const_step)
-            self.const_terminal = Links(tuple(const_step))
+        Returns:
+            The dots added to the consistent terminal
+        """
+        if not new_consistent and block_consistent:
+            new_consistent = [block_dot]
+        return self._update_terminal_dots(((block_dot, block_links),), new_consistent)
 
-        new_term.update(self.__calc_terminal(self._terminal))
-        new_term = sorted(new_term)
-        self._terminal = Links(tuple(new_term))
+    def _update_terminal_dots(
+        self, blocks: Iterable[Tuple[Dot, Links]], new_consistent: List[Dot]
+    ) -> Set[Dot]:
+        """Update current terminal nodes wrt new blocks, once all of them are inserted.
+
+        Args:
+            blocks: Dots and links of the new blocks
+            new_consistent: Blocks that became consistent with the new blocks
+
+        Returns:
+            The dots added to the consistent terminal
+        """
+        for block_dot, block_links in blocks:
+            # Linked blocks have a next block now
+            self.terminal_dots.difference_update(block_links)
+            if not self.get_next_links(block_dot):
+                self.terminal_dots.add(block_dot)
+        self._terminal = None
+
+        added = set()
+        if new_consistent:
+            # Previous blocks of consistent blocks are not consistent terminal
+            for dot in new_consistent:
+                self.const_terminal_dots.difference_update(self.get_prev_links(dot))
+            for dot in new_consistent:
+                next_links = self.get_next_links(dot) or ()
+                if not any(n not in self.inconsistent_blocks for n in next_links):
+                    if dot not in self.const_terminal_dots:
+                        added.add(dot)
+                        self.const_terminal_dots.add(dot)
+            self._const_terminal = None
+        return added
 
     def _update_forward_pointers(self, block_links: Links, block_dot: Dot) -> None:
         for dot in block_links:
             if dot not in self.forward_pointers:
                 self.forward_pointers[dot] = set()
             self.forward_pointers[dot].add(block_dot)
+        if self._changes is not None:
+            self._changes[b"f"].extend((dot, (block_dot,)) for dot in block_links)
 
     def _update_back_pointers(self, block_dot: Dot, block_links: Links):
         self.back_pointers[block_dot] = block_links
+        if self._changes is not None:
+            self._changes[b"b"].append((block_dot, block_links))
 
     def _update_versions(self, block_seq_num: int, block_hash: ShortKey) -> None:
         if block_seq_num not in self.versions:
             self.versions[block_seq_num] = set()
         self.versions[block_seq_num].add(block_hash)
+        if self._changes is not None:
+            self._changes[b"v"].append((block_seq_num, (block_hash,)))
 
     def add_block(
         self, block_links: Links, block_seq_num: int, block_hash: bytes
     ) -> List[Dot]:
-        blk_hash = shorten(block_hash)
-        block_dot = Dot((block_seq_num, blk_hash))
-
         with self.lock:
-            # 0. Update versions
-            self._update_versions(block_seq_num, blk_hash)
-            # 1. Update back pointers
-            self._update_back_pointers(block_dot, block_links)
-            # 2. Update forward pointers
-            self._update_forward_pointers(block_links, block_dot)
-            # 3. Update holes
-            self._update_holes(block_seq_num)
-            # 4. Update inconsistencies
-            block_consistent = self._add_inconsistencies(block_links, block_dot)
-            missing = list(self._remove_inconsistencies(block_dot, block_consistent))
-            if missing:
-                last_dot = missing[-1]
-                for dot in missing[:-1]:
-                    self.term_cache[Links((dot,))] = (Links((last_dot,)), True)
-            # 5. Update terminal nodes if consistent
-            old_terminal = self.const_terminal
-            self._update_terminal(block_seq_num, blk_hash, block_consistent)
-
-        diff = set(self.consistent_terminal) - set(old_terminal)
+            block_dot, block_consistent, missing = self._insert_block(
+                block_links, block_seq_num, block_hash
+            )
+            # 5. Update terminal nodes
+            diff = self._update_terminal(
+                block_dot, block_links, block_consistent, missing
+            )
+
         if diff and missing:
             # return list(itertools.chain([max(diff)], missing))
             return missing
@@ -338,30 +410,192 @@ class Chain(BaseChain):
         else:
             return []
 
+    def add_blocks(self, blocks: Iterable[Tuple[Links, int, bytes]]) -> List[Dot]:
+        """Add a batch of blocks in one pass: the terminal nodes are updated once for the batch.
+
+        Args:
+            blocks: Links, sequence number and hash of each block, in any order
+
+        Returns:
+            All dots that became consistent with the batch, in insertion order
+        """
+        # Links point to lower sequence numbers, so sorting orders the batch topologically
+        batch = sorted({b[2]: b for b in blocks}.values(), key=lambda b: b[1])
+        inserted = []
+        new_consistent = []
+        with self.lock:
+            for block_links, block_seq_num, block_hash in batch:
+                block_dot, block_consistent, missing = self._insert_block(
+                    block_links, block_seq_num, block_hash
+                )
+                inserted.append((block_dot, block_links))
+                if missing:
+                    new_consistent.extend(missing)
+                elif block_consistent:
+                    new_consistent.append(block_dot)
+            self._update_terminal_dots(inserted, new_consistent)
+        return new_consistent
+
+    def _insert_block(
+        self, block_links: Links, block_seq_num: int, block_hash: bytes
+    ) -> Tuple[Dot, bool, List[Dot]]:
+        """Insert block in the chain, without updating the terminal nodes.
+
+        Returns:
+            Block dot, True if the block is consistent, and the blocks that became consistent
+        """
+        blk_hash = shorten(block_hash)
+        block_dot = Dot((block_seq_num, blk_hash))
+        self._frontier = None
+
+        # 0. Update versions
+        self._update_versions(block_seq_num, blk_hash)
+        # 1. Update back pointers
+        self._update_back_pointers(block_dot, block_links)
+        # 2. Update forward pointers
+        self._update_forward_pointers(block_links, block_dot)
+        # 3. Update holes
+        self._update_holes(block_seq_num)
+        # 4. Update inconsistencies
+        block_consistent = self._add_inconsistencies(block_links, block_dot)
+        missing = list(self._remove_inconsistencies(block_dot, block_consistent))
+        return block_dot, block_consistent, missing
+
+    def prune(self, seq_num: int) -> List[Dot]:
+        with self.lock:
+            # History is final only up to the first hole or inconsistency
+            limit = min(seq_num, self.max_known_seq_num + 1)
+            if self.holes:
+                limit = min(limit, next(iter(self.holes)))
+            for dot in self.inconsistencies | self.inconsistent_blocks:
+                limit = min(limit, dot[0])
+            if limit <= self._pruned_seq_num:
+                return []
+
+            pruned = []
+            for seq in range(self._pruned_seq_num, limit):
+                for short_hash in self.versions.pop(seq, ()):
+                    dot = Dot((seq, short_hash))
+                    self.back_pointers.pop(dot, None)
+                    self.forward_pointers.pop(dot, None)
+                    pruned.append(dot)
+            self.forward_pointers.pop(GENESIS_DOT, None)
+            self._pruned_seq_num = limit
+            # Deltas only add versions and pointers
+            self._changes = None
+            return pruned
+
+    def _get_state(self) -> dict:
+        """Chain state besides the versions and pointers"""
+        return {
+            b"i": tuple(self.inconsistencies),
+            b"ib": tuple(self.inconsistent_blocks),
+            b"h": ranges(self.holes),
+            b"t": self.terminal,
+            b"ct": self.consistent_terminal,
+            b"m": self.max_known_seq_num,
+            b"p": self._pruned_seq_num,
+        }
+
+    def _set_state(self, state: dict) -> None:
+        self.inconsistencies = set(state[b"i"])
+        self.inconsistent_blocks = set(state[b"ib"])
+        self.holes = expand_ranges(state[b"h"])
+        self.terminal_dots = set(state[b"t"])
+        self.const_terminal_dots = set(state[b"ct"])
+        self._terminal = None
+        self._const_terminal = None
+        self._frontier = None
+        self.max_known_seq_num = state[b"m"]
+        self._pruned_seq_num = state.get(b"p", GENESIS_SEQ)
+
+    def _get_full_state(self) -> dict:
+        state = self._get_state()
+        state[b"v"] = [(s, tuple(v)) for s, v in self.versions.items()]
+        state[b"f"] = [(d, tuple(f)) for d, f in self.forward_pointers.items()]
+        state[b"b"] = list(self.back_pointers.items())
+        return state
+
+    def to_bytes(self) -> bytes:
+        with self.lock:
+            return encode_raw(self._get_full_state())
+
+    def checkpoint_state(self, full: bool = False) -> Tuple[bool, bytes]:
+        with self.lock:
+            full = (
+                full
+                or self._changes is None
+                or self._num_deltas >= MAX_CHECKPOINT_DELTAS
+            )
+            if full:
+                state = self._get_full_state()
+                self._num_deltas = 0
+            else:
+                # Holes, terminal nodes and inconsistencies are small: they are replaced
+                state = self._get_state()
+                state.update(self._changes)
+                self._num_deltas += 1
+            self._changes = {b"v": [], b"f": [], b"b": []}
+            return full, encode_raw(state)
+
+    def apply_delta(self, delta: bytes) -> None:
+        state = decode_raw(delta)
+        with self.lock:
+            self._set_state(state)
+            for s, v in state[b"v"]:
+                self.versions.setdefault(s, set()).update(v)
+            for d, f in state[b"f"]:
+                self.forward_pointers.setdefault(d, set()).update(f)
+            self.back_pointers.update(state[b"b"])
+            self._num_deltas += 1
+
+    @classmethod
+    def from_bytes(cls, chain_state: bytes, **kwargs) -> Chain:
+        state = decode_raw(chain_state)
+        chain = cls(**kwargs)
+        chain._set_state(state)
+        chain.versions = {s: set(v) for s, v in state[b"v"]}
+        chain.forward_pointers = {d: set(f) for d, f in state[b"f"]}
+        chain.back_pointers = dict(state[b"b"])
+        # The restored state is checkpointed: the next checkpoints store the changes to it
+        chain._changes = {b"v": [], b"f": [], b"b": []}
+        return chain
+
     @property
     def frontier(self) -> Frontier:
         with self.lock:
-            return Frontier(
-                self.terminal,
-                ranges(self.holes),
-                Links(tuple(sorted(self.inconsistencies))),
-            )
+            if self._frontier is None:
+                self._frontier = Frontier(
+                    self.terminal,
+                    ranges(self.holes),
+                    Links(tuple(sorted(self.inconsistencies))),
+                )
+            return self._frontier
+
+    def known_seq_nums(self) -> IntervalSet:
+        with self.lock:
+            return IntervalSet(((1, self.max_known_seq_num),)) - self.holes
 
     def reconcile(
         self, frontier: Frontier, last_reconcile_point: int = None
     ) -> FrontierDiff:
+        # Blocks can be added from another thread meanwhile
+        with self.lock:
+            return self._reconcile(frontier, last_reconcile_point)
+
+    def _reconcile(
+        self, frontier: Frontier, last_reconcile_point: int = None
+    ) -> FrontierDiff:
 
+        # Interval arithmetic: the cost depends on the number of holes, not on the chain length
         f_holes = expand_ranges(frontier.holes)
-        max_term_seq = max(frontier.terminal)[0]
+        max_term_seq = frontier.max_seq_num
 
-        front_known_seq = expand_ranges(Ranges(((1, max_term_seq),))) - f_holes
-        peer_known_seq = (
-            expand_ranges(Ranges(((1, self.max_known_seq_num),))) - self.holes
-        )
+        front_known_seq = IntervalSet(((1, max_term_seq),)) - f_holes
+        peer_known_seq = IntervalSet(((1, self.max_known_seq_num),)) - self.holes
 
         # External frontier has blocks that peer is missing => Request from front these blocks
-        f_diff = front_known_seq - peer_known_seq
-        missing = ranges(f_diff)
+        missing = (front_known_seq - peer_known_seq).ranges()
 
         # Front has blocks with conflicting hash => Request these blocks
         conflicts = {
@@ -370,16 +604,16 @@ class Chain(BaseChain):
             if s in self.versions
             and h not in self.versions[s]
             and (s, h) not in frontier.inconsistencies
-            and s not in frontier.holes
+            and s not in f_holes
         }
 
         # Check if peer has block that cover your inconsistencies
         for i in self.inconsistencies:
-            for t in self.__calc_terminal(Links((i,))):
+            for t in self._calc_terminal(Links((i,))):
                 if (
                     t in frontier.terminal
                     and t not in frontier.inconsistencies
-                    and t[0] not in frontier.holes
+                    and t[0] not in f_holes
                 ):
                     conflicts.add(i)
 
@@ -405,5 +639,208 @@ class Chain(BaseChain):
 
 
 class ChainFactory(BaseChainFactory):
-    def create_chain(self, **kwargs) -> BaseChain:
+    def create_chain(self, chain_id: bytes, **kwargs) -> BaseChain:
         return Chain(**kwargs)
+
+    def load_chain(self, chain_id: bytes, chain_state: bytes, **kwargs) -> BaseChain:
+        return Chain.from_bytes(chain_state, **kwargs)
+
+
+_MISSING = object()
+
+
+class LMDBChainMap:
+    """Map of one chain stored in a LMDB sub-database, keys are prefixed with the chain id.
+
+    Recently used entries, such as the ones near the terminal nodes, are kept in a bounded LRU cache.
+    Entries written in a write batch are cached once the batch is committed. Values are immutable: tuples, or frozensets if as_set is True. Update an entry by assigning a new value.
+    """
+
+    def __init__(
+        self,
+        block_store: LMDBLockStore,
+        db_name: bytes,
+        chain_id: bytes,
+        cache_size: int,
+        as_set: bool = False,
+    ) -> None:
+        self.block_store = block_store
+        self.db_name = db_name
+        self.prefix = encode_raw(chain_id)
+        self.as_set = as_set
+        self.cache = cachetools.LRUCache(cache_size)
+        # Reads on the event loop update the recency of the cache too
+        self.cache_lock = threading.Lock()
+        # Entries written in the open write batch, None if deleted
+        self.pending = {}
+
+    def _decode(self, raw_val: bytes) -> Any:
+        val = decode_raw(raw_val)
+        return frozenset(val) if self.as_set else val
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        val = _MISSING
+        if self.pending and self.block_store.in_write_batch():
+            # Other threads read the committed entries
+            val = self.pending.get(key, _MISSING)
+        if val is _MISSING:
+            with self.cache_lock:
+                val = self.cache.get(key, _MISSING)
+        if val is _MISSING:
+            with self.block_store.begin() as txn:
+                raw_val = txn.get(
+                    self.prefix + encode_raw(key),
+                    db=self.block_store.open_db(self.db_name),
+                )
+            val = None if raw_val is None else self._decode(raw_val)
+            # A batch committed since the read may have cached a newer value
+            with self.cache_lock:
+                val = self.cache.setdefault(key, val)
+        return default if val is None else val
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: Any) -> Any:
+        val = self.get(key)
+        if val is None:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        with self.block_store.begin(write=True) as txn:
+            txn.put(
+                self.prefix + encode_raw(key),
+                encode_raw(tuple(value)),
+                db=self.block_store.open_db(self.db_name),
+            )
+        self._cache_write(key, frozenset(value) if self.as_set else value)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        val = self.get(key)
+        if val is not None:
+            with self.block_store.begin(write=True) as txn:
+                txn.delete(
+                    self.prefix + encode_raw(key),
+                    db=self.block_store.open_db(self.db_name),
+                )
+            self._cache_write(key, None)
+        return default if val is None else val
+
+    def _cache_write(self, key: Any, val: Any) -> None:
+        if not self.block_store.in_write_batch():
+            with self.cache_lock:
+                self.cache[key] = val
+            return
+        if not self.pending:
+            self.block_store.on_batch_end(self._end_batch)
+        self.pending[key] = val
+
+    def _end_batch(self, committed: bool) -> None:
+        if committed:
+            with self.cache_lock:
+                self.cache.update(self.pending)
+        self.pending.clear()
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        with self.block_store.begin() as txn:
+            cursor = txn.cursor(db=self.block_store.open_db(self.db_name))
+            if cursor.set_range(self.prefix):
+                for raw_key, raw_val in cursor:
+                    if not raw_key.startswith(self.prefix):
+                        break
+                    yield decode_raw(raw_key[len(self.prefix) :]), self._decode(raw_val)
+
+
+class LMDBChain(Chain):
+    def __init__(
+        self,
+        versions: LMDBChainMap,
+        forward_pointers: LMDBChainMap,
+        back_pointers: LMDBChainMap,
+        **kwargs,
+    ) -> None:
+        """DAG-Chain of one community with the versions and pointers stored in LMDB.
+        Only the holes, inconsistencies and terminal nodes are kept in memory.
+        """
+        super().__init__(**kwargs)
+        self.versions = versions
+        self.forward_pointers = forward_pointers
+        self.back_pointers = back_pointers
+
+    # Replayed blocks are already in the maps: only new entries are written
+
+    def _update_forward_pointers(self, block_links: Links, block_dot: Dot) -> None:
+        for dot in block_links:
+            pointers = self.forward_pointers.get(dot, frozenset())
+            if block_dot not in pointers:
+                self.forward_pointers[dot] = pointers | {block_dot}
+
+    def _update_back_pointers(self, block_dot: Dot, block_links: Links) -> None:
+        if self.back_pointers.get(block_dot) != block_links:
+            self.back_pointers[block_dot] = block_links
+
+    def _update_versions(self, block_seq_num: int, block_hash: ShortKey) -> None:
+        versions = self.versions.get(block_seq_num, frozenset())
+        if block_hash not in versions:
+            self.versions[block_seq_num] = versions | {block_hash}
+
+    def to_bytes(self) -> bytes:
+        # Versions and pointers are already in the store
+        with self.lock:
+            return encode_raw(self._get_state())
+
+    def checkpoint_state(self, full: bool = False) -> Tuple[bool, bytes]:
+        # The state without the versions and pointers is always small
+        return True, self.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, chain_state: bytes, **kwargs) -> LMDBChain:
+        chain = cls(**kwargs)
+        chain._set_state(decode_raw(chain_state))
+        return chain
+
+
+class LMDBChainFactory(BaseChainFactory):
+    def __init__(self, block_store: LMDBLockStore, cache_size: int = 10_000) -> None:
+        """Factory of chains stored in the sub-databases of the block store.
+
+        Args:
+            block_store: The block store, chain updates join its write batches.
+            cache_size: The maximum amount of entries cached per chain map.
+        """
+        self.block_store = block_store
+        self.cache_size = cache_size
+        self.versions_db = b"chain_versions"
+        self.forward_db = b"chain_forward"
+        self.back_db = b"chain_back"
+        # Open the sub-databases before any transaction uses them
+        for db_name in self.versions_db, self.forward_db, self.back_db:
+            block_store.open_db(db_name)
+
+    def _chain_maps(self, chain_id: bytes) -> dict:
+        return dict(
+            versions=LMDBChainMap(
+                self.block_store,
+                self.versions_db,
+                chain_id,
+                self.cache_size,
+                as_set=True,
+            ),
+            forward_pointers=LMDBChainMap(
+                self.block_store,
+                self.forward_db,
+                chain_id,
+                self.cache_size,
+                as_set=True,
+            ),
+            back_pointers=LMDBChainMap(
+                self.block_store, self.back_db, chain_id, self.cache_size
+            ),
+        )
+
+    def create_chain(self, chain_id: bytes, **kwargs) -> BaseChain:
+        return LMDBChain(**self._chain_maps(chain_id), **kwargs)
+
+    def load_chain(self, chain_id: bytes, chain_state: bytes, **kwargs) -> BaseChain:
+        return LMDBChain.from_bytes(chain_state, **self._chain_maps(chain_id), **kwargs)
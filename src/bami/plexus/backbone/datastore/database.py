@@ -3,11 +3,31 @@ This file contains everything related to persistence for TrustChain.
 """
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from contextlib import closing
 from enum import Enum
-from typing import Dict, Iterable, Optional, Set, Tuple
+import struct
+import threading
+from typing import (
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import cachetools
 
-from bami.plexus.backbone.block import PlexusBlock
-from bami.plexus.backbone.datastore.block_store import BaseBlockStore
+from bami.plexus.backbone.block import PlexusBlock, PlexusBlockView
+from bami.plexus.backbone.datastore.block_store import (
+    BaseBlockStore,
+    INDEX_COMMUNITY,
+    INDEX_PUBLIC_KEY,
+    INDEX_TYPE,
+)
 from bami.plexus.backbone.datastore.chain_store import (
     BaseChain,
     BaseChainFactory,
@@ -20,12 +40,47 @@ from bami.plexus.backbone.utils import (
     encode_raw,
     expand_ranges,
     GENESIS_LINK,
+    GENESIS_SEQ,
+    IntervalSet,
     Links,
     Notifier,
+    Ranges,
     ShortKey,
 )
 
 
+def index_prefix(value: bytes) -> bytes:
+    """Index key prefix of a variable length value, unique for the value"""
+    return struct.pack(">H", len(value)) + value
+
+
+def index_key(value: bytes, position: int) -> bytes:
+    """Index key ordered by value, then by position"""
+    return index_prefix(value) + struct.pack(">Q", position)
+
+
+class FrontierCursor(NamedTuple):
+    """Position in a block request: a missing sequence number or a conflict"""
+
+    seq_num: Optional[int]
+    conflict: Optional[Dot]
+
+    def remaining(
+        self, frontier_diff: FrontierDiff, known: IntervalSet = None
+    ) -> FrontierDiff:
+        """The part of the frontier diff from this position on, limited to the known
+        sequence numbers if given"""
+        if self.conflict is None:
+            missing = expand_ranges(frontier_diff.missing)
+            if known is not None:
+                missing = missing & known
+            missing.discard_range(1, self.seq_num - 1)
+            return FrontierDiff(missing.ranges(), frontier_diff.conflicts)
+        conflicts = list(frontier_diff.conflicts.items())
+        index = [dot for dot, _ in conflicts].index(self.conflict)
+        return FrontierDiff(Ranges(()), dict(conflicts[index:]))
+
+
 class BaseDB(ABC, Notifier):
     @abstractmethod
     def get_chain(self, chain_id: bytes) -> Optional[BaseChain]:
@@ -35,10 +90,26 @@ class BaseDB(ABC, Notifier):
     def add_block(self, block_blob: bytes, block: PlexusBlock) -> None:
         pass
 
+    @abstractmethod
+    def add_blocks(self, blocks: Iterable[Tuple[bytes, PlexusBlock]]) -> None:
+        """Add a batch of blocks, given as (blob, block), in any order"""
+        pass
+
+    def write_batch(self) -> ContextManager[None]:
+        """Persist all blocks added within the context in a single block store write"""
+        return self.block_store.write_batch()
+
     @abstractmethod
     def get_block_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
         pass
 
+    @abstractmethod
+    def get_block_hash_and_blob_by_dot(
+        self, chain_id: bytes, block_dot: Dot
+    ) -> Optional[Tuple[bytes, bytes]]:
+        """Get the hash of the block, as stored, together with its blob"""
+        pass
+
     @abstractmethod
     def get_tx_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
         pass
@@ -81,21 +152,69 @@ class BaseDB(ABC, Notifier):
     def get_last_frontier(self, chain_id: bytes, peer_id: bytes) -> Frontier:
         pass
 
+    @abstractmethod
+    def store_sent_frontier(
+        self, chain_id: bytes, peer_id: bytes, frontier: Frontier, num_deltas: int
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def get_sent_frontier(
+        self, chain_id: bytes, peer_id: bytes
+    ) -> Tuple[Optional[Frontier], int]:
+        """Frontier last sent to the peer, and the number of deltas sent since the last full one"""
+        pass
+
+    @abstractmethod
+    def store_received_frontier(
+        self, chain_id: bytes, peer_id: bytes, frontier: Frontier
+    ) -> None:
+        pass
+
+    @abstractmethod
+    def get_received_frontier(
+        self, chain_id: bytes, peer_id: bytes
+    ) -> Optional[Frontier]:
+        pass
+
     def reconcile(
         self, chain_id: bytes, frontier: Frontier, peer_id: bytes
     ) -> FrontierDiff:
         """Reconcile the frontier from peer. If chain does not exist - will create chain and reconcile."""
         chain = self.get_chain(chain_id)
         if not chain:
-            chain = self.chain_factory.create_chain()
+            chain = self.chain_factory.create_chain(chain_id)
         res = chain.reconcile(
             frontier, self.get_last_reconcile_point(chain_id, peer_id)
         )
         if res.is_empty():
             # The frontiers are same => update reconciliation point
-            self.set_last_reconcile_point(chain_id, peer_id, max(frontier.terminal)[0])
+            self.set_last_reconcile_point(chain_id, peer_id, frontier.max_seq_num)
         return res
 
+    @abstractmethod
+    def checkpoint(self) -> None:
+        """Persist the chain states, so that restart does not replay all blocks"""
+        pass
+
+    @abstractmethod
+    def prune(self, finalized: Dict[bytes, int]) -> int:
+        """Drop the history of chains below their finalized sequence number.
+        The community does not prune by itself: the application decides which history is final.
+
+        Args:
+            finalized: The finalized sequence number of each chain to prune
+
+        Returns:
+            The number of deleted blocks
+        """
+        pass
+
+    @abstractmethod
+    async def compact(self) -> bool:
+        """Reclaim the space freed by pruning. Returns True if the store was compacted."""
+        pass
+
     @abstractmethod
     def close(self) -> None:
         pass
@@ -106,6 +225,49 @@ class BaseDB(ABC, Notifier):
     ) -> Iterable[bytes]:
         pass
 
+    @abstractmethod
+    def iterate_blocks_by_public_key(
+        self, public_key: bytes, start_seq: int = GENESIS_SEQ, end_seq: int = None
+    ) -> Iterator[bytes]:
+        """Iterate over the blocks of a peer with a sequence number from start_seq to
+        end_seq, both included, in sequence number order"""
+        pass
+
+    @abstractmethod
+    def iterate_blocks_by_community(
+        self, com_id: bytes, start_seq: int = GENESIS_SEQ, end_seq: int = None
+    ) -> Iterator[bytes]:
+        """Iterate over the blocks of a community chain with a community sequence number
+        from start_seq to end_seq, both included, in sequence number order"""
+        pass
+
+    @abstractmethod
+    def iterate_blocks_by_type(
+        self, block_type: bytes, start_time: int = 0, end_time: int = None
+    ) -> Iterator[bytes]:
+        """Iterate over the blocks of a type with a timestamp from start_time to end_time,
+        both included, in timestamp order"""
+        pass
+
+    @abstractmethod
+    def get_block_blobs_page(
+        self,
+        chain_id: bytes,
+        frontier_diff: FrontierDiff,
+        vals_to_request: Set,
+        max_bytes: int,
+        max_count: int,
+    ) -> Tuple[List[bytes], Optional[FrontierDiff]]:
+        """
+        Get the blocks requested with a frontier diff, up to max_bytes and max_count.
+        The blocks of a sequence number or of a conflict are never split, and at least one
+        of them is returned.
+
+        Returns:
+            The blocks, and the diff to request the remaining blocks, or None if there are none
+        """
+        pass
+
 
 class ChainTopic(Enum):
     ALL = 1
@@ -114,22 +276,74 @@ class ChainTopic(Enum):
 
 
 class DBManager(BaseDB):
-    def __init__(self, chain_factory: BaseChainFactory, block_store: BaseBlockStore):
+    def __init__(
+        self,
+        chain_factory: BaseChainFactory,
+        block_store: BaseBlockStore,
+        blob_cache_size: int = 32 * 1024 * 1024,
+        indexed: bool = False,
+    ):
+        """
+        Args:
+            chain_factory: Factory of the chains, restored from the block store on start
+            block_store: Storage of the blocks
+            blob_cache_size: The maximum size in bytes of the block blobs cached by chain dot
+            indexed: Maintain the public key, community and type indexes of new blocks
+        """
         super().__init__()
         self._chain_factory = chain_factory
         self._block_store = block_store
+        self.indexed = indexed
 
+        # Hashes and blobs of the recently added or requested blocks, keyed by (chain_id, dot)
+        self.blob_cache = cachetools.LRUCache(
+            blob_cache_size, getsizeof=lambda val: len(val[1])
+        )
+        # The cache is shared with the threads of the async facade
+        self.blob_cache_lock = threading.Lock()
+        self.blob_cache_hits = 0
+        self.blob_cache_misses = 0
+
+        # Serializes the changes to the chains, and the reads of their caches, between the
+        # event loop and the writer thread of the async facade
+        self.lock = threading.RLock()
         self.chains = dict()
+        # Chains changed since the last checkpoint
+        self.dirty_chains = set()
+        # Chains whose last checkpoint was not saved: their next one is a full state
+        self.lost_checkpoints = set()
         self.last_reconcile_seq_num = defaultdict(lambda: defaultdict(int))
         self.last_frontier = defaultdict(
             lambda: defaultdict(
                 lambda: Frontier(terminal=GENESIS_LINK, holes=(), inconsistencies=())
             )
         )
-
-        # Sync chains with block store
-        for block_blob in self._block_store.iterate_blocks():
-            self.add_block(block_blob[1], PlexusBlock.unpack(block_blob[1]))
+        # Frontiers last sent to and received from peers: the bases of the delta encoding
+        self.sent_frontiers = defaultdict(dict)
+        self.received_frontiers = defaultdict(dict)
+
+        # Sync chains with block store: restore the last checkpoint and replay only newer blocks
+        checkpoint = self._block_store.load_checkpoint()
+        if checkpoint:
+            chain_states, position = checkpoint
+            for chain_id, chain_state in chain_states.items():
+                chain = self.chain_factory.load_chain(chain_id, chain_state)
+                for delta in self._block_store.load_chain_deltas(chain_id):
+                    chain.apply_delta(delta)
+                self.chains[chain_id] = chain
+            blocks = self._block_store.iterate_blocks_since(position, buffers=True)
+        else:
+            blocks = self._block_store.iterate_blocks(buffers=True)
+        # Replay reads the links of the blocks in place, the hash is the store key.
+        # Chains stored in the block store are updated in one transaction: the read
+        # transaction of the replay keeps the pages of every commit from being reused.
+        with self._block_store.write_batch():
+            for block_hash, block_buffer in blocks:
+                self._add_block(
+                    block_buffer,
+                    PlexusBlockView(block_buffer, block_hash),
+                    persist=False,
+                )
 
     def get_last_reconcile_point(self, chain_id: bytes, peer_id: bytes) -> Links:
         return self.last_reconcile_seq_num[chain_id][peer_id]
@@ -148,16 +362,35 @@ class DBManager(BaseDB):
     def get_last_frontier(self, chain_id: bytes, peer_id: bytes) -> Frontier:
         return self.last_frontier[chain_id][peer_id]
 
-    def _process_missing_seq_num(
-        self, chain: BaseChain, chain_id: bytes, missing_ranges: Set[int]
+    def store_sent_frontier(
+        self, chain_id: bytes, peer_id: bytes, frontier: Frontier, num_deltas: int
+    ) -> None:
+        self.sent_frontiers[chain_id][peer_id] = (frontier, num_deltas)
+
+    def get_sent_frontier(
+        self, chain_id: bytes, peer_id: bytes
+    ) -> Tuple[Optional[Frontier], int]:
+        return self.sent_frontiers[chain_id].get(peer_id, (None, 0))
+
+    def store_received_frontier(
+        self, chain_id: bytes, peer_id: bytes, frontier: Frontier
+    ) -> None:
+        self.received_frontiers[chain_id][peer_id] = frontier
+
+    def get_received_frontier(
+        self, chain_id: bytes, peer_id: bytes
+    ) -> Optional[Frontier]:
+        return self.received_frontiers[chain_id].get(peer_id)
+
+    def _process_seq_num(
+        self, chain: BaseChain, chain_id: bytes, seq_num: int
     ) -> Iterable[bytes]:
-        for b_i in missing_ranges:
-            # Return all blocks with a sequence number
-            for dot in chain.get_dots_by_seq_num(b_i):
-                val = self.get_block_blob_by_dot(chain_id, dot)
-                if not val:
-                    raise Exception("No block", chain_id, dot)
-                yield val
+        # Return all blocks with a sequence number
+        for dot in chain.get_dots_by_seq_num(seq_num):
+            val = self.get_block_blob_by_dot(chain_id, dot)
+            if not val:
+                raise Exception("No block", chain_id, dot)
+            yield val
 
     def _find_first_conflicting_point(
         self, conf_dict: Dict, chain: BaseChain
@@ -179,69 +412,192 @@ class DBManager(BaseDB):
                 return {Dot((sn, k)) for k in diff_val}, to_request
         return set(), to_request
 
-    def _process_conflicting(
+    def _process_conflict(
         self,
         chain: BaseChain,
         chain_id: bytes,
-        conflict_dict: Dict[Dot, Dict[int, Tuple[ShortKey]]],
+        conf_dot: Dot,
+        conf_dict: Dict[int, Tuple[ShortKey]],
         val_to_request: Set,
-    ):
-        # for c in conflict_dict:
-        #    val = self.get_block_blob_by_dot(chain_id, c)
-        #    if not val:
-        #        raise Exception("No block", chain_id, c)
-        #    yield val
-        for conf_dot, conf_dict in conflict_dict.items():
-            if not conf_dict:
-                val = self.get_block_blob_by_dot(chain_id, conf_dot)
-                if val:
-                    yield val
-                continue
-            current_point, to_request = self._find_first_conflicting_point(
-                conf_dict, chain
-            )
-            val_to_request.update(to_request)
-            while (
-                current_point
-                and max(current_point)[0] < conf_dot[0]
-                and conf_dot not in current_point
-            ):
-                new_point = set()
-                for d in current_point:
-                    val = self.get_block_blob_by_dot(chain_id, d)
-                    if not val:
-                        continue
-                    yield val
-                    l = chain.get_next_links(d)
-                    if l:
-                        new_point.update(set(l))
-                current_point = new_point
+    ) -> Iterable[bytes]:
+        if not conf_dict:
             val = self.get_block_blob_by_dot(chain_id, conf_dot)
             if val:
                 yield val
-
-    def get_block_blobs_by_frontier_diff(
+            return
+        current_point, to_request = self._find_first_conflicting_point(conf_dict, chain)
+        val_to_request.update(to_request)
+        while (
+            current_point
+            and max(current_point)[0] < conf_dot[0]
+            and conf_dot not in current_point
+        ):
+            new_point = set()
+            for d in current_point:
+                val = self.get_block_blob_by_dot(chain_id, d)
+                if not val:
+                    continue
+                yield val
+                l = chain.get_next_links(d)
+                if l:
+                    new_point.update(set(l))
+            current_point = new_point
+        val = self.get_block_blob_by_dot(chain_id, conf_dot)
+        if val:
+            yield val
+
+    def iterate_block_blobs_by_frontier_diff(
         self, chain_id: bytes, frontier_diff: FrontierDiff, vals_to_request: Set
-    ) -> Iterable[bytes]:
+    ) -> Iterator[Tuple[FrontierCursor, List[bytes]]]:
+        """
+        Lazily yield the blocks requested with a frontier diff: the blocks of each missing
+        sequence number, in sequence order, then the blocks of each conflict. Every block is
+        yielded once, together with the cursor to continue the request from it.
+        """
         chain = self.get_chain(chain_id)
-        if chain:
-            # Processing missing holes
-            blks = set(
-                self._process_missing_seq_num(
-                    chain, chain_id, expand_ranges(frontier_diff.missing)
+        if not chain:
+            return
+        sent = set()
+        # All lookups of the request share one read transaction
+        with self.block_store.read_batch():
+            # Missing sequence numbers first, in sequence order. Only the ones the chain has
+            # are visited, whatever the size of the requested ranges.
+            missing = expand_ranges(frontier_diff.missing) & chain.known_seq_nums()
+            for seq_num in missing:
+                blobs = self._unique(
+                    self._process_seq_num(chain, chain_id, seq_num), sent
                 )
-            )
-            blks.update(
-                set(
-                    self._process_conflicting(
-                        chain, chain_id, frontier_diff.conflicts, vals_to_request
-                    )
+                if blobs:
+                    yield FrontierCursor(seq_num, None), blobs
+            for conf_dot, conf_dict in frontier_diff.conflicts.items():
+                blobs = self._unique(
+                    self._process_conflict(
+                        chain, chain_id, conf_dot, conf_dict, vals_to_request
+                    ),
+                    sent,
                 )
+                if blobs:
+                    yield FrontierCursor(None, conf_dot), blobs
+
+    @staticmethod
+    def _unique(blobs: Iterable[bytes], sent: Set[bytes]) -> List[bytes]:
+        unique = []
+        for blob in blobs:
+            if blob not in sent:
+                sent.add(blob)
+                unique.append(blob)
+        return unique
+
+    def get_block_blobs_page(
+        self,
+        chain_id: bytes,
+        frontier_diff: FrontierDiff,
+        vals_to_request: Set,
+        max_bytes: int,
+        max_count: int,
+    ) -> Tuple[List[bytes], Optional[FrontierDiff]]:
+        page = []
+        page_bytes = 0
+        with self.lock, closing(
+            self.iterate_block_blobs_by_frontier_diff(
+                chain_id, frontier_diff, vals_to_request
             )
-            return blks
-        return []
+        ) as groups:
+            for cursor, blobs in groups:
+                blobs_bytes = sum(len(blob) for blob in blobs)
+                if page and (
+                    len(page) + len(blobs) > max_count
+                    or page_bytes + blobs_bytes > max_bytes
+                ):
+                    known = self.get_chain(chain_id).known_seq_nums()
+                    return page, cursor.remaining(frontier_diff, known)
+                page.extend(blobs)
+                page_bytes += blobs_bytes
+        return page, None
+
+    def get_block_blobs_by_frontier_diff(
+        self, chain_id: bytes, frontier_diff: FrontierDiff, vals_to_request: Set
+    ) -> List[bytes]:
+        with self.lock:
+            return [
+                blob
+                for _, blobs in self.iterate_block_blobs_by_frontier_diff(
+                    chain_id, frontier_diff, vals_to_request
+                )
+                for blob in blobs
+            ]
+
+    def checkpoint(self) -> None:
+        with self.lock:
+            if not self.dirty_chains:
+                return
+            # Most chains only store their changes since the last checkpoint
+            chain_states, chain_deltas = {}, {}
+            for chain_id in self.dirty_chains:
+                full, state = self.chains[chain_id].checkpoint_state(
+                    chain_id in self.lost_checkpoints
+                )
+                (chain_states if full else chain_deltas)[chain_id] = state
+            try:
+                self.block_store.save_checkpoint(chain_states, chain_deltas)
+            except Exception:
+                # The changes are no longer tracked by the chains
+                self.lost_checkpoints.update(self.dirty_chains)
+                raise
+            self.lost_checkpoints.clear()
+            self.dirty_chains.clear()
+
+    def prune(self, finalized: Dict[bytes, int]) -> int:
+        num_deleted = 0
+        with self.lock, self.block_store.write_batch():
+            for chain_id, seq_num in finalized.items():
+                chain = self.get_chain(chain_id)
+                if not chain:
+                    continue
+                pruned = chain.prune(seq_num)
+                if pruned:
+                    self.dirty_chains.add(chain_id)
+                for dot in pruned:
+                    num_deleted += self._prune_dot(chain_id, dot)
+            # Restart must not replay the blocks that are left over the pruned history
+            self.checkpoint()
+        return num_deleted
+
+    def _prune_dot(self, chain_id: bytes, block_dot: Dot) -> bool:
+        """Delete the dot of a pruned block. The block itself is deleted once it is
+        pruned in both its personal and community chain."""
+        dot_id = chain_id + encode_raw(block_dot)
+        with self.blob_cache_lock:
+            self.blob_cache.pop((chain_id, tuple(block_dot)), None)
+        block_hash = self.block_store.get_hash_by_dot(dot_id)
+        self.block_store.delete_dot(dot_id)
+        if not block_hash:
+            return False
+
+        with self.block_store.get_block_buffer(block_hash) as block_buffer:
+            if block_buffer is None:
+                return False
+            block = PlexusBlockView(block_buffer, block_hash)
+            pers, com = self._get_chain_ids(block)
+            for other_id, seq_num in (
+                (pers, block.sequence_number),
+                (com, block.com_seq_num),
+            ):
+                other = self.get_chain(other_id)
+                if other and seq_num >= other.pruned_seq_num:
+                    return False
+            # The buffer is invalid once the block is deleted
+            index_keys = list(self._index_keys(block))
+        self.block_store.delete_block(block_hash)
+        for index, key in index_keys:
+            self.block_store.delete_index_key(index, key, block_hash)
+        return True
+
+    async def compact(self) -> bool:
+        return await self.block_store.compact()
 
     def close(self) -> None:
+        self.checkpoint()
         self.block_store.close()
 
     @property
@@ -256,12 +612,36 @@ class DBManager(BaseDB):
         return self.chains.get(chain_id)
 
     def get_block_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
+        val = self.get_block_hash_and_blob_by_dot(chain_id, block_dot)
+        return val[1] if val else None
+
+    def get_block_hash_and_blob_by_dot(
+        self, chain_id: bytes, block_dot: Dot
+    ) -> Optional[Tuple[bytes, bytes]]:
+        cache_key = (chain_id, tuple(block_dot))
+        with self.blob_cache_lock:
+            val = self.blob_cache.get(cache_key)
+            if val is not None:
+                self.blob_cache_hits += 1
+                return val
+            self.blob_cache_misses += 1
+
         dot_id = chain_id + encode_raw(block_dot)
         blk_hash = self.block_store.get_hash_by_dot(dot_id)
         if blk_hash:
-            return self.block_store.get_block_by_hash(blk_hash)
-        else:
-            return None
+            blob = self.block_store.get_block_by_hash(blk_hash)
+            if blob:
+                self._cache_blob(cache_key, blk_hash, blob)
+                return blk_hash, blob
+        return None
+
+    def _cache_blob(
+        self, cache_key: Tuple[bytes, Dot], block_hash: bytes, blob: bytes
+    ) -> None:
+        # Blobs larger than the whole cache are not cached
+        if len(blob) <= self.blob_cache.maxsize:
+            with self.blob_cache_lock:
+                self.blob_cache[cache_key] = (block_hash, blob)
 
     def get_tx_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
         dot_id = chain_id + encode_raw(block_dot)
@@ -284,15 +664,110 @@ class DBManager(BaseDB):
 
     def add_block(self, block_blob: bytes, block: PlexusBlock) -> None:
 
-        block_hash = block.hash
-        block_tx = block.transaction
+        with self.lock, self.block_store.write_batch():
+            self._add_block(block_blob, block)
+
+    def add_blocks(self, blocks: Iterable[Tuple[bytes, PlexusBlock]]) -> None:
+        """Add a batch of blocks in a single write batch. Every chain ingests its blocks in one pass,
+        and its subscribers are notified once with all dots that became consistent."""
+        chain_blocks = defaultdict(list)
+        chain_topics = defaultdict(dict)
+        chain_dots = {}
+        with self.lock, self.block_store.write_batch():
+            for block_blob, block in blocks:
+                block_hash = block.hash
+                if self.has_block(block_hash):
+                    # Stored before or earlier in the batch: the chains have it
+                    continue
+                self._persist_block(block_blob, block)
+
+                pers, com = self._get_chain_ids(block)
+                chain_blocks[pers].append(
+                    (block.previous, block.sequence_number, block_hash)
+                )
+                pers_block_dot = Dot((block.sequence_number, block.short_hash))
+                self.block_store.add_dot(pers + encode_raw(pers_block_dot), block_hash)
+                self._cache_blob((pers, pers_block_dot), block_hash, block_blob)
+                # Dicts keep the topics unique, in the order of the single block path
+                chain_topics[pers].update(
+                    {ChainTopic.ALL: None, ChainTopic.PERSONAL: None, pers: None}
+                )
 
-        # 1. Add block blob and transaction blob to the block storage
+                if com == pers:
+                    chain_topics[com][ChainTopic.GROUP] = None
+                elif com != EMPTY_PK:
+                    chain_blocks[com].append(
+                        (block.links, block.com_seq_num, block_hash)
+                    )
+                    com_block_dot = Dot((block.com_seq_num, block.short_hash))
+                    self.block_store.add_dot(
+                        com + encode_raw(com_block_dot), block_hash
+                    )
+                    self._cache_blob((com, com_block_dot), block_hash, block_blob)
+                    chain_topics[com].update(
+                        {ChainTopic.ALL: None, ChainTopic.GROUP: None, com: None}
+                    )
+
+            # The chains stored in the block store write their entries in the same batch
+            for chain_id, blocks_info in chain_blocks.items():
+                if chain_id not in self.chains:
+                    self.chains[chain_id] = self.chain_factory.create_chain(chain_id)
+                chain_dots[chain_id] = self.chains[chain_id].add_blocks(blocks_info)
+                self.dirty_chains.add(chain_id)
+
+        for chain_id, dots_list in chain_dots.items():
+            if dots_list:
+                for topic in chain_topics[chain_id]:
+                    self.notify(topic, chain_id=chain_id, dots=dots_list)
+
+    def _persist_block(self, block_blob: bytes, block: PlexusBlock) -> None:
+        block_hash = block.hash
         self.block_store.add_block(block_hash, block_blob)
-        self.block_store.add_tx(block_hash, block_tx)
+        self.block_store.add_tx(block_hash, block.transaction)
         self.block_store.add_extra(block_hash, encode_raw({b"type": block.type}))
-
-        # 2. There are two chains: personal and community chain
+        if self.indexed:
+            self._index_block(block_hash, block)
+
+    def _index_block(self, block_hash: bytes, block: PlexusBlock) -> None:
+        for index, key in self._index_keys(block):
+            self.block_store.add_index_key(index, key, block_hash)
+
+    def _index_keys(self, block: PlexusBlock) -> Iterator[Tuple[bytes, bytes]]:
+        yield INDEX_PUBLIC_KEY, index_key(block.public_key, block.sequence_number)
+        if block.com_id != EMPTY_PK:
+            _, com = self._get_chain_ids(block)
+            yield INDEX_COMMUNITY, index_key(com, block.com_seq_num)
+        yield INDEX_TYPE, index_key(block.type, block.timestamp)
+
+    def _iterate_index(
+        self, index: bytes, value: bytes, start: int, end: Optional[int]
+    ) -> Iterator[bytes]:
+        end_key = struct.pack(">Q", end + 1) if end is not None else None
+        # The scan and the block lookups share one read transaction
+        with self.block_store.read_batch():
+            for _, block_hash in self.block_store.iterate_index(
+                index, index_prefix(value), struct.pack(">Q", start), end_key
+            ):
+                yield self.block_store.get_block_by_hash(block_hash)
+
+    def iterate_blocks_by_public_key(
+        self, public_key: bytes, start_seq: int = GENESIS_SEQ, end_seq: int = None
+    ) -> Iterator[bytes]:
+        return self._iterate_index(INDEX_PUBLIC_KEY, public_key, start_seq, end_seq)
+
+    def iterate_blocks_by_community(
+        self, com_id: bytes, start_seq: int = GENESIS_SEQ, end_seq: int = None
+    ) -> Iterator[bytes]:
+        return self._iterate_index(INDEX_COMMUNITY, com_id, start_seq, end_seq)
+
+    def iterate_blocks_by_type(
+        self, block_type: bytes, start_time: int = 0, end_time: int = None
+    ) -> Iterator[bytes]:
+        return self._iterate_index(INDEX_TYPE, block_type, start_time, end_time)
+
+    @staticmethod
+    def _get_chain_ids(block: PlexusBlock) -> Tuple[bytes, bytes]:
+        """Ids of the personal and the community chain of the block"""
         pers = block.public_key
         com = block.com_id
 
@@ -301,17 +776,34 @@ class DBManager(BaseDB):
             com = block.com_prefix + com
         else:
             com = block.com_prefix + com
+        return pers, com
+
+    def _add_block(
+        self, block_blob: bytes, block: PlexusBlock, persist: bool = True
+    ) -> None:
+        """Add block to the chains. If persist is False, the block is already in the block store."""
+        block_hash = block.hash
+
+        # 1. Add block blob and transaction blob to the block storage
+        if persist:
+            self._persist_block(block_blob, block)
+
+        # 2. There are two chains: personal and community chain
+        pers, com = self._get_chain_ids(block)
 
         # 2.1: Process the block wrt personal chain
         if pers not in self.chains:
-            self.chains[pers] = self.chain_factory.create_chain()
+            self.chains[pers] = self.chain_factory.create_chain(pers)
 
         pers_block_dot = Dot((block.sequence_number, block.short_hash))
         pers_dots_list = self.chains[pers].add_block(
             block.previous, block.sequence_number, block_hash
         )
-        full_dot_id = pers + encode_raw(pers_block_dot)
-        self.block_store.add_dot(full_dot_id, block_hash)
+        self.dirty_chains.add(pers)
+        if persist:
+            full_dot_id = pers + encode_raw(pers_block_dot)
+            self.block_store.add_dot(full_dot_id, block_hash)
+            self._cache_blob((pers, pers_block_dot), block_hash, block_blob)
         # TODO: add more chain topic
 
         # Notify subs of the personal chain
@@ -327,13 +819,16 @@ class DBManager(BaseDB):
                 self.notify(ChainTopic.GROUP, chain_id=com, dots=pers_dots_list)
             else:
                 if com not in self.chains:
-                    self.chains[com] = self.chain_factory.create_chain()
+                    self.chains[com] = self.chain_factory.create_chain(com)
                 com_block_dot = Dot((block.com_seq_num, block.short_hash))
                 com_dots_list = self.chains[com].add_block(
                     block.links, block.com_seq_num, block_hash
                 )
-                full_dot_id = com + encode_raw(com_block_dot)
-                self.block_store.add_dot(full_dot_id, block_hash)
+                self.dirty_chains.add(com)
+                if persist:
+                    full_dot_id = com + encode_raw(com_block_dot)
+                    self.block_store.add_dot(full_dot_id, block_hash)
+                    self._cache_blob((com, com_block_dot), block_hash, block_blob)
 
                 self.notify(ChainTopic.ALL, chain_id=com, dots=com_dots_list)
                 self.notify(ChainTopic.GROUP, chain_id=com, dots=com_dots_list)
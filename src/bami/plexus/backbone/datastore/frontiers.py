@@ -1,18 +1,66 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, Tuple
+import struct
+from typing import Any, Dict, Iterable, Tuple
+import zlib
 
+from ipv8.messaging.serialization import PackError
+from msgpack import UnpackException
+
+from bami.plexus.backbone.exceptions import UnknownFrontierBaseException
 from bami.plexus.backbone.utils import (
     decode_raw,
     Dot,
     encode_raw,
-    expand_ranges,
     Links,
     Ranges,
     ShortKey,
 )
 
+# Versions of the compact wire format. Messages of the previous msgpack format start with a map.
+COMPACT_FULL = 1
+COMPACT_DELTA = 2
+# First bytes of a msgpack map: fixmap, map 16 and map 32
+MSGPACK_MAP = frozenset(range(0x80, 0x90)) | {0xDE, 0xDF}
+
+TERMINAL_CHANGED = 1
+HOLES_CHANGED = 2
+INCONSISTENCIES_CHANGED = 4
+
+BASE_FINGERPRINT = struct.Struct(">I")
+
+
+def check_version(raw: bytes) -> int:
+    """First byte of the message: the version of the compact format, or a msgpack map"""
+    if not raw:
+        raise PackError("Empty frontier message")
+    version = raw[0]
+    if version not in (COMPACT_FULL, COMPACT_DELTA) and version not in MSGPACK_MAP:
+        raise PackError("Unknown frontier format {}".format(version))
+    return version
+
+
+def decode_legacy(raw: bytes) -> Dict:
+    """Decode a message in the previous msgpack format"""
+    try:
+        val = decode_raw(raw)
+    except (ValueError, UnpackException) as e:
+        raise PackError("Malformed frontier message") from e
+    if not isinstance(val, dict):
+        raise PackError("Malformed frontier message")
+    return val
+
+
+def check_ranges(vals: Any) -> Ranges:
+    """Ranges of a legacy message: pairs with the start not after the end"""
+    try:
+        if all(start <= end for start, end in vals):
+            return Ranges(tuple(vals))
+    except (TypeError, ValueError) as e:
+        raise PackError("Malformed ranges in frontier message") from e
+    raise PackError("Inverted range in frontier message")
+
 
 def convert_to_tuple_list(val):
     return tuple(tuple(t) for t in val)
@@ -22,21 +70,258 @@ def convert_to_tuple_dict(val):
     return dict((k, tuple(v)) for k, v in val.items())
 
 
-@dataclass
+class CompactEncoder:
+    """Writer of the compact format: varint numbers and short hashes deduplicated in a table.
+
+    Sequence numbers are written as zigzag varint deltas to the previous one, so sorted dots
+    and ranges near the reference sequence number take one or two bytes.
+    """
+
+    def __init__(self, base_hashes: Iterable[ShortKey] = ()) -> None:
+        self.body = bytearray()
+        self.hash_index = {h: i for i, h in enumerate(base_hashes)}
+        self.new_hashes = []
+
+    def varint(self, val: int) -> None:
+        if val < 0x80:
+            self.body.append(val)
+            return
+        while val > 0x7F:
+            self.body.append((val & 0x7F) | 0x80)
+            val >>= 7
+        self.body.append(val)
+
+    def signed(self, val: int) -> None:
+        self.varint(val << 1 if val >= 0 else (-val << 1) - 1)
+
+    def hash(self, short_hash: ShortKey) -> None:
+        index = self.hash_index.get(short_hash)
+        if index is None:
+            index = len(self.hash_index)
+            self.hash_index[short_hash] = index
+            self.new_hashes.append(short_hash)
+        self.varint(index)
+
+    def dots(self, links: Links, prev_seq: int = 0) -> None:
+        self.varint(len(links))
+        for seq_num, short_hash in links:
+            self.signed(seq_num - prev_seq)
+            self.hash(short_hash)
+            prev_seq = seq_num
+
+    def ranges(self, vals: Ranges, prev_seq: int = 0) -> None:
+        self.varint(len(vals))
+        for start, end in vals:
+            self.signed(start - prev_seq)
+            self.varint(end - start)
+            prev_seq = end
+
+    def to_bytes(self, header: bytes) -> bytes:
+        """Message with the header, the table of new hashes and the body"""
+        body = self.body
+        self.body = bytearray(header)
+        self.varint(len(self.new_hashes))
+        for short_hash in self.new_hashes:
+            self.varint(len(short_hash))
+            self.body += short_hash
+        self.body += body
+        return bytes(self.body)
+
+
+class CompactDecoder:
+    """Reader of the compact format. Parses the message in place through a memoryview.
+
+    Raises:
+        PackError: if the message is truncated or refers to an unknown hash
+    """
+
+    def __init__(
+        self, raw: bytes, pos: int, base_hashes: Iterable[ShortKey] = ()
+    ) -> None:
+        self.buf = memoryview(raw)
+        self.pos = pos
+        self.hashes = list(base_hashes)
+        for _ in range(self.varint()):
+            hash_len = self.varint()
+            if self.pos + hash_len > len(self.buf):
+                raise PackError("Compact message is truncated")
+            self.hashes.append(
+                ShortKey(bytes(self.buf[self.pos : self.pos + hash_len]))
+            )
+            self.pos += hash_len
+
+    def varint(self) -> int:
+        try:
+            val = self.buf[self.pos]
+            if val < 0x80:
+                self.pos += 1
+                return val
+            val = shift = 0
+            while True:
+                byte = self.buf[self.pos]
+                self.pos += 1
+                val |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    return val
+                shift += 7
+        except IndexError as e:
+            raise PackError("Compact message is truncated") from e
+
+    def signed(self) -> int:
+        val = self.varint()
+        return val >> 1 if not val & 1 else -((val + 1) >> 1)
+
+    def hash(self) -> ShortKey:
+        index = self.varint()
+        if index >= len(self.hashes):
+            raise PackError("Unknown hash index {}".format(index))
+        return self.hashes[index]
+
+    def dots(self, prev_seq: int = 0) -> Links:
+        dots = []
+        for _ in range(self.varint()):
+            prev_seq += self.signed()
+            dots.append((prev_seq, self.hash()))
+        return Links(tuple(dots))
+
+    def ranges(self, prev_seq: int = 0) -> Ranges:
+        vals = []
+        for _ in range(self.varint()):
+            start = prev_seq + self.signed()
+            prev_seq = start + self.varint()
+            vals.append((start, prev_seq))
+        return Ranges(tuple(vals))
+
+
+@dataclass(frozen=True)
 class Frontier:
+    """Immutable frontier of a chain. Comparison inputs and the hash are computed on creation."""
+
+    __slots__ = (
+        "terminal",
+        "holes",
+        "inconsistencies",
+        "max_seq_num",
+        "num_holes",
+        "_hash",
+        "_fingerprint",
+    )
+
     terminal: Links
     holes: Ranges
     inconsistencies: Links
 
-    def to_bytes(self) -> bytes:
-        return encode_raw(
-            {b"t": self.terminal, b"h": self.holes, b"i": self.inconsistencies}
+    def __post_init__(self) -> None:
+        # Frozen dataclass: derived values are set through object.__setattr__
+        object.__setattr__(
+            self, "max_seq_num", max(self.terminal)[0] if self.terminal else 0
+        )
+        object.__setattr__(
+            self, "num_holes", sum(end - start + 1 for start, end in self.holes)
         )
+        object.__setattr__(
+            self, "_hash", hash((self.terminal, self.holes, self.inconsistencies))
+        )
+        object.__setattr__(self, "_fingerprint", None)
+
+    def __reduce__(self) -> Tuple:
+        return self.__class__, (self.terminal, self.holes, self.inconsistencies)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, Frontier):
+            return NotImplemented
+        return (
+            self._hash == other._hash
+            and self.terminal == other.terminal
+            and self.holes == other.holes
+            and self.inconsistencies == other.inconsistencies
+        )
+
+    def to_bytes(self, base: Frontier = None) -> bytes:
+        """Encode the frontier in the compact format.
+
+        Args:
+            base: Frontier last sent to the same peer. If given, only the changes to it are encoded.
+        """
+        if base is None:
+            encoder = CompactEncoder()
+            encoder.dots(self.terminal)
+            encoder.ranges(self.holes)
+            encoder.dots(self.inconsistencies)
+            return encoder.to_bytes(bytes((COMPACT_FULL,)))
+
+        encoder = CompactEncoder(base.hashes())
+        base_seq = base.max_seq_num
+        changed = 0
+        if self.terminal != base.terminal:
+            changed |= TERMINAL_CHANGED
+            encoder.dots(self.terminal, base_seq)
+        if self.holes != base.holes:
+            changed |= HOLES_CHANGED
+            encoder.ranges(self.holes, base_seq)
+        if self.inconsistencies != base.inconsistencies:
+            changed |= INCONSISTENCIES_CHANGED
+            encoder.dots(self.inconsistencies, base_seq)
+        header = bytes((COMPACT_DELTA,)) + base.fingerprint() + bytes((changed,))
+        return encoder.to_bytes(header)
 
     @classmethod
-    def from_bytes(cls, bytes_frontier: bytes):
-        front_dict = decode_raw(bytes_frontier)
-        return cls(front_dict.get(b"t"), front_dict.get(b"h"), front_dict.get(b"i"),)
+    def from_bytes(cls, bytes_frontier: bytes, base: Frontier = None):
+        """Decode a frontier in the compact or in the previous msgpack format.
+
+        Args:
+            base: Frontier last received from the same peer, required to decode a delta.
+
+        Raises:
+            UnknownFrontierBaseException: if the delta is not relative to the given base
+            PackError: if the frontier is malformed or in an unknown format
+        """
+        version = check_version(bytes_frontier)
+        if version == COMPACT_FULL:
+            decoder = CompactDecoder(bytes_frontier, 1)
+            return cls(decoder.dots(), decoder.ranges(), decoder.dots())
+        if version == COMPACT_DELTA:
+            fingerprint_end = 1 + BASE_FINGERPRINT.size
+            if base is None or base.fingerprint() != bytes_frontier[1:fingerprint_end]:
+                raise UnknownFrontierBaseException("Frontier delta to unknown base")
+            if len(bytes_frontier) <= fingerprint_end:
+                raise PackError("Compact message is truncated")
+            changed = bytes_frontier[fingerprint_end]
+            if not changed:
+                return base
+            decoder = CompactDecoder(bytes_frontier, fingerprint_end + 1, base.hashes())
+            base_seq = base.max_seq_num
+            return cls(
+                decoder.dots(base_seq) if changed & TERMINAL_CHANGED else base.terminal,
+                decoder.ranges(base_seq) if changed & HOLES_CHANGED else base.holes,
+                decoder.dots(base_seq)
+                if changed & INCONSISTENCIES_CHANGED
+                else base.inconsistencies,
+            )
+        front_dict = decode_legacy(bytes_frontier)
+        return cls(
+            front_dict.get(b"t"),
+            check_ranges(front_dict.get(b"h")),
+            front_dict.get(b"i"),
+        )
+
+    def hashes(self) -> Iterable[ShortKey]:
+        """Short hashes of the frontier, in the order of the compact hash table"""
+        return dict.fromkeys(h for _, h in self.terminal + self.inconsistencies).keys()
+
+    def fingerprint(self) -> bytes:
+        """Checksum of the frontier, to verify a delta refers to the same base"""
+        if self._fingerprint is None:
+            checksum = zlib.crc32(
+                encode_raw((self.terminal, self.holes, self.inconsistencies))
+            )
+            object.__setattr__(self, "_fingerprint", BASE_FINGERPRINT.pack(checksum))
+        return self._fingerprint
 
     def __gt__(self, other: Frontier) -> bool:
         """Frontier is older if one of these holds:
@@ -45,12 +330,10 @@ class Frontier:
           - holds less inconsistencies
           - has more terminal nodes
           """
-        newer = max(self.terminal)[0] > max(other.terminal)[0]
+        newer = self.max_seq_num > other.max_seq_num
 
-        not_more_holes = len(expand_ranges(self.holes)) <= len(
-            expand_ranges(other.holes)
-        )
-        less_holes = len(expand_ranges(self.holes)) < len(expand_ranges(other.holes))
+        not_more_holes = self.num_holes <= other.num_holes
+        less_holes = self.num_holes < other.num_holes
         less_inconsistent = len(self.inconsistencies) < len(other.inconsistencies)
         not_more_inconsistent = len(self.inconsistencies) <= len(other.inconsistencies)
         more_details_known = len(self.terminal) > len(other.terminal)
@@ -69,12 +352,53 @@ class FrontierDiff:
     conflicts: Dict[Dot, Dict[int, Tuple[ShortKey]]]
 
     def to_bytes(self) -> bytes:
-        return encode_raw({b"m": self.missing, b"c": self.conflicts})
+        encoder = CompactEncoder()
+        encoder.ranges(self.missing)
+        encoder.varint(len(self.conflicts))
+        prev_seq = 0
+        for (seq_num, short_hash), extra_dots in self.conflicts.items():
+            encoder.signed(seq_num - prev_seq)
+            encoder.hash(short_hash)
+            prev_seq = seq_num
+            encoder.varint(len(extra_dots))
+            for extra_seq, extra_hashes in extra_dots.items():
+                encoder.signed(extra_seq - prev_seq)
+                encoder.varint(len(extra_hashes))
+                for extra_hash in extra_hashes:
+                    encoder.hash(extra_hash)
+        return encoder.to_bytes(bytes((COMPACT_FULL,)))
 
     @classmethod
     def from_bytes(cls, bytes_frontier: bytes):
-        val_dict = decode_raw(bytes_frontier)
-        return cls(val_dict.get(b"m"), val_dict.get(b"c"))
+        """Decode a frontier diff in the compact or in the previous msgpack format.
+
+        Raises:
+            PackError: if the frontier diff is malformed or in an unknown format
+        """
+        if check_version(bytes_frontier) != COMPACT_FULL:
+            val_dict = decode_legacy(bytes_frontier)
+            return cls(check_ranges(val_dict.get(b"m")), val_dict.get(b"c"))
+
+        decoder = CompactDecoder(bytes_frontier, 1)
+        missing = decoder.ranges()
+        conflicts = {}
+        prev_seq = 0
+        for _ in range(decoder.varint()):
+            prev_seq += decoder.signed()
+            conflict_dot = (prev_seq, decoder.hash())
+            extra_dots = conflicts[conflict_dot] = {}
+            for _ in range(decoder.varint()):
+                extra_seq = prev_seq + decoder.signed()
+                extra_dots[extra_seq] = tuple(
+                    decoder.hash() for _ in range(decoder.varint())
+                )
+        return cls(missing, conflicts)
 
     def is_empty(self):
         return len(self.missing) == 0 and len(self.conflicts) == 0
+
+    def num_blocks(self) -> int:
+        """Lower bound of the number of blocks requested with the diff"""
+        return sum(end - start + 1 for start, end in self.missing) + len(
+            self.conflicts
+        )
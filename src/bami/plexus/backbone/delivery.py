@@ -0,0 +1,118 @@
+"""
+In-order delivery of the blocks of each chain to its subscribers.
+"""
+from collections import deque
+import logging
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import cachetools
+
+from bami.plexus.backbone.block import PlexusBlock
+from bami.plexus.backbone.utils import Dot, Notifier
+
+
+class OrderedDelivery(object):
+    """
+    Queue of the blocks to deliver in order, per chain.
+
+    The blocks of a chain are queued when they become consistent, and handed to the subscribers
+    of the chain in batches: block callbacks are called for every block of the batch, batch
+    callbacks once with the whole batch. The recently decoded blocks are kept, so delivering
+    them does not read the block store again.
+
+    A block that cannot be loaded, or a subscriber that fails, is logged and skipped: the other
+    blocks and subscribers are still delivered.
+    """
+
+    _logger = logging.getLogger("OrderedDelivery")
+
+    def __init__(
+        self,
+        load_block: Callable[[bytes, Dot], PlexusBlock],
+        cache_size: int = 10_000,
+        batch_size: int = 256,
+    ) -> None:
+        self.load_block = load_block
+        self.batch_size = batch_size
+        self.block_callbacks = Notifier()
+        self.batch_callbacks = Notifier()
+        # Dots, and decoded blocks if known, waiting for delivery per chain id
+        self.queues: Dict[bytes, Deque[Tuple[Dot, Optional[PlexusBlock]]]] = {}
+        # Chains with a delivery in progress, to keep the order on re-entrant calls
+        self.delivering: Set[bytes] = set()
+        # Recently decoded blocks, by short hash
+        self.decoded = cachetools.LRUCache(cache_size)
+
+    def add_block_callback(
+        self, chain_id: bytes, callback: Callable[[PlexusBlock], None]
+    ) -> None:
+        self.block_callbacks.add_observer(chain_id, callback)
+
+    def add_batch_callback(
+        self, chain_id: bytes, callback: Callable[[List[PlexusBlock]], None]
+    ) -> None:
+        self.batch_callbacks.add_observer(chain_id, callback)
+
+    def remember(self, block: PlexusBlock) -> None:
+        self.decoded[block.short_hash] = block
+
+    def put(self, chain_id: bytes, dots: List[Dot]) -> None:
+        queue = self.queues.setdefault(chain_id, deque())
+        for dot in dots:
+            block = self.decoded.get(dot[1])
+            if block is not None and dot[0] not in (
+                block.com_seq_num,
+                block.sequence_number,
+            ):
+                block = None
+            queue.append((dot, block))
+
+    def backlog(self, chain_id: bytes) -> int:
+        """Number of blocks of the chain waiting for delivery"""
+        queue = self.queues.get(chain_id)
+        return len(queue) if queue else 0
+
+    def pending_chains(self) -> List[bytes]:
+        return [chain_id for chain_id, queue in self.queues.items() if queue]
+
+    def deliver(self, chain_id: bytes, max_blocks: int = None) -> int:
+        """Deliver up to max_blocks queued blocks of the chain, in batches.
+        Returns the number of blocks delivered."""
+        queue = self.queues.get(chain_id)
+        if not queue or chain_id in self.delivering:
+            # The running delivery continues with the queued blocks
+            return 0
+        self.delivering.add(chain_id)
+        delivered = 0
+        try:
+            while queue and (max_blocks is None or delivered < max_blocks):
+                size = min(len(queue), self.batch_size)
+                if max_blocks is not None:
+                    size = min(size, max_blocks - delivered)
+                batch = []
+                for _ in range(size):
+                    dot, block = queue.popleft()
+                    if block is None:
+                        try:
+                            block = self.load_block(chain_id, dot)
+                        except Exception:
+                            self._logger.exception(
+                                "Failed to load block %s of chain %s", dot, chain_id
+                            )
+                            continue
+                    batch.append(block)
+                delivered += len(batch)
+                for block in batch:
+                    self._notify(self.block_callbacks, chain_id, block)
+                if batch:
+                    self._notify(self.batch_callbacks, chain_id, batch)
+        finally:
+            self.delivering.discard(chain_id)
+        return delivered
+
+    def _notify(self, callbacks: Notifier, chain_id: bytes, arg: Any) -> None:
+        for callback in callbacks.observers.get(chain_id, ()):
+            try:
+                callback(arg)
+            except Exception:
+                self._logger.exception("Subscriber of chain %s failed", chain_id)
@@ -20,3 +20,7 @@ class IPv8UnavailableException(Exception):
 
 class UnknownChainException(Exception):
     pass
+
+
+class UnknownFrontierBaseException(Exception):
+    pass
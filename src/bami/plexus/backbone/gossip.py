@@ -1,25 +1,60 @@
 from __future__ import annotations
 
 from abc import ABC, ABCMeta, abstractmethod
-from asyncio import Queue, sleep
-from random import sample, shuffle
-from typing import Iterable, Union
+from random import sample
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 from bami.plexus.backbone.community_routines import (
     CommunityRoutines,
     MessageStateMachine,
 )
 from bami.plexus.backbone.datastore.frontiers import Frontier, FrontierDiff
+from bami.plexus.backbone.exceptions import UnknownFrontierBaseException
 from bami.plexus.backbone.payload import (
     BlocksRequestPayload,
+    BlocksResponseCursorPayload,
     FrontierPayload,
     FrontierResponsePayload,
+    MultiFrontierPayload,
     RawBlockPayload,
 )
 from bami.plexus.backbone.sub_community import SubCommunityRoutines
+from bami.plexus.backbone.utils import (
+    decode_raw,
+    Dot,
+    encode_raw,
+    expand_ranges,
+    GENESIS_LINK,
+    IndexedSet,
+)
 from ipv8.lazy_community import lazy_wrapper
+from ipv8.messaging.serialization import PackError
 from ipv8.peer import Peer
 
+GENESIS_FRONTIER = Frontier(terminal=GENESIS_LINK, holes=(), inconsistencies=())
+# Encoding overhead of a (chain_id, frontier) pair in a bundle, at most
+BUNDLE_ENTRY_OVERHEAD = 7
+
+
+def bundle_frontiers(
+    frontiers: Iterable[Tuple[bytes, bytes]], max_bytes: int
+) -> List[bytes]:
+    """Encode the (chain_id, frontier) pairs in as few bundles as fit in max_bytes each.
+    A pair that exceeds max_bytes alone is sent in its own bundle."""
+    bundles = []
+    bundle, size = [], 0
+    for chain_id, frontier in frontiers:
+        entry_size = len(chain_id) + len(frontier) + BUNDLE_ENTRY_OVERHEAD
+        if bundle and size + entry_size > max_bytes:
+            bundles.append(encode_raw(bundle))
+            bundle, size = [], 0
+        bundle.append((chain_id, frontier))
+        size += entry_size
+    if bundle:
+        bundles.append(encode_raw(bundle))
+    return bundles
+
 
 class NextPeerSelectionStrategy(ABC):
     @abstractmethod
@@ -39,6 +74,10 @@ class NextPeerSelectionStrategy(ABC):
         """
         pass
 
+    def on_peer_frontier(self, chain_id: bytes, peer: Peer, frontier: Frontier) -> None:
+        """Called with every frontier received from a peer"""
+        pass
+
 
 class RandomPeerSelectionStrategy(
     NextPeerSelectionStrategy,
@@ -59,29 +98,294 @@ class RandomPeerSelectionStrategy(
         return sample(peer_set, f)
 
 
+class PeerKnowledgeIndex(object):
+    """
+    Peers known to be behind the local frontier of a chain.
+
+    A peer is behind if the local frontier is newer than the last frontier received from it,
+    or than the genesis frontier if none was received. Frontiers are not totally ordered, so a
+    peer is re-evaluated against the local frontier whenever it sends a frontier, and every
+    peer is re-evaluated when the local frontier changes.
+    """
+
+    def __init__(self) -> None:
+        self.local = GENESIS_FRONTIER
+        # Last frontier received per peer id, and the peers
+        self.frontiers: Dict[bytes, Frontier] = {}
+        self.peers: Dict[bytes, Peer] = {}
+        self.behind = IndexedSet()
+        self.up_to_date = set()
+        # Time the peers were last synced with the sub-community
+        self.synced_at: Optional[float] = None
+
+    def _classify(self, peer_id: bytes) -> None:
+        if self.local > self.frontiers[peer_id]:
+            self.up_to_date.discard(peer_id)
+            self.behind.add(peer_id)
+        else:
+            self.behind.discard(peer_id)
+            self.up_to_date.add(peer_id)
+
+    def update_local(self, frontier: Frontier) -> None:
+        if frontier == self.local:
+            return
+        self.local = frontier
+        for peer_id in self.frontiers:
+            self._classify(peer_id)
+
+    def update_peer(self, peer: Peer, frontier: Frontier = GENESIS_FRONTIER) -> None:
+        peer_id = peer.public_key.key_to_bin()
+        self.peers[peer_id] = peer
+        self.frontiers[peer_id] = frontier
+        self._classify(peer_id)
+
+    def sync_peers(self, peers: Iterable[Peer], now: float) -> None:
+        """Add the new peers of the sub-community and remove those that left it"""
+        peer_ids = set()
+        for peer in peers:
+            peer_id = peer.public_key.key_to_bin()
+            peer_ids.add(peer_id)
+            if peer_id not in self.frontiers:
+                self.update_peer(peer)
+        for peer_id in set(self.frontiers) - peer_ids:
+            self.remove_peer(peer_id)
+        self.synced_at = now
+
+    def remove_peer(self, peer_id: bytes) -> None:
+        self.frontiers.pop(peer_id, None)
+        self.peers.pop(peer_id, None)
+        self.behind.discard(peer_id)
+        self.up_to_date.discard(peer_id)
+
+    def sample_behind(self, number: int) -> List[Peer]:
+        return [self.peers[peer_id] for peer_id in self.behind.sample(number)]
+
+
 class SmartPeerSelectionStrategy(
     NextPeerSelectionStrategy,
     SubCommunityRoutines,
     CommunityRoutines,
     metaclass=ABCMeta,
 ):
+    def setup_mixin(self) -> None:
+        self.peer_indexes: Dict[bytes, PeerKnowledgeIndex] = {}
+
+    def get_peer_index(self, chain_id: bytes) -> PeerKnowledgeIndex:
+        index = self.peer_indexes.get(chain_id)
+        if index is None:
+            index = self.peer_indexes[chain_id] = PeerKnowledgeIndex()
+        return index
+
     def get_next_gossip_peers(
         self, subcom_id: bytes, chain_id: bytes, my_frontier: Frontier, number: int
     ) -> Iterable[Peer]:
-        subcom = self.get_subcom(subcom_id)
-        peer_set = subcom.get_known_peers() if subcom else []
+        index = self.get_peer_index(chain_id)
+        now = time.monotonic()
+        if (
+            index.synced_at is None
+            or now - index.synced_at >= self.settings.frontier_gossip_peers_refresh
+        ):
+            subcom = self.get_subcom(subcom_id)
+            index.sync_peers(subcom.get_known_peers() if subcom else [], now)
+        index.update_local(my_frontier)
+        return index.sample_behind(number)
 
-        selected_peers = []
-        for p in peer_set:
-            known_frontier = self.persistence.get_last_frontier(
-                chain_id, p.public_key.key_to_bin()
-            )
-            if my_frontier > known_frontier:
-                selected_peers.append(p)
-        shuffle(selected_peers)
-        return (
-            selected_peers[:number] if len(selected_peers) > number else selected_peers
+    def on_peer_frontier(self, chain_id: bytes, peer: Peer, frontier: Frontier) -> None:
+        self.get_peer_index(chain_id).update_peer(peer, frontier)
+
+
+class FrontierScheduler(object):
+    """
+    Schedule the reconciliation of the frontiers received for the synced chains.
+
+    Only the newest frontier received from a peer on a chain is kept. Every tick, the chains
+    that lag the most behind their peers are reconciled first, one frontier per chain, until
+    the budget of the tick is spent. A chain that requested blocks waits for them to arrive
+    before it is reconciled again.
+
+    The last blocks request sent to each peer is kept, so that a truncated response is only
+    continued within what was requested.
+    """
+
+    def __init__(self) -> None:
+        # Newest frontier, and whether to respond to it, per peer id, per synced chain
+        self.pending: Dict[bytes, Dict[bytes, Tuple[Peer, Frontier, bool]]] = {}
+        # Time until which a chain is not reconciled, while its requested blocks arrive
+        self.paused_until: Dict[bytes, float] = {}
+        # Outstanding blocks request per peer id, per synced chain
+        self.requests: Dict[bytes, Dict[bytes, FrontierDiff]] = {}
+
+    def add_chain(self, chain_id: bytes) -> None:
+        self.pending.setdefault(chain_id, {})
+
+    def has_chain(self, chain_id: bytes) -> bool:
+        return chain_id in self.pending
+
+    def put(
+        self, chain_id: bytes, peer: Peer, frontier: Frontier, should_respond: bool
+    ) -> bool:
+        """Replace the pending frontier of the peer on the chain.
+        Returns False if the chain is not synced."""
+        chain_frontiers = self.pending.get(chain_id)
+        if chain_frontiers is None:
+            return False
+        peer_id = peer.public_key.key_to_bin()
+        previous = chain_frontiers.get(peer_id)
+        # The peer still waits for a response to the frontier it replaces
+        should_respond = should_respond or (previous is not None and previous[2])
+        chain_frontiers[peer_id] = (peer, frontier, should_respond)
+        return True
+
+    def pop(self, chain_id: bytes, peer_id: bytes) -> Tuple[Peer, Frontier, bool]:
+        return self.pending[chain_id].pop(peer_id)
+
+    def pause(self, chain_id: bytes, until: float) -> None:
+        self.paused_until[chain_id] = until
+
+    def request_sent(
+        self, chain_id: bytes, peer_id: bytes, frontier_diff: FrontierDiff
+    ) -> None:
+        """Replace the outstanding blocks request to the peer on the chain"""
+        self.requests.setdefault(chain_id, {})[peer_id] = frontier_diff
+
+    def continue_request(
+        self, chain_id: bytes, peer_id: bytes, cursor: FrontierDiff
+    ) -> Optional[FrontierDiff]:
+        """Check the cursor of a truncated response against the outstanding request to the
+        peer: it must lie within the request, and move past its start.
+        Returns the request that continues it, or None if the cursor is dropped."""
+        request = self.requests.get(chain_id, {}).pop(peer_id, None)
+        if request is None:
+            return None
+        missing = expand_ranges(request.missing)
+        conflicts = request.conflicts or {}
+        cursor_missing = expand_ranges(cursor.missing)
+        cursor_conflicts = cursor.conflicts or {}
+        if cursor_missing - missing or any(
+            dot not in conflicts for dot in cursor_conflicts
+        ):
+            return None
+        # The response served the start of the request, at least
+        if missing:
+            if next(iter(missing)) in cursor_missing:
+                return None
+        elif not conflicts or next(iter(conflicts)) in cursor_conflicts:
+            return None
+        next_request = FrontierDiff(
+            cursor_missing.ranges(),
+            {
+                dot: extra_dots
+                for dot, extra_dots in conflicts.items()
+                if dot in cursor_conflicts
+            },
         )
+        if next_request.is_empty():
+            return None
+        self.requests[chain_id][peer_id] = next_request
+        return next_request
+
+    def schedule(
+        self, now: float, lag: Callable[[bytes, Frontier], int]
+    ) -> List[Tuple[bytes, bytes]]:
+        """Get the (chain id, peer id) of the frontiers to reconcile in this tick, in order:
+        for each chain that is not paused, the frontier of the peer it lags most behind"""
+        candidates = []
+        for chain_id, chain_frontiers in self.pending.items():
+            if not chain_frontiers or self.paused_until.get(chain_id, 0) > now:
+                continue
+            best = max(
+                (lag(chain_id, frontier), peer_id)
+                for peer_id, (_, frontier, _) in chain_frontiers.items()
+            )
+            candidates.append((best[0], chain_id, best[1]))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return [(chain_id, peer_id) for _, chain_id, peer_id in candidates]
+
+
+class GossipRate(object):
+    """Frontier gossip rate of a chain"""
+
+    def __init__(self, interval: float, fanout: int) -> None:
+        self.interval = interval
+        self.fanout = fanout
+        # Time of the next gossip round
+        self.next_round = 0.0
+        # Whether the chain had activity since its last round, and the frontier then sent
+        self.active = False
+        self.last_frontier: Optional[Frontier] = None
+
+
+class GossipController(object):
+    """
+    Adapt the frontier gossip interval and fanout of each chain to its activity.
+
+    A chain is quiet if its frontier did not change and no reconciliation found a difference
+    with a peer since its last round. A quiet chain backs off: its interval grows exponentially
+    and its fanout shrinks, down to the bounds. Any activity restores the shortest interval
+    and the full fanout, and the chain gossips again on the next tick.
+
+    With max_interval equal to min_interval and min_fanout equal to max_fanout, the chains
+    gossip on a fixed schedule.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 0.5,
+        max_interval: float = 8.0,
+        backoff: float = 2.0,
+        min_fanout: int = 2,
+        max_fanout: int = 6,
+    ) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.min_fanout = min(min_fanout, max_fanout)
+        self.max_fanout = max_fanout
+        self.rates: Dict[bytes, GossipRate] = {}
+
+    def add_chain(self, chain_id: bytes) -> None:
+        if chain_id not in self.rates:
+            self.rates[chain_id] = GossipRate(self.min_interval, self.max_fanout)
+
+    def is_due(self, chain_id: bytes, now: float) -> bool:
+        rate = self.rates.get(chain_id)
+        # Tolerate the jitter of the ticks, which run every min_interval
+        return rate is None or now >= rate.next_round - self.min_interval / 2
+
+    def fanout(self, chain_id: bytes) -> int:
+        rate = self.rates.get(chain_id)
+        return rate.fanout if rate else self.max_fanout
+
+    def on_activity(self, chain_id: bytes) -> None:
+        """The chain has new dots, or a reconciliation found a difference with a peer"""
+        rate = self.rates.get(chain_id)
+        if rate is None:
+            return
+        rate.active = True
+        if rate.interval > self.min_interval:
+            # Do not wait for the end of the backed off interval
+            rate.next_round = 0.0
+
+    def on_round(self, chain_id: bytes, frontier: Frontier, now: float) -> None:
+        """Adapt the rate of the chain after a gossip round of its frontier"""
+        rate = self.rates.get(chain_id)
+        if rate is None:
+            return
+        if rate.active or frontier != rate.last_frontier:
+            rate.interval, rate.fanout = self.min_interval, self.max_fanout
+        else:
+            rate.interval = min(rate.interval * self.backoff, self.max_interval)
+            rate.fanout = max((rate.fanout + 1) // 2, self.min_fanout)
+        rate.active = False
+        rate.last_frontier = frontier
+        rate.next_round = now + rate.interval
+
+    def metrics(self) -> Dict[bytes, Tuple[float, int]]:
+        """Current gossip interval and fanout per chain"""
+        return {
+            chain_id: (rate.interval, rate.fanout)
+            for chain_id, rate in self.rates.items()
+        }
 
 
 class GossipRoutines(ABC):
@@ -95,8 +399,20 @@ class GossipRoutines(ABC):
         """Start of the gossip state machine"""
         pass
 
+    @property
     @abstractmethod
-    def incoming_frontier_queue(self, subcom_id: bytes) -> Queue:
+    def frontier_scheduler(self) -> FrontierScheduler:
+        pass
+
+    @property
+    @abstractmethod
+    def gossip_controller(self) -> GossipController:
+        pass
+
+    @property
+    @abstractmethod
+    def gossip_chains(self) -> Dict[bytes, Tuple[bytes, bytes]]:
+        """Sub-community id and prefix of the chains gossiped in bundles, by chain id"""
         pass
 
 
@@ -105,22 +421,35 @@ class GossipFrontiersMixin(
 ):
     COMMUNITY_CACHE = u"gossip_cache"
 
-    def frontier_gossip_sync_task(self, subcom_id: bytes, prefix: bytes = b"") -> None:
-        """Start of the gossip state machine"""
+    def frontier_gossip_tick(self, subcom_id: bytes, prefix: bytes = b"") -> None:
+        """Run a gossip round if the chain is due, according to its activity"""
+        if self.gossip_controller.is_due(prefix + subcom_id, time.monotonic()):
+            self.frontier_gossip_sync_task(subcom_id, prefix)
+
+    def select_frontier_gossip(
+        self, subcom_id: bytes, prefix: bytes = b""
+    ) -> Tuple[Optional[Frontier], Iterable[Peer]]:
+        """Get the local frontier of the chain, and the peers to gossip it to"""
         chain = self.persistence.get_chain(prefix + subcom_id)
         if not chain:
             self.logger.debug(
                 "No chain for %s. Skipping the gossip round.", prefix + subcom_id
             )
-        if chain:
-            frontier = chain.frontier
-            # Select next peers for the gossip round
-            next_peers = self.gossip_strategy.get_next_gossip_peers(
-                subcom_id,
-                prefix + subcom_id,
-                frontier,
-                self.settings.frontier_gossip_fanout,
-            )
+            return None, ()
+        frontier = chain.frontier
+        # Select next peers for the gossip round
+        next_peers = self.gossip_strategy.get_next_gossip_peers(
+            subcom_id,
+            prefix + subcom_id,
+            frontier,
+            self.gossip_controller.fanout(prefix + subcom_id),
+        )
+        return frontier, next_peers
+
+    def frontier_gossip_sync_task(self, subcom_id: bytes, prefix: bytes = b"") -> None:
+        """Start of the gossip state machine"""
+        frontier, next_peers = self.select_frontier_gossip(subcom_id, prefix)
+        if frontier is not None:
             for peer in next_peers:
                 self.logger.debug(
                     "Sending frontier %s to peer %s. Audit chain: %s",
@@ -129,41 +458,133 @@ class GossipFrontiersMixin(
                     prefix.startswith(b"w"),
                 )
                 self.send_packet(
-                    peer, FrontierPayload(prefix + subcom_id, frontier.to_bytes())
-                )
-
-    async def process_frontier_queue(self, subcom_id: bytes) -> None:
-        while True:
-            peer, frontier, should_respond = await self.incoming_frontier_queue(
-                subcom_id
-            ).get()
-            self.persistence.store_last_frontier(
-                subcom_id, peer.public_key.key_to_bin(), frontier
-            )
-            frontier_diff = self.persistence.reconcile(
-                subcom_id, frontier, peer.public_key.key_to_bin()
-            )
-            if frontier_diff.is_empty():
-                # Move to the next
-                await sleep(0.001)
-            else:
-                # Request blocks and wait for some time
-                self.logger.debug(
-                    "Sending frontier diff %s to peer %s. Audit chain: %s",
-                    frontier_diff,
                     peer,
-                    subcom_id.startswith(b"w"),
+                    FrontierPayload(
+                        prefix + subcom_id,
+                        self.encode_frontier(prefix + subcom_id, peer, frontier),
+                    ),
                 )
-                self.send_packet(
-                    peer, BlocksRequestPayload(subcom_id, frontier_diff.to_bytes())
+            self.gossip_controller.on_round(
+                prefix + subcom_id, frontier, time.monotonic()
+            )
+
+    def frontier_gossip_bundle_task(self) -> None:
+        """Gossip the frontiers of all due chains, with one bundle per peer"""
+        now = time.monotonic()
+        peer_frontiers: Dict[Peer, List[Tuple[bytes, bytes]]] = {}
+        for chain_id, (subcom_id, prefix) in self.gossip_chains.items():
+            if not self.gossip_controller.is_due(chain_id, now):
+                continue
+            frontier, next_peers = self.select_frontier_gossip(subcom_id, prefix)
+            if frontier is None:
+                continue
+            for peer in next_peers:
+                peer_frontiers.setdefault(peer, []).append(
+                    (chain_id, self.encode_frontier(chain_id, peer, frontier))
                 )
-                await sleep(self.settings.frontier_gossip_collect_time)
-            # Send frontier response:
-            chain = self.persistence.get_chain(subcom_id)
-            if chain and should_respond:
-                self.send_packet(
-                    peer, FrontierResponsePayload(subcom_id, chain.frontier.to_bytes())
+            self.gossip_controller.on_round(chain_id, frontier, now)
+        for peer, frontiers in peer_frontiers.items():
+            self.logger.debug("Sending %s frontiers to peer %s", len(frontiers), peer)
+            for bundle in bundle_frontiers(
+                frontiers, self.settings.frontier_bundle_max_bytes
+            ):
+                self.send_packet(peer, MultiFrontierPayload(bundle))
+
+    def on_new_chain_dots(self, chain_id: bytes, dots: List[Dot]) -> None:
+        self.gossip_controller.on_activity(chain_id)
+
+    def encode_frontier(self, chain_id: bytes, peer: Peer, frontier: Frontier) -> bytes:
+        """Encode the frontier for the peer, as a delta to the last frontier sent to it"""
+        if not self.settings.frontier_delta_encoding:
+            return frontier.to_bytes()
+        peer_id = peer.public_key.key_to_bin()
+        base, num_deltas = self.persistence.get_sent_frontier(chain_id, peer_id)
+        if base is None or num_deltas >= self.settings.frontier_max_deltas:
+            # Full frontier: the peer might have missed a previous one
+            base, num_deltas = None, -1
+        self.persistence.store_sent_frontier(
+            chain_id, peer_id, frontier, num_deltas + 1
+        )
+        return frontier.to_bytes(base)
+
+    def decode_frontier(
+        self, chain_id: bytes, peer: Peer, raw_frontier: bytes
+    ) -> Frontier:
+        """Decode the frontier from the peer, which can be a delta to the last one received.
+        Raises:
+            UnknownFrontierBaseException - if the frontier the delta refers to was not received
+        """
+        peer_id = peer.public_key.key_to_bin()
+        frontier = Frontier.from_bytes(
+            raw_frontier, self.persistence.get_received_frontier(chain_id, peer_id)
+        )
+        self.persistence.store_received_frontier(chain_id, peer_id, frontier)
+        return frontier
+
+    def frontier_lag(self, chain_id: bytes, frontier: Frontier) -> int:
+        """Number of sequence numbers the local chain is behind the frontier"""
+        chain = self.persistence.get_chain(chain_id)
+        local_seq = max(chain.terminal)[0] if chain and chain.terminal else 0
+        return max(frontier.terminal)[0] - local_seq if frontier.terminal else 0
+
+    def process_frontiers(self) -> None:
+        """Reconcile the scheduled frontiers within the budget of a tick"""
+        now = time.monotonic()
+        reconciled = requested = 0
+        for chain_id, peer_id in self.frontier_scheduler.schedule(
+            now, self.frontier_lag
+        ):
+            if (
+                reconciled >= self.settings.frontier_max_reconciliations
+                or requested >= self.settings.frontier_max_requested_blocks
+            ):
+                # Left pending for the next tick
+                break
+            if self.is_delivery_congested(chain_id):
+                # Left pending until the subscribers catch up with the chain
+                continue
+            peer, frontier, should_respond = self.frontier_scheduler.pop(
+                chain_id, peer_id
+            )
+            num_blocks = self.process_frontier(chain_id, peer, frontier, should_respond)
+            if num_blocks:
+                self.frontier_scheduler.pause(
+                    chain_id, now + self.settings.frontier_gossip_collect_time
                 )
+            reconciled += 1
+            requested += num_blocks
+
+    def is_delivery_congested(self, chain_id: bytes) -> bool:
+        """Whether too many blocks of the chain wait for delivery to request more"""
+        return False
+
+    def process_frontier(
+        self, chain_id: bytes, peer: Peer, frontier: Frontier, should_respond: bool
+    ) -> int:
+        """Request the blocks missing wrt the frontier of the peer, and respond with the local
+        frontier if asked. Returns the number of requested blocks."""
+        peer_id = peer.public_key.key_to_bin()
+        self.persistence.store_last_frontier(chain_id, peer_id, frontier)
+        self.gossip_strategy.on_peer_frontier(chain_id, peer, frontier)
+        frontier_diff = self.persistence.reconcile(chain_id, frontier, peer_id)
+        if not frontier_diff.is_empty():
+            self.gossip_controller.on_activity(chain_id)
+            self.logger.debug(
+                "Sending frontier diff %s to peer %s. Audit chain: %s",
+                frontier_diff,
+                peer,
+                chain_id.startswith(b"w"),
+            )
+            self.send_packet(
+                peer, BlocksRequestPayload(chain_id, frontier_diff.to_bytes())
+            )
+            self.frontier_scheduler.request_sent(chain_id, peer_id, frontier_diff)
+        # Send frontier response:
+        chain = self.persistence.get_chain(chain_id)
+        if chain and should_respond:
+            frontier_blob = self.encode_frontier(chain_id, peer, chain.frontier)
+            self.send_packet(peer, FrontierResponsePayload(chain_id, frontier_blob))
+        return frontier_diff.num_blocks()
 
     def process_frontier_payload(
         self,
@@ -171,20 +592,38 @@ class GossipFrontiersMixin(
         payload: Union[FrontierPayload, FrontierResponsePayload],
         should_respond: bool,
     ) -> None:
-        frontier = Frontier.from_bytes(payload.frontier)
-        chain_id = payload.chain_id
+        self.process_raw_frontier(
+            peer, payload.chain_id, payload.frontier, should_respond
+        )
+
+    def process_raw_frontier(
+        self, peer: Peer, chain_id: bytes, raw_frontier: bytes, should_respond: bool
+    ) -> None:
+        try:
+            frontier = self.decode_frontier(chain_id, peer, raw_frontier)
+        except UnknownFrontierBaseException:
+            # Wait for the next full frontier
+            self.logger.debug("Dropped frontier delta from %s on %s", peer, chain_id)
+            return
+        except PackError:
+            # The other frontiers of a bundle are still processed
+            self.logger.warning("Malformed frontier from %s on %s", peer, chain_id)
+            return
         # Process frontier
-        if self.incoming_frontier_queue(chain_id):
-            self.incoming_frontier_queue(chain_id).put_nowait(
-                (peer, frontier, should_respond)
-            )
-        else:
+        if not self.frontier_scheduler.put(chain_id, peer, frontier, should_respond):
             self.logger.error("Received unexpected frontier %s", chain_id)
 
     @lazy_wrapper(FrontierPayload)
     def received_frontier(self, peer: Peer, payload: FrontierPayload) -> None:
         self.process_frontier_payload(peer, payload, should_respond=True)
 
+    @lazy_wrapper(MultiFrontierPayload)
+    def received_multi_frontier(
+        self, peer: Peer, payload: MultiFrontierPayload
+    ) -> None:
+        for chain_id, raw_frontier in decode_raw(payload.frontiers):
+            self.process_raw_frontier(peer, chain_id, raw_frontier, should_respond=True)
+
     @lazy_wrapper(FrontierResponsePayload)
     def received_frontier_response(
         self, peer: Peer, payload: FrontierResponsePayload
@@ -195,6 +634,9 @@ class GossipFrontiersMixin(
     def received_blocks_request(
         self, peer: Peer, payload: BlocksRequestPayload
     ) -> None:
+        self.process_blocks_request(peer, payload)
+
+    def process_blocks_request(self, peer: Peer, payload: BlocksRequestPayload) -> None:
         f_diff = FrontierDiff.from_bytes(payload.frontier_diff)
         chain_id = payload.subcom_id
         vals_to_request = set()
@@ -204,9 +646,42 @@ class GossipFrontiersMixin(
             peer,
             chain_id.startswith(b"w"),
         )
-        blocks = self.persistence.get_block_blobs_by_frontier_diff(
-            chain_id, f_diff, vals_to_request
+        # The peer misses blocks of the chain
+        self.gossip_controller.on_activity(chain_id)
+        if self.async_persistence:
+            self.register_anonymous_task(
+                "blocks_request", self.send_blocks_page_async, peer, chain_id, f_diff
+            )
+            return
+        blocks, remaining = self.persistence.get_block_blobs_page(
+            chain_id,
+            f_diff,
+            vals_to_request,
+            self.settings.block_response_max_bytes,
+            self.settings.block_response_max_count,
+        )
+        self.send_blocks_page(peer, chain_id, blocks, remaining)
+
+    async def send_blocks_page_async(
+        self, peer: Peer, chain_id: bytes, f_diff: FrontierDiff
+    ) -> None:
+        """Read the requested blocks off the event loop, then send them"""
+        blocks, remaining = await self.async_persistence.get_block_blobs_page(
+            chain_id,
+            f_diff,
+            set(),
+            self.settings.block_response_max_bytes,
+            self.settings.block_response_max_count,
         )
+        self.send_blocks_page(peer, chain_id, blocks, remaining)
+
+    def send_blocks_page(
+        self,
+        peer: Peer,
+        chain_id: bytes,
+        blocks: List[bytes],
+        remaining: Optional[FrontierDiff],
+    ) -> None:
         self.logger.debug(
             "Sending %s blocks to peer %s. Audit chain %s",
             len(blocks),
@@ -215,13 +690,45 @@ class GossipFrontiersMixin(
         )
         for block in blocks:
             self.send_packet(peer, RawBlockPayload(block))
+        if remaining is not None:
+            # The response is truncated: the peer continues the request with the cursor
+            self.send_packet(
+                peer, BlocksResponseCursorPayload(chain_id, remaining.to_bytes())
+            )
+
+    @lazy_wrapper(BlocksResponseCursorPayload)
+    def received_blocks_response_cursor(
+        self, peer: Peer, payload: BlocksResponseCursorPayload
+    ) -> None:
+        chain_id = payload.subcom_id
+        if not self.frontier_scheduler.has_chain(chain_id):
+            return
+        try:
+            cursor = FrontierDiff.from_bytes(payload.frontier_diff)
+        except PackError:
+            self.logger.warning("Malformed cursor from %s on %s", peer, chain_id)
+            return
+        peer_id = peer.public_key.key_to_bin()
+        next_request = self.frontier_scheduler.continue_request(
+            chain_id, peer_id, cursor
+        )
+        if next_request is None:
+            # Not a continuation of the request sent to the peer
+            self.logger.debug("Dropped cursor %s from %s on %s", cursor, peer, chain_id)
+            return
+        # Request the next page of blocks
+        self.send_packet(peer, BlocksRequestPayload(chain_id, next_request.to_bytes()))
 
     def setup_messages(self) -> None:
         self.add_message_handler(FrontierPayload, self.received_frontier)
+        self.add_message_handler(MultiFrontierPayload, self.received_multi_frontier)
         self.add_message_handler(
             FrontierResponsePayload, self.received_frontier_response
         )
         self.add_message_handler(BlocksRequestPayload, self.received_blocks_request)
+        self.add_message_handler(
+            BlocksResponseCursorPayload, self.received_blocks_response_cursor
+        )
 
 
 class SubComGossipMixin(
@@ -99,3 +99,57 @@ class FrontierResponsePayload(ComparablePayload):
     msg_id = 11
     format_list = ["varlenH", "varlenH"]
     names = ["chain_id", "frontier"]
+
+
+@vp_compile
+class BlocksResponseCursorPayload(ComparablePayload):
+    msg_id = 12
+    format_list = ["varlenH", "varlenH"]
+    names = ["subcom_id", "frontier_diff"]
+
+
+@vp_compile
+class MultiFrontierPayload(ComparablePayload):
+    """
+    Payload with the frontiers of several chains, encoded as (chain_id, frontier) pairs.
+    """
+
+    msg_id = 13
+    format_list = ["varlenH"]
+    names = ["frontiers"]
+
+
+@vp_compile
+class SessionRequestPayload(ComparablePayload):
+    msg_id = 14
+    format_list = ["32s", "Q"]
+    names = ["nonce", "timestamp"]
+
+
+@vp_compile
+class SessionResponsePayload(ComparablePayload):
+    msg_id = 15
+    format_list = ["32s"]
+    names = ["nonce"]
+
+
+@vp_compile
+class SessionPacketPayload(ComparablePayload):
+    """
+    Payload authenticated with the session key of the sender, followed by its MAC.
+    """
+
+    msg_id = 16
+    format_list = ["20s", "Q", "B", "raw"]
+    names = ["mid", "counter", "payload_id", "data"]
+
+
+@vp_compile
+class SessionRejectPayload(ComparablePayload):
+    """
+    Answer to a packet authenticated with a session key the receiver does not know.
+    """
+
+    msg_id = 17
+    format_list = ["Q"]
+    names = ["counter"]
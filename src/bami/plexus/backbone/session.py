@@ -0,0 +1,292 @@
+"""
+Session keys to authenticate the high-rate gossip messages with a MAC instead of a signature.
+"""
+from abc import ABCMeta
+import hashlib
+import hmac
+import os
+import time
+from typing import Any, Callable, Optional, Tuple, Type
+
+import cachetools
+import libnacl
+
+from bami.plexus.backbone.community_routines import (
+    CommunityRoutines,
+    MessageStateMachine,
+)
+from bami.plexus.backbone.payload import (
+    SessionPacketPayload,
+    SessionRejectPayload,
+    SessionRequestPayload,
+    SessionResponsePayload,
+)
+from ipv8.keyvault.keys import Key
+from ipv8.keyvault.public.libnaclkey import LibNaCLPK
+from ipv8.lazy_community import lazy_wrapper
+from ipv8.messaging.payload import Payload
+from ipv8.peer import Peer
+
+MAC_SIZE = 32
+# Time after which a request without response is sent again
+REQUEST_TIMEOUT = 5.0
+# Maximum difference, in seconds, between the time of a request and the time it is accepted
+REQUEST_MAX_AGE = 30.0
+# Number of counters below the highest received one that are still accepted once
+REPLAY_WINDOW = 1024
+
+
+class ReplayWindow(object):
+    """Counters of the packets received with a key. A counter is accepted once, and only if it
+    is within the window below the highest one received: packets may be reordered, not replayed.
+    """
+
+    __slots__ = ("highest", "bitmap")
+
+    def __init__(self) -> None:
+        self.highest = None
+        # Bit i is set if the counter highest - i was received
+        self.bitmap = 0
+
+    def accept(self, counter: int) -> bool:
+        if self.highest is None or counter - self.highest >= REPLAY_WINDOW:
+            self.bitmap = 1
+            self.highest = counter
+            return True
+        if counter > self.highest:
+            shift = counter - self.highest
+            self.bitmap = ((self.bitmap << shift) | 1) & ((1 << REPLAY_WINDOW) - 1)
+            self.highest = counter
+            return True
+        offset = self.highest - counter
+        if offset >= REPLAY_WINDOW or self.bitmap >> offset & 1:
+            return False
+        self.bitmap |= 1 << offset
+        return True
+
+
+class SessionKeys(object):
+    """
+    Keys to authenticate the messages exchanged with each peer.
+
+    Each direction has its own key. The sender picks a nonce and sends it in a signed request.
+    Both sides derive the key from the nonce and the Diffie-Hellman secret of their curve25519
+    keys. The sender uses the key once the peer signed the response, and until the key
+    expires. The receiver keeps the key of a sender until the sender replaces it with a newer
+    request, so a replayed request does not reset the key.
+
+    The packets sent with a key are numbered from a random counter, and the receiver accepts
+    every counter once. A receiver that lost the key rejects the counter, and the sender drops
+    the key if it sent that counter with it.
+    """
+
+    def __init__(
+        self, my_key: Key, max_peers: int = 10_000, lifetime: float = 120.0
+    ) -> None:
+        self.my_key = my_key
+        self.lifetime = lifetime
+        # Keys of the messages to send, and their expiry time, per peer mid
+        self.send_keys = cachetools.LRUCache(max_peers)
+        # Peers and keys of the messages received, per sender mid
+        self.receive_keys = cachetools.LRUCache(max_peers)
+        # Nonces of the requests waiting for a response, and their time, per peer mid
+        self.pending = cachetools.LRUCache(max_peers)
+        # Time of the last accepted request, per sender mid
+        self.request_times = cachetools.LRUCache(max_peers)
+        # Time of the last rejected packet, per sender mid
+        self.reject_times = cachetools.LRUCache(max_peers)
+
+    def supports(self, peer: Peer) -> bool:
+        return isinstance(self.my_key, LibNaCLPK) and isinstance(
+            peer.public_key, LibNaCLPK
+        )
+
+    def derive(self, peer: Peer, nonce: bytes) -> bytes:
+        shared = libnacl.crypto_box_beforenm(peer.public_key.key.pk, self.my_key.key.sk)
+        return hashlib.blake2b(
+            nonce, digest_size=MAC_SIZE, key=shared, person=b"bami-session"
+        ).digest()
+
+    def get_send_key(self, peer: Peer, now: float) -> Optional[bytes]:
+        entry = self.send_keys.get(peer.mid)
+        if entry is None or entry[1] <= now:
+            return None
+        return entry[0]
+
+    def next_counter(self, peer: Peer) -> int:
+        """Number the next packet sent with the key of the peer"""
+        key, expiry, first, counter = self.send_keys[peer.mid]
+        self.send_keys[peer.mid] = (key, expiry, first, counter + 1)
+        return counter
+
+    def get_receive_key(self, mid: bytes) -> Optional[Tuple[Peer, bytes, ReplayWindow]]:
+        return self.receive_keys.get(mid)
+
+    def should_reject(self, mid: bytes, now: float) -> bool:
+        """Reject a packet with an unknown key, at most once per request timeout per sender"""
+        if now - self.reject_times.get(mid, float("-inf")) < REQUEST_TIMEOUT:
+            return False
+        self.reject_times[mid] = now
+        return True
+
+    def rejected(self, peer: Peer, counter: int) -> bool:
+        """Drop the key of the peer if it was used for the rejected packet"""
+        entry = self.send_keys.get(peer.mid)
+        if entry is None or not entry[2] <= counter < entry[3]:
+            return False
+        del self.send_keys[peer.mid]
+        return True
+
+    def start(self, peer: Peer, now: float) -> Optional[bytes]:
+        """Get the nonce of a new request to the peer, unless one is waiting for a response"""
+        if not self.supports(peer):
+            return None
+        pending = self.pending.get(peer.mid)
+        if pending is not None and now - pending[1] < REQUEST_TIMEOUT:
+            return None
+        nonce = os.urandom(32)
+        self.pending[peer.mid] = (nonce, now)
+        return nonce
+
+    def accept(self, peer: Peer, nonce: bytes, timestamp: float, now: float) -> bool:
+        """Accept the request of the peer to authenticate its messages with a new key,
+        unless the request is stale or not newer than the last accepted one"""
+        if not self.supports(peer) or abs(now - timestamp) > REQUEST_MAX_AGE:
+            return False
+        if timestamp <= self.request_times.get(peer.mid, float("-inf")):
+            return False
+        self.request_times[peer.mid] = timestamp
+        self.receive_keys[peer.mid] = (peer, self.derive(peer, nonce), ReplayWindow())
+        return True
+
+    def complete(self, peer: Peer, nonce: bytes, now: float) -> bool:
+        """Use the key of the request the peer responded to"""
+        pending = self.pending.get(peer.mid)
+        if pending is None or not hmac.compare_digest(pending[0], nonce):
+            return False
+        del self.pending[peer.mid]
+        # A rejection of a packet sent with a previous key does not match the new counters
+        first = int.from_bytes(os.urandom(7), "big")
+        self.send_keys[peer.mid] = (
+            self.derive(peer, nonce),
+            now + self.lifetime,
+            first,
+            first,
+        )
+        return True
+
+    @staticmethod
+    def mac(key: bytes, data: bytes) -> bytes:
+        return hmac.digest(key, data, "sha256")
+
+
+class SessionAuthMixin(MessageStateMachine, CommunityRoutines, metaclass=ABCMeta):
+    def setup_messages(self) -> None:
+        self.session_keys = SessionKeys(
+            self.my_peer.key,
+            self.settings.session_max_peers,
+            self.settings.session_key_lifetime,
+        )
+        # Payload class and handler of the payloads that can be sent with a MAC, by message id
+        self.session_handlers = {}
+        self.add_message_handler(SessionRequestPayload, self.received_session_request)
+        self.add_message_handler(SessionResponsePayload, self.received_session_response)
+        self.add_message_handler(SessionPacketPayload, self.received_session_packet)
+        self.add_message_handler(SessionRejectPayload, self.received_session_reject)
+
+    def add_session_handler(
+        self, payload_class: Type[Payload], handler: Callable[[Peer, Payload], None]
+    ) -> None:
+        """Allow the payloads to be sent with a MAC. The handler is called with the sender
+        and the payload of the authenticated packets."""
+        self.session_handlers[payload_class.msg_id] = (payload_class, handler)
+
+    def send_with_session(self, peer: Peer, payload: Payload) -> bool:
+        """Send the payload authenticated with the session key of the peer, if there is one.
+        Otherwise, start a session with the peer and return False."""
+        if not self.settings.session_auth or not isinstance(
+            payload, self.session_handlers.get(payload.msg_id, (type(None),))[0]
+        ):
+            return False
+        now = time.monotonic()
+        key = self.session_keys.get_send_key(peer, now)
+        if key is None:
+            nonce = self.session_keys.start(peer, now)
+            if nonce is not None:
+                self.ez_send(
+                    peer, SessionRequestPayload(nonce, int(time.time() * 1000))
+                )
+            return False
+        packet = self.ezr_pack(
+            SessionPacketPayload.msg_id,
+            SessionPacketPayload(
+                self.my_peer.mid,
+                self.session_keys.next_counter(peer),
+                payload.msg_id,
+                self.serializer.pack_serializable(payload),
+            ),
+            sig=False,
+        )
+        self.endpoint.send(peer.address, packet + self.session_keys.mac(key, packet))
+        return True
+
+    @lazy_wrapper(SessionRequestPayload)
+    def received_session_request(
+        self, peer: Peer, payload: SessionRequestPayload
+    ) -> None:
+        if self.settings.session_auth and self.session_keys.accept(
+            peer, payload.nonce, payload.timestamp / 1000, time.time()
+        ):
+            self.ez_send(peer, SessionResponsePayload(payload.nonce))
+
+    @lazy_wrapper(SessionResponsePayload)
+    def received_session_response(
+        self, peer: Peer, payload: SessionResponsePayload
+    ) -> None:
+        if not self.session_keys.complete(peer, payload.nonce, time.monotonic()):
+            self.logger.debug("Dropped unexpected session response from %s", peer)
+
+    def received_session_packet(self, source_address: Any, data: bytes) -> None:
+        packet, mac = data[:-MAC_SIZE], data[-MAC_SIZE:]
+        # The payload follows the community prefix and the message id
+        session_packet, _ = self.serializer.unpack_serializable(
+            SessionPacketPayload, packet, offset=len(self.get_prefix()) + 1
+        )
+        session = self.session_keys.get_receive_key(session_packet.mid)
+        if session is None:
+            self.reject_session_packet(source_address, session_packet)
+            return
+        if not hmac.compare_digest(self.session_keys.mac(session[1], packet), mac):
+            self.logger.debug("Dropped unauthenticated packet from %s", source_address)
+            return
+        if not session[2].accept(session_packet.counter):
+            self.logger.debug("Dropped replayed packet from %s", source_address)
+            return
+        if session_packet.payload_id not in self.session_handlers:
+            return
+        payload_class, handler = self.session_handlers[session_packet.payload_id]
+        payload, _ = self.serializer.unpack_serializable(
+            payload_class, session_packet.data
+        )
+        handler(session[0], payload)
+
+    def reject_session_packet(
+        self, source_address: Any, session_packet: SessionPacketPayload
+    ) -> None:
+        """Tell the sender of a packet with an unknown key, e.g. after a restart, to drop the
+        key: it signs its messages until a new session is set up"""
+        peer = self.network.get_verified_by_address(source_address)
+        if peer is None or peer.mid != session_packet.mid:
+            self.logger.debug(
+                "Dropped packet of unknown session from %s", source_address
+            )
+            return
+        if self.session_keys.should_reject(peer.mid, time.monotonic()):
+            self.ez_send(peer, SessionRejectPayload(session_packet.counter))
+
+    @lazy_wrapper(SessionRejectPayload)
+    def received_session_reject(
+        self, peer: Peer, payload: SessionRejectPayload
+    ) -> None:
+        if not self.session_keys.rejected(peer, payload.counter):
+            self.logger.debug("Dropped unexpected session reject from %s", peer)
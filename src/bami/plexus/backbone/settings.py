@@ -7,6 +7,11 @@ class BamiSettings(object):
         # Push gossip properties: fanout and ttl (number of hops)
         self.push_gossip_fanout = 9
         self.push_gossip_ttl = 1
+        # Push gossip fanout of specific chains, by chain id, instead of push_gossip_fanout
+        self.push_gossip_chain_fanout = {}
+        # The number of broadcast blocks, and the time in seconds, remembered to relay once
+        self.push_gossip_seen_size = 10_000
+        self.push_gossip_seen_time = 60.0
 
         # Track chains of every overlay neighbour
         self.track_neighbours_chains = False
@@ -17,15 +22,81 @@ class BamiSettings(object):
         self.frontier_gossip_sync_max_delay = 0.1
         # The interval at which we gossip the latest frontier in each community
         self.frontier_gossip_interval = 0.5
-        # The waiting time between processing two collected frontiers
+        # Adapt the gossip rate of each chain to its activity. A quiet chain is gossiped less
+        # often and to fewer peers, so a peer catches up with it later after missing a block.
+        self.frontier_gossip_adaptive = False
+        # The interval of a quiet chain grows by the backoff factor every round, up to the maximum
+        self.frontier_gossip_max_interval = 8.0
+        self.frontier_gossip_backoff = 2.0
+        # The waiting time before reconciling again a chain that requested blocks
         self.frontier_gossip_collect_time = 0.2
-        # Gossip fanout for frontiers exchange
+        # The interval at which the received frontiers are reconciled
+        self.frontier_scheduler_interval = 0.05
+        # Budget of a reconciliation interval: frontiers reconciled and blocks requested
+        self.frontier_max_reconciliations = 100
+        self.frontier_max_requested_blocks = 2000
+        # Gossip fanout for frontiers exchange, and the fanout a quiet chain shrinks to
         self.frontier_gossip_fanout = 6
+        self.frontier_gossip_min_fanout = 2
+        # Gossip the frontiers of all chains in one task, bundling the frontiers sent to a peer
+        self.frontier_gossip_bundled = False
+        # The maximum size in bytes of a bundle, to fit in a UDP packet with the IPv8 headers
+        self.frontier_bundle_max_bytes = 1200
+        # The interval at which the gossip peers of a chain are synced with its sub-community
+        self.frontier_gossip_peers_refresh = 2.0
+        # Encode frontiers as deltas to the frontier last sent to the same peer. Only enable it
+        # when all peers of the community decode deltas: there is no negotiation.
+        self.frontier_delta_encoding = False
+        # Number of deltas after which a full frontier is sent, to recover from lost messages
+        self.frontier_max_deltas = 10
 
         self.block_sign_delta = 0.3
 
+        # Authenticate frontiers, block requests and pulled blocks with a MAC of a session key
+        # negotiated with the peer, instead of a signature. Needs curve25519 peer keys.
+        self.session_auth = False
+        # The time after which a session key is negotiated again
+        self.session_key_lifetime = 120.0
+        # The maximum number of peers with a session key
+        self.session_max_peers = 10_000
+
+        # Number of threads verifying the signatures of received blocks
+        self.verification_workers = 4
+        # The maximum number of pushed blocks verified together
+        self.verification_batch_size = 256
+        # The maximum number of verification results memoised by block hash
+        self.verification_cache_size = 100_000
+        # The number of recently received block hashes used to drop duplicate blocks
+        self.duplicate_filter_size = 10_000
+
+        # Deliver the blocks in order to the subscribers in a task, instead of when persisted
+        self.async_block_delivery = False
+        # The maximum number of blocks of a chain delivered together
+        self.block_delivery_batch_size = 256
+        # The number of recently decoded blocks kept to deliver them without a store read
+        self.block_delivery_cache_size = 10_000
+        # The number of blocks of a chain waiting for delivery above which no more are requested
+        self.block_delivery_max_backlog = 10_000
+
         # working directory for the database
         self.work_directory = ".block_db"
+        # The interval at which the chain states are checkpointed to the database
+        self.checkpoint_interval = 60
+        # Store the chain versions and pointers on disk instead of in memory
+        self.on_disk_chains = False
+        # The maximum number of entries cached per on-disk chain map
+        self.chain_cache_size = 10_000
+        # The maximum size in bytes of the block blobs cached to serve block requests
+        self.blob_cache_size = 32 * 1024 * 1024
+        # Run the block store reads and writes of the gossip and block sync on threads
+        self.async_persistence = False
+        # Number of threads reading the block store, if async_persistence is enabled
+        self.persistence_readers = 4
+        # Maintain the public key, community and type indexes for range queries on blocks
+        self.block_indexes = False
+        # The maximum size in bytes and number of blocks sent in response to one block request
+        self.block_response_max_bytes = 256 * 1024
+        self.block_response_max_count = 200
 
         # The maximum and minimum number of peers in the main communities
         self.main_min_peers = 20
@@ -22,6 +22,13 @@ class BaseSubCommunity(ABC):
         """
         pass
 
+    def get_peer(self, peer_key: bytes) -> Optional[Peer]:
+        """Get the known peer with the public key, if any"""
+        for peer in self.get_known_peers():
+            if peer.public_key.key_to_bin() == peer_key:
+                return peer
+        return None
+
     @abstractmethod
     def add_peer(self, peer: Peer):
         pass
@@ -45,6 +52,12 @@ class IPv8SubCommunity(Community, BaseSubCommunity):
         self.community_id = peer.mid
         super().__init__(*args, **kwargs)
 
+    def get_peer(self, peer_key: bytes) -> Optional[Peer]:
+        peer = self.network.get_verified_by_public_key_bin(peer_key)
+        if peer and self.community_id in self.network.get_services_for_peer(peer):
+            return peer
+        return None
+
     def add_peer(self, peer: Peer):
         self.network.add_verified_peer(peer)
         self.network.discover_services(peer, [self.community_id])
@@ -57,6 +70,7 @@ class LightSubCommunity(BaseSubCommunity):
     def __init__(self, subcom_id: bytes = None, max_peers: int = None):
         self._subcom_id = subcom_id
         self.peers = set()
+        self.peers_by_key = {}
 
     @property
     def subcom_id(self) -> bytes:
@@ -65,8 +79,12 @@ class LightSubCommunity(BaseSubCommunity):
     def get_known_peers(self) -> Iterable[Peer]:
         return self.peers
 
+    def get_peer(self, peer_key: bytes) -> Optional[Peer]:
+        return self.peers_by_key.get(peer_key)
+
     def add_peer(self, peer: Peer):
         self.peers.add(peer)
+        self.peers_by_key[peer.public_key.key_to_bin()] = peer
 
 
 class BaseSubCommunityFactory(ABC):
@@ -1,8 +1,15 @@
+from asyncio import AbstractEventLoop
 from binascii import hexlify
+from bisect import bisect_left, bisect_right
+from collections.abc import Set as AbstractSet
+from functools import partial
 from hashlib import sha256
 from itertools import chain
-from typing import Any, Callable, NewType, Set, Tuple
+import random
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, NewType, Set, Tuple
 
+import cachetools
 from msgpack import dumps, loads
 
 KEY_LEN = 8
@@ -101,20 +108,140 @@ def decode_links(bytes_links: BytesLinks) -> Links:
     return Links(tuple(tuple(x) for x in decode_raw(bytes_links)))
 
 
-def expand_ranges(range_vals: Ranges) -> Set[int]:
+class IntervalSet(AbstractSet):
+    """Set of ints stored as sorted, disjoint and non-adjacent closed intervals.
+
+    Membership, insertion and removal are a binary search over the intervals,
+    so the cost depends on the number of gaps, not on the number of values.
+    """
+
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, range_vals: Iterable[Tuple[int, int]] = ()) -> None:
+        self._starts = []
+        self._ends = []
+        for b, e in range_vals:
+            self.add_range(b, e)
+
+    @classmethod
+    def from_ranges(cls, range_vals: Ranges) -> "IntervalSet":
+        val = cls()
+        for b, e in range_vals:
+            if b > e:
+                # Empty range, as in add_range
+                continue
+            if val._ends and b <= val._ends[-1] + 1:
+                val.add_range(b, e)
+            else:
+                # Sorted and disjoint ranges are appended without a search
+                val._starts.append(b)
+                val._ends.append(e)
+        return val
+
+    @classmethod
+    def _from_iterable(cls, values: Iterable[int]) -> "IntervalSet":
+        return cls.from_ranges(ranges(set(values)))
+
+    def add_range(self, start: int, end: int) -> None:
+        """Add all values from start to end, including both"""
+        if start > end:
+            return
+        # Intervals that overlap or touch [start, end] are merged with it
+        lo = bisect_left(self._ends, start - 1)
+        hi = bisect_right(self._starts, end + 1)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def discard_range(self, start: int, end: int) -> None:
+        """Remove all values from start to end, including both, if present"""
+        if start > end:
+            return
+        lo = bisect_left(self._ends, start)
+        hi = bisect_right(self._starts, end)
+        if lo >= hi:
+            return
+        starts, ends = [], []
+        # Keep the parts of the boundary intervals outside of [start, end]
+        if self._starts[lo] < start:
+            starts.append(self._starts[lo])
+            ends.append(start - 1)
+        if self._ends[hi - 1] > end:
+            starts.append(end + 1)
+            ends.append(self._ends[hi - 1])
+        self._starts[lo:hi] = starts
+        self._ends[lo:hi] = ends
+
+    def add(self, value: int) -> None:
+        self.add_range(value, value)
+
+    def discard(self, value: int) -> None:
+        self.discard_range(value, value)
+
+    def remove(self, value: int) -> None:
+        if value not in self:
+            raise KeyError(value)
+        self.discard(value)
+
+    def ranges(self) -> Ranges:
+        return Ranges(tuple(zip(self._starts, self._ends)))
+
+    def copy(self) -> "IntervalSet":
+        val = IntervalSet()
+        val._starts = list(self._starts)
+        val._ends = list(self._ends)
+        return val
+
+    def __contains__(self, value: Any) -> bool:
+        i = bisect_right(self._starts, value) - 1
+        return i >= 0 and value <= self._ends[i]
+
+    def __iter__(self) -> Iterator[int]:
+        for b, e in zip(self._starts, self._ends):
+            yield from range(b, e + 1)
+
+    def __len__(self) -> int:
+        return sum(e - b + 1 for b, e in zip(self._starts, self._ends))
+
+    def __bool__(self) -> bool:
+        return bool(self._starts)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, IntervalSet):
+            return self._starts == other._starts and self._ends == other._ends
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __sub__(self, other: Any) -> "IntervalSet":
+        if not isinstance(other, IntervalSet):
+            return super().__sub__(other)
+        val = self.copy()
+        for b, e in zip(other._starts, other._ends):
+            val.discard_range(b, e)
+        return val
+
+    def __and__(self, other: Any) -> "IntervalSet":
+        if not isinstance(other, IntervalSet):
+            return super().__and__(other)
+        return self - (self - other)
+
+    def __repr__(self) -> str:
+        return "IntervalSet({})".format(self.ranges())
+
+
+def expand_ranges(range_vals: Ranges) -> IntervalSet:
     """Expand ranges to set of ints
 
     Args:
         range_vals: List of tuple ranges
 
     Returns:
-        Set of ints with ranges expanded
+        Set of ints with ranges expanded, stored as intervals
     """
-    val_set = set()
-    for b, e in range_vals:
-        for val in range(b, e + 1):
-            val_set.add(val)
-    return val_set
+    return IntervalSet.from_ranges(range_vals)
 
 
 def ranges(nums: Set[int]) -> Ranges:
@@ -126,6 +253,8 @@ def ranges(nums: Set[int]) -> Ranges:
     Returns:
         List of tuples of ranges
     """
+    if isinstance(nums, IntervalSet):
+        return nums.ranges()
     if not nums:
         return Ranges(tuple())
     nums = sorted(nums)
@@ -134,10 +263,83 @@ def ranges(nums: Set[int]) -> Ranges:
     return Ranges(tuple(zip(edges, edges)))
 
 
+class DuplicateFilter(object):
+    """Bounded filter of the hashes of recently received blocks.
+
+    Counts the duplicates it suppresses per peer and per chain, for the max_counters peers
+    and chains that sent or received duplicates most recently.
+    """
+
+    def __init__(self, size: int, max_counters: int = 1000) -> None:
+        # Chain ids of the recent blocks, keyed by block hash
+        self.recent = cachetools.LRUCache(size)
+        self.peer_duplicates = cachetools.LRUCache(max_counters)
+        self.chain_duplicates = cachetools.LRUCache(max_counters)
+
+    def is_duplicate(self, block_hash: bytes, peer_id: bytes) -> bool:
+        chain_id = self.recent.get(block_hash)
+        if chain_id is None:
+            return False
+        self.peer_duplicates[peer_id] = self.peer_duplicates.get(peer_id, 0) + 1
+        self.chain_duplicates[chain_id] = self.chain_duplicates.get(chain_id, 0) + 1
+        return True
+
+    def add(self, block_hash: bytes, chain_id: bytes) -> None:
+        self.recent[block_hash] = chain_id
+
+    def discard(self, block_hash: bytes) -> None:
+        self.recent.pop(block_hash, None)
+
+
+class IndexedSet(object):
+    """Set that samples its items in time independent of its size"""
+
+    def __init__(self) -> None:
+        self.items = []
+        self.positions = {}
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.positions
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.items)
+
+    def add(self, item: Any) -> None:
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item: Any) -> None:
+        pos = self.positions.pop(item, None)
+        if pos is None:
+            return
+        # Move the last item into the freed position
+        last = self.items.pop()
+        if pos < len(self.items):
+            self.items[pos] = last
+            self.positions[last] = pos
+
+    def sample(self, number: int) -> List[Any]:
+        return random.sample(self.items, min(number, len(self.items)))
+
+
 class Notifier(object):
+    # Loop, and the thread running it, that receives the notifications made in other threads
+    _loop = None
+    _loop_thread = None
+
     def __init__(self):
         self.observers = {}
 
+    def deliver_on(self, loop: AbstractEventLoop) -> None:
+        """Deliver the notifications made in other threads on the thread running the loop.
+        Call it from that thread."""
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+
     def add_unique_observer(self, subject: Any, callback: Callable) -> None:
         self.observers[subject] = [callback]
 
@@ -148,5 +350,10 @@ class Notifier(object):
     def notify(self, subject: Any, *args, **kwargs) -> None:
         if subject not in self.observers:
             return
+        if self._loop is not None and threading.get_ident() != self._loop_thread:
+            self._loop.call_soon_threadsafe(
+                partial(self.notify, subject, *args, **kwargs)
+            )
+            return
         for callback in self.observers[subject]:
             callback(*args, **kwargs)
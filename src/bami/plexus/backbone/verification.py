@@ -0,0 +1,62 @@
+"""
+Verification of received blocks on a thread pool, off the event loop.
+"""
+from asyncio import gather, get_event_loop
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List
+
+import cachetools
+
+from bami.plexus.backbone.block import PlexusBlock
+
+
+def verify_blocks(blocks: List[PlexusBlock]) -> List[bool]:
+    return [block.block_invariants_valid() for block in blocks]
+
+
+class BlockVerifier:
+    """Check the invariants of blocks, including their signature, and memoise the results by
+    block hash. Duplicates of a block received from several peers are verified once.
+
+    The signature checks call into libsodium without the GIL, so the worker threads verify
+    the chunks of a batch in parallel.
+    """
+
+    def __init__(self, num_workers: int = 4, cache_size: int = 100_000) -> None:
+        """
+        Args:
+            num_workers: The number of threads verifying blocks
+            cache_size: The maximum number of memoised results
+        """
+        self.num_workers = num_workers
+        self.executor = ThreadPoolExecutor(num_workers, "bami-verify")
+        self.results = cachetools.LRUCache(cache_size)
+
+    def is_valid(self, block: PlexusBlock) -> bool:
+        """Verify the block in the calling thread, unless it is verified already"""
+        valid = self.results.get(block.hash)
+        if valid is None:
+            valid = self.results[block.hash] = block.block_invariants_valid()
+        return valid
+
+    async def verify(self, blocks: Iterable[PlexusBlock]) -> None:
+        """Verify the blocks that are not verified yet on the worker threads"""
+        new_blocks = {}
+        for block in blocks:
+            if block.hash not in self.results:
+                new_blocks.setdefault(block.hash, block)
+        if not new_blocks:
+            return
+        todo = list(new_blocks.values())
+        chunks = [todo[i :: self.num_workers] for i in range(self.num_workers)]
+        chunks = [chunk for chunk in chunks if chunk]
+        loop = get_event_loop()
+        results = await gather(
+            *(loop.run_in_executor(self.executor, verify_blocks, c) for c in chunks)
+        )
+        for chunk, chunk_results in zip(chunks, results):
+            for block, valid in zip(chunk, chunk_results):
+                self.results[block.hash] = valid
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,114 @@
+from asyncio import gather, sleep
+import threading
+
+import pytest
+
+from bami.plexus.backbone.datastore.async_db import AsyncDB
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+from bami.plexus.backbone.datastore.chain_store import (
+    Chain,
+    ChainFactory,
+    LMDBChainFactory,
+)
+from bami.plexus.backbone.datastore.database import DBManager
+from bami.plexus.backbone.datastore.frontiers import FrontierDiff
+from bami.plexus.backbone.utils import Ranges
+
+from tests.plexus.conftest import FakeBlock
+
+
+@pytest.fixture
+def async_db(tmpdir):
+    dbms = DBManager(ChainFactory(), LMDBLockStore(str(tmpdir)))
+    return AsyncDB(dbms)
+
+
+@pytest.mark.asyncio
+async def test_add_blocks(async_db, create_batches):
+    blks = create_batches(num_batches=1, num_blocks=10)[0]
+    com_id = blks[0].com_id
+    writer_threads = set()
+    notified = []
+
+    def chain_dots_tester(chain_id, dots):
+        notified.append((threading.get_ident(), dots))
+
+    original_add_blocks = async_db.db.add_blocks
+
+    def add_blocks(blocks):
+        writer_threads.add(threading.get_ident())
+        assert all(async_db.is_block_pending(blk.hash) for _, blk in blocks)
+        original_add_blocks(blocks)
+
+    async_db.db.add_blocks = add_blocks
+    async_db.db.add_observer(com_id, chain_dots_tester)
+
+    await async_db.add_blocks((blk.pack(), blk) for blk in blks)
+    assert threading.get_ident() not in writer_threads
+    assert not async_db.pending_blocks
+    # Notifications are delivered on the event loop, before the write is awaited
+    assert len(notified) == 1
+    assert notified[0][0] == threading.get_ident()
+    assert [dot[0] for dot in notified[0][1]] == list(range(1, 11))
+
+    assert await async_db.has_block(blks[0].hash)
+    assert await async_db.get_block_blob_by_dot(com_id, blks[0].com_dot) == (
+        blks[0].pack()
+    )
+    await async_db.close()
+
+
+@pytest.mark.asyncio
+async def test_blocks_page(async_db):
+    blk = FakeBlock()
+    await async_db.add_block(blk.pack(), blk)
+    await async_db.add_block(blk.pack(), blk)
+
+    blocks, remaining = await async_db.get_block_blobs_page(
+        blk.com_id, FrontierDiff(Ranges(((1, 1),)), {}), set(), 10**6, 10
+    )
+    assert blocks == [blk.pack()]
+    assert remaining is None
+    await async_db.close()
+
+
+@pytest.mark.asyncio
+async def test_writes_in_order(async_db, create_batches):
+    blks = create_batches(num_batches=1, num_blocks=5)[0]
+    notified = []
+    async_db.db.add_observer(
+        blks[0].com_id, lambda chain_id, dots: notified.extend(dots)
+    )
+
+    # Writes queued together are applied one at a time, in order
+    await gather(*(async_db.add_block(blk.pack(), blk) for blk in blks))
+    await async_db.checkpoint()
+    assert [dot[0] for dot in notified] == list(range(1, 6))
+    assert not async_db.db.dirty_chains
+    await async_db.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes(tmpdir, create_batches):
+    block_store = LMDBLockStore(str(tmpdir))
+    dbms = DBManager(LMDBChainFactory(block_store, cache_size=10), block_store)
+    async_db = AsyncDB(dbms)
+    loop_blks, writer_blks = create_batches(num_batches=2, num_blocks=200)
+    com_id = loop_blks[0].com_id
+
+    # Blocks of one chain added on the writer thread and on the event loop at once
+    writes = gather(*(async_db.add_block(blk.pack(), blk) for blk in writer_blks))
+    for blk in loop_blks:
+        dbms.add_block(blk.pack(), blk)
+        dbms.get_chain(com_id).versions.get(blk.com_seq_num)
+        await sleep(0)
+    await writes
+    await async_db.checkpoint()
+
+    full_chain = Chain()
+    for blk in loop_blks + writer_blks:
+        full_chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+    assert dbms.get_chain(com_id).frontier == full_chain.frontier
+    assert dict(dbms.get_chain(com_id).versions.items()) == full_chain.versions
+    assert not dbms.dirty_chains
+    await async_db.close()
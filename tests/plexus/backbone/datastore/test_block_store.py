@@ -1,5 +1,14 @@
+from asyncio import ensure_future, get_event_loop, sleep
+import os
+import threading
+
 import pytest
-from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+
+from bami.plexus.backbone.datastore.block_store import (
+    INDEX_PUBLIC_KEY,
+    INDEX_TYPE,
+    LMDBLockStore,
+)
 
 
 @pytest.fixture
@@ -57,3 +66,210 @@ def test_add_dot(lmdb_store):
     lmdb_store.add_dot(test_key, test_blob)
     res = lmdb_store.get_hash_by_dot(test_key)
     assert res == test_blob
+
+
+def test_write_batch(lmdb_store):
+    with lmdb_store.write_batch():
+        lmdb_store.add_block(b"lopo1", b"blob1")
+        lmdb_store.add_tx(b"lopo1", b"tx1")
+        lmdb_store.add_dot(b"dot1", b"lopo1")
+        # Writes are visible within the batch
+        assert lmdb_store.get_block_by_hash(b"lopo1") == b"blob1"
+        with lmdb_store.write_batch():
+            lmdb_store.add_block(b"lopo2", b"blob2")
+
+    assert lmdb_store.get_block_by_hash(b"lopo1") == b"blob1"
+    assert lmdb_store.get_block_by_hash(b"lopo2") == b"blob2"
+    assert lmdb_store.get_tx_by_hash(b"lopo1") == b"tx1"
+    assert lmdb_store.get_hash_by_dot(b"dot1") == b"lopo1"
+
+
+def test_write_batch_rollback(lmdb_store):
+    with pytest.raises(ValueError):
+        with lmdb_store.write_batch():
+            lmdb_store.add_block(b"lopo1", b"blob1")
+            raise ValueError()
+
+    assert lmdb_store.get_block_by_hash(b"lopo1") is None
+
+
+def test_read_batch(lmdb_store):
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    with lmdb_store.read_batch():
+        with lmdb_store.begin() as txn, lmdb_store.begin() as txn2:
+            assert txn is txn2
+        # Writes use their own transaction, reads keep the snapshot of the batch
+        lmdb_store.add_block(b"lopo2", b"blob2")
+        assert lmdb_store.get_block_by_hash(b"lopo1") == b"blob1"
+        assert lmdb_store.get_block_by_hash(b"lopo2") is None
+
+    assert lmdb_store.get_block_by_hash(b"lopo2") == b"blob2"
+
+
+def test_index(lmdb_store):
+    lmdb_store.add_index_key(INDEX_TYPE, b"k1" + b"\x02", b"hash2")
+    lmdb_store.add_index_key(INDEX_TYPE, b"k1" + b"\x01", b"hash1")
+    lmdb_store.add_index_key(INDEX_TYPE, b"k1" + b"\x01", b"hash3")
+    lmdb_store.add_index_key(INDEX_TYPE, b"k2" + b"\x01", b"hash4")
+    lmdb_store.add_index_key(INDEX_PUBLIC_KEY, b"k1" + b"\x01", b"hash5")
+
+    hashes = [h for _, h in lmdb_store.iterate_index(INDEX_TYPE, b"k1")]
+    assert hashes == [b"hash1", b"hash3", b"hash2"]
+    hashes = [h for _, h in lmdb_store.iterate_index(INDEX_TYPE, b"k1", b"\x02")]
+    assert hashes == [b"hash2"]
+    hashes = [h for _, h in lmdb_store.iterate_index(INDEX_TYPE, b"k1", end=b"\x02")]
+    assert hashes == [b"hash1", b"hash3"]
+    assert list(lmdb_store.iterate_index(INDEX_TYPE, b"k3")) == []
+
+
+def test_delete_block(lmdb_store):
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    lmdb_store.add_block(b"lopo2", b"blob2")
+    lmdb_store.add_tx(b"lopo1", b"tx1")
+    lmdb_store.delete_block(b"lopo1")
+
+    assert lmdb_store.get_block_by_hash(b"lopo1") is None
+    assert lmdb_store.get_tx_by_hash(b"lopo1") is None
+    # Deleted blocks are skipped when replaying the block log
+    assert list(lmdb_store.iterate_blocks_since(0)) == [(b"lopo2", b"blob2")]
+
+
+@pytest.mark.asyncio
+async def test_compact(lmdb_store):
+    data_file = os.path.join(lmdb_store.block_dir, "data.mdb")
+    with lmdb_store.write_batch():
+        for i in range(1000):
+            lmdb_store.add_block(b"lopo%d" % i, os.urandom(1000))
+    with lmdb_store.write_batch():
+        for i in range(1, 1000):
+            lmdb_store.delete_block(b"lopo%d" % i)
+    size = os.path.getsize(data_file)
+
+    assert await lmdb_store.compact()
+    assert os.path.getsize(data_file) < size / 10
+    assert lmdb_store.get_block_by_hash(b"lopo0") is not None
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    assert lmdb_store.get_block_by_hash(b"lopo1") == b"blob1"
+
+
+@pytest.mark.asyncio
+async def test_compact_waits_for_readers(lmdb_store):
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    reading, release = threading.Event(), threading.Event()
+
+    def reader():
+        with lmdb_store.read_batch():
+            reading.set()
+            release.wait()
+            return lmdb_store.get_block_by_hash(b"lopo1")
+
+    loop = get_event_loop()
+    read = loop.run_in_executor(None, reader)
+    await loop.run_in_executor(None, reading.wait)
+    compact = ensure_future(lmdb_store.compact())
+    await sleep(0.1)
+    # The environment is not closed under the open read transaction
+    assert not compact.done()
+    release.set()
+    assert await read == b"blob1"
+    assert await compact
+    assert lmdb_store.get_block_by_hash(b"lopo1") == b"blob1"
+
+
+@pytest.mark.asyncio
+async def test_compact_after_write(lmdb_store):
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    writing, release = threading.Event(), threading.Event()
+
+    def writer():
+        with lmdb_store.write_batch():
+            writing.set()
+            release.wait()
+            lmdb_store.add_block(b"lopo2", b"blob2")
+
+    loop = get_event_loop()
+    write = loop.run_in_executor(None, writer)
+    await loop.run_in_executor(None, writing.wait)
+    compact = ensure_future(lmdb_store.compact())
+    await sleep(0.1)
+    release.set()
+    await write
+    # The copy misses the write
+    assert not await compact
+    assert lmdb_store.get_block_by_hash(b"lopo2") == b"blob2"
+
+
+@pytest.mark.asyncio
+async def test_close_during_compact(lmdb_store):
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    # Keep the store busy, so that the compaction waits to replace it
+    with lmdb_store._in_use():
+        compact = ensure_future(lmdb_store.compact())
+        await sleep(0.1)
+        lmdb_store.close()
+    # The closed store is not replaced, nor copied again
+    assert not await compact
+    assert not await lmdb_store.compact()
+
+
+def test_iterate_blocks_since(lmdb_store):
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    lmdb_store.add_block(b"lopo2", b"blob2")
+    # Blocks already stored are not logged twice
+    lmdb_store.add_block(b"lopo1", b"blob1")
+    lmdb_store.add_block(b"lopo3", b"blob3")
+
+    assert list(lmdb_store.iterate_blocks_since(0)) == [
+        (b"lopo1", b"blob1"),
+        (b"lopo2", b"blob2"),
+        (b"lopo3", b"blob3"),
+    ]
+    assert list(lmdb_store.iterate_blocks_since(2)) == [(b"lopo3", b"blob3")]
+    assert list(lmdb_store.iterate_blocks_since(3)) == []
+
+
+def test_block_buffer(lmdb_store):
+    lmdb_store.add_block(b"lopo1", b"blob1")
+
+    with lmdb_store.get_block_buffer(b"lopo1") as buffer:
+        assert isinstance(buffer, memoryview)
+        assert buffer == b"blob1"
+    with lmdb_store.get_block_buffer(b"lopo2") as buffer:
+        assert buffer is None
+
+    blocks = [
+        (block_hash, bytes(blob))
+        for block_hash, blob in lmdb_store.iterate_blocks_since(0, buffers=True)
+    ]
+    assert blocks == [(b"lopo1", b"blob1")]
+
+
+def test_checkpoint(tmpdir):
+    path = str(tmpdir)
+    db = LMDBLockStore(path)
+    assert db.load_checkpoint() is None
+
+    db.add_block(b"lopo1", b"blob1")
+    db.save_checkpoint({b"chain1": b"state1"})
+    db.add_block(b"lopo2", b"blob2")
+    db.save_checkpoint({b"chain2": b"state2"})
+    db.save_checkpoint({}, {b"chain1": b"delta1", b"chain11": b"delta11"})
+    db.save_checkpoint({}, {b"chain1": b"delta2"})
+    db.save_checkpoint({b"chain11": b"state11"})
+    db.add_block(b"lopo3", b"blob3")
+    db.close()
+
+    db2 = LMDBLockStore(path)
+    chain_states, position = db2.load_checkpoint()
+    assert chain_states == {
+        b"chain1": b"state1",
+        b"chain2": b"state2",
+        b"chain11": b"state11",
+    }
+    assert list(db2.iterate_blocks_since(position)) == [(b"lopo3", b"blob3")]
+    assert db2.load_chain_deltas(b"chain1") == [b"delta1", b"delta2"]
+    # A full state replaces the changes
+    assert db2.load_chain_deltas(b"chain11") == []
+    assert db2.load_chain_deltas(b"chain2") == []
+    db2.close()
+    tmpdir.remove()
@@ -1,6 +1,10 @@
+from contextlib import contextmanager
+
 import pytest
 
-from bami.plexus.backbone.datastore.chain_store import Chain
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+from bami.plexus.backbone.datastore.chain_store import Chain, LMDBChainFactory
+from bami.plexus.backbone.datastore.frontiers import Frontier
 from bami.plexus.backbone.utils import (
     expand_ranges,
     GENESIS_DOT,
@@ -8,10 +12,11 @@ from bami.plexus.backbone.utils import (
     Links,
     ranges,
     Ranges,
+    shorten,
     wrap_return,
 )
 
-from tests.plexus.conftest import FakeBlock
+from tests.plexus.conftest import FakeBlock, insert_batch_seq
 
 
 class TestBatchInsert:
@@ -25,6 +30,20 @@ class TestBatchInsert:
         assert len(chain.terminal) == 1
         assert last_blk_link in chain.terminal
 
+    def test_deep_reversed_insert(self, chain):
+        num_blocks = 2000
+        links = GENESIS_LINK
+        blocks = []
+        for i in range(1, num_blocks + 1):
+            block_hash = i.to_bytes(32, "big")
+            blocks.append((links, i, block_hash))
+            links = Links(((i, shorten(block_hash)),))
+
+        for block in reversed(blocks):
+            chain.add_block(*block)
+        assert chain.terminal == links
+        assert chain.consistent_terminal == links
+
 
 class TestConflictsInsert:
     def test_two_conflict_seq_insert(
@@ -46,7 +65,7 @@ class TestConflictsInsert:
         assert len(chain.terminal) == 2
         assert last_blk_link in chain.terminal
 
-    @pytest.mark.parametrize("num_batches", [2 ** i for i in range(4, 10, 2)])
+    @pytest.mark.parametrize("num_batches", [2**i for i in range(4, 10, 2)])
     def test_insert_many_conflicts(
         self, create_batches, num_batches, insert_function, chain
     ):
@@ -83,6 +102,18 @@ class TestFrontiers:
         assert len(frontier.terminal) == 1
         assert frontier.terminal[0][0] == 10
 
+    def test_frontier_per_version(self, create_batches, chain):
+        batches = create_batches(num_batches=1, num_blocks=2)
+        frontier = chain.frontier
+        assert chain.frontier is frontier
+
+        blk = batches[0][0]
+        chain.add_block(blk.links, blk.com_seq_num, blk.hash)
+        new_frontier = chain.frontier
+        assert new_frontier is not frontier
+        assert new_frontier > frontier
+        assert chain.frontier is new_frontier
+
     def test_insert_with_one_hole(self, create_batches, insert_function, chain):
         batches = create_batches(num_batches=1, num_blocks=10)
 
@@ -121,6 +152,15 @@ class TestFrontiers:
         assert len(frontier.terminal) == 2
         assert frontier.terminal[0][0] == 10 and frontier.terminal[1][0] == 30
 
+    def test_insert_far_ahead(self, chain):
+        far_seq_num = 10**9
+        chain.add_block(GENESIS_LINK, 1, b"hash1")
+        chain.add_block(Links(((far_seq_num - 1, b"unknown"),)), far_seq_num, b"hash2")
+
+        frontier = chain.frontier
+        assert frontier.holes == ((2, far_seq_num - 1),)
+        assert frontier.terminal[-1][0] == far_seq_num
+
     def test_insert_multi_holes(self, create_batches, insert_function, chain):
         batches = create_batches(num_batches=1, num_blocks=30)
 
@@ -230,6 +270,26 @@ class TestFrontierReconciliation:
         assert not front_diff.conflicts
         assert all(k == (9, 10) for k in front_diff.missing)
 
+    def test_missing_with_holes(self, create_batches, chain):
+        chain2 = Chain()
+        batches = create_batches(num_batches=1, num_blocks=30)
+
+        wrap_return(insert_batch_seq(chain, batches[0][:5]))
+        wrap_return(insert_batch_seq(chain, batches[0][10:20]))
+        wrap_return(insert_batch_seq(chain2, batches[0][:15]))
+        wrap_return(insert_batch_seq(chain2, batches[0][25:]))
+
+        front_diff = chain.reconcile(chain2.frontier)
+        assert front_diff.missing == ((6, 10), (26, 30))
+
+    def test_far_ahead_frontier(self, chain):
+        far_seq_num = 10**9
+        chain.add_block(GENESIS_LINK, 1, b"hash1")
+        front = Frontier(Links(((far_seq_num, b"hash2"),)), Ranges(((3, 4),)), ())
+
+        front_diff = chain.reconcile(front)
+        assert front_diff.missing == ((2, 2), (5, far_seq_num))
+
     def test_chain_conflicting(self, create_batches, insert_function, chain):
         chain2 = Chain()
         batches = create_batches(num_batches=2, num_blocks=10)
@@ -434,6 +494,228 @@ class TestNewConsistentDots:
         assert len(list(chain.get_dots_by_seq_num(11))) == 1
 
 
+class TestAddBlocks:
+    @staticmethod
+    def blocks_info(batch):
+        return [(blk.links, blk.com_seq_num, blk.hash) for blk in batch]
+
+    def test_reversed_batch(self, create_batches, chain):
+        batches = create_batches(num_batches=1, num_blocks=20)
+        vals = chain.add_blocks(reversed(self.blocks_info(batches[0])))
+        assert [dot[0] for dot in vals] == list(range(1, 21))
+        last_blk = batches[0][-1]
+        assert chain.terminal == Links(((last_blk.com_seq_num, last_blk.short_hash),))
+        assert chain.consistent_terminal == chain.terminal
+
+    def test_duplicate_blocks(self, create_batches, chain):
+        batches = create_batches(num_batches=1, num_blocks=10)
+        vals = chain.add_blocks(self.blocks_info(batches[0]) * 2)
+        assert len(vals) == 10
+
+    def test_fill_holes(self, create_batches, chain):
+        batches = create_batches(num_batches=1, num_blocks=20)
+        blocks_info = self.blocks_info(batches[0])
+        assert chain.add_blocks(blocks_info[10:]) == []
+        assert chain.frontier.holes == Ranges(((1, 10),))
+
+        vals = chain.add_blocks(blocks_info[:10])
+        assert [dot[0] for dot in vals] == list(range(1, 21))
+        assert chain.frontier.holes == ()
+
+    def test_same_as_single_inserts(self, create_batches):
+        batches = create_batches(num_batches=3, num_blocks=30)
+        blocks_info = [self.blocks_info(batch) for batch in batches]
+        rounds = [
+            blocks_info[0][:10] + blocks_info[1][5:15],
+            blocks_info[2][20:] + blocks_info[0][10:] + blocks_info[1][:5],
+            blocks_info[1][15:] + blocks_info[2][:20],
+        ]
+        single_chain = Chain()
+        batch_chain = Chain()
+        for blocks in rounds:
+            single_vals = set()
+            for block in reversed(blocks):
+                single_vals.update(single_chain.add_block(*block))
+            batch_vals = batch_chain.add_blocks(blocks)
+
+            assert set(batch_vals) == single_vals
+            assert batch_chain.terminal == single_chain.terminal
+            assert batch_chain.consistent_terminal == single_chain.consistent_terminal
+            assert batch_chain.frontier == single_chain.frontier
+
+
 def test_empty_get_dots(create_batches, chain):
     v = chain.get_dots_by_seq_num(1)
     assert len(list(v)) == 0
+
+
+class TestChainSerialization:
+    def test_empty_chain(self, chain_factory, chain):
+        restored = chain_factory.load_chain(b"chain_id", chain.to_bytes())
+        assert restored.frontier == chain.frontier
+
+    def test_round_trip(self, create_batches, insert_function, chain_factory, chain):
+        batches = create_batches(num_batches=2, num_blocks=100)
+        wrap_return(insert_function(chain, batches[0][:20]))
+        wrap_return(insert_function(chain, batches[0][40:]))
+        wrap_return(insert_function(chain, batches[1][:60]))
+
+        restored = chain_factory.load_chain(b"chain_id", chain.to_bytes())
+        assert restored.frontier == chain.frontier
+        assert restored.consistent_terminal == chain.consistent_terminal
+        assert dict(restored.versions.items()) == dict(chain.versions.items())
+        assert restored.holes == chain.holes
+
+        # The restored chain keeps accepting blocks as a chain with all blocks
+        wrap_return(insert_function(restored, batches[0][20:40]))
+        full_chain = Chain()
+        for batch in batches[0], batches[1][:60]:
+            wrap_return(insert_function(full_chain, batch))
+        assert restored.frontier == full_chain.frontier
+        assert restored.consistent_terminal == full_chain.consistent_terminal
+
+    def test_checkpoint_deltas(self, create_batches, insert_function):
+        batches = create_batches(num_batches=2, num_blocks=100)
+        chain = Chain()
+        wrap_return(insert_function(chain, batches[0][:20]))
+        full, state = chain.checkpoint_state()
+        assert full
+        wrap_return(insert_function(chain, batches[0][40:]))
+        full, delta1 = chain.checkpoint_state()
+        assert not full
+        wrap_return(insert_function(chain, batches[1][:60]))
+        _, delta2 = chain.checkpoint_state()
+
+        restored = Chain.from_bytes(state)
+        restored.apply_delta(delta1)
+        restored.apply_delta(delta2)
+        assert restored.frontier == chain.frontier
+        assert restored.consistent_terminal == chain.consistent_terminal
+        assert restored.versions == chain.versions
+        assert restored.forward_pointers == chain.forward_pointers
+        assert restored.back_pointers == chain.back_pointers
+        # The restored chain checkpoints its changes to the restored state
+        assert not restored.checkpoint_state()[0]
+
+        chain.prune(10)
+        assert chain.checkpoint_state()[0]
+        assert chain.checkpoint_state(full=True)[0]
+
+
+class TestPrune:
+    def test_prune(self, create_batches, chain_factory, chain):
+        full_chain = Chain()
+        batches = create_batches(num_batches=1, num_blocks=25)
+        wrap_return(insert_batch_seq(chain, batches[0][:20]))
+        wrap_return(insert_batch_seq(full_chain, batches[0]))
+
+        pruned = chain.prune(11)
+        assert sorted(pruned) == [
+            (blk.com_seq_num, blk.short_hash) for blk in batches[0][:10]
+        ]
+        assert chain.pruned_seq_num == 11
+        assert chain.get_dots_by_seq_num(5) is None or not list(
+            chain.get_dots_by_seq_num(5)
+        )
+        assert chain.get_next_links(pruned[0]) is None
+        assert chain.prune(11) == []
+
+        # Reconciliation and insertion work as on the full chain
+        assert chain.reconcile(full_chain.frontier).missing == ((21, 25),)
+        assert full_chain.reconcile(chain.frontier).is_empty()
+        wrap_return(insert_batch_seq(chain, batches[0][20:]))
+        assert chain.frontier == full_chain.frontier
+        assert chain.consistent_terminal == full_chain.consistent_terminal
+
+        restored = chain_factory.load_chain(b"chain_id", chain.to_bytes())
+        assert restored.pruned_seq_num == 11
+        assert restored.frontier == full_chain.frontier
+
+    def test_prune_below_hole(self, create_batches, chain):
+        batches = create_batches(num_batches=1, num_blocks=20)
+        wrap_return(insert_batch_seq(chain, batches[0][:5]))
+        wrap_return(insert_batch_seq(chain, batches[0][10:]))
+
+        # History after the hole is not final yet
+        assert len(chain.prune(15)) == 5
+        assert chain.pruned_seq_num == 6
+        wrap_return(insert_batch_seq(chain, batches[0][5:10]))
+        assert chain.consistent_terminal == Links(
+            ((batches[0][-1].com_seq_num, batches[0][-1].short_hash),)
+        )
+
+
+class TestLMDBChain:
+    def test_bounded_cache(self, tmpdir, create_batches, insert_function):
+        block_store = LMDBLockStore(str(tmpdir))
+        chain = LMDBChainFactory(block_store, cache_size=10).create_chain(b"chain_id")
+        full_chain = Chain()
+        batches = create_batches(num_batches=1, num_blocks=100)
+        with block_store.write_batch():
+            wrap_return(insert_function(chain, batches[0]))
+        wrap_return(insert_function(full_chain, batches[0]))
+
+        assert len(chain.versions.cache) <= 10
+        assert len(chain.forward_pointers.cache) <= 10
+        assert len(chain.back_pointers.cache) <= 10
+        assert chain.frontier == full_chain.frontier
+        assert dict(chain.versions.items()) == full_chain.versions
+        assert dict(chain.back_pointers.items()) == full_chain.back_pointers
+        block_store.close()
+
+    def test_chains_share_store(self, tmpdir, create_batches):
+        block_store = LMDBLockStore(str(tmpdir))
+        chain_factory = LMDBChainFactory(block_store)
+        chains = [
+            chain_factory.create_chain(b"chain_id"),
+            chain_factory.create_chain(b"chain_id2"),
+        ]
+        batches = create_batches(num_batches=2, num_blocks=10)
+        for chain, batch in zip(chains, batches):
+            wrap_return(insert_batch_seq(chain, batch))
+            full_chain = Chain()
+            wrap_return(insert_batch_seq(full_chain, batch))
+            assert chain.frontier == full_chain.frontier
+            assert dict(chain.forward_pointers.items()) == full_chain.forward_pointers
+        block_store.close()
+
+    def test_aborted_batch_not_cached(self, tmpdir):
+        block_store = LMDBLockStore(str(tmpdir))
+        versions = LMDBChainFactory(block_store).create_chain(b"chain_id").versions
+        versions[1] = {b"hash1"}
+        with pytest.raises(ValueError):
+            with block_store.write_batch():
+                versions[1] = {b"hash1", b"hash2"}
+                versions[2] = {b"hash3"}
+                # The batch reads its own writes
+                assert versions[1] == {b"hash1", b"hash2"}
+                raise ValueError
+        assert versions[1] == {b"hash1"}
+        assert versions.get(2) is None
+
+        with block_store.write_batch():
+            versions[2] = {b"hash3"}
+        assert versions.cache[2] == {b"hash3"}
+        block_store.close()
+
+    def test_read_does_not_cache_over_commit(self, tmpdir, monkeypatch):
+        block_store = LMDBLockStore(str(tmpdir))
+        versions = LMDBChainFactory(block_store).create_chain(b"chain_id").versions
+        begin = block_store.begin
+        writes = []
+
+        @contextmanager
+        def read_then_commit(write=False):
+            with begin(write) as txn:
+                yield txn
+            if not write and not writes:
+                # Another thread commits the entry after the read missed it
+                writes.append(True)
+                with block_store.write_batch():
+                    versions[1] = {b"hash1"}
+
+        monkeypatch.setattr(block_store, "begin", read_then_commit)
+        assert versions.get(1) == {b"hash1"}
+        assert versions.cache[1] == {b"hash1"}
+        monkeypatch.undo()
+        block_store.close()
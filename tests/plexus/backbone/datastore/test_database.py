@@ -1,11 +1,15 @@
 import pytest
+from ipv8.keyvault.crypto import default_eccrypto
+
+from bami.plexus.backbone.block import PlexusBlock
 from bami.plexus.backbone.datastore.block_store import LMDBLockStore
-from bami.plexus.backbone.datastore.chain_store import ChainFactory
+from bami.plexus.backbone.datastore.chain_store import ChainFactory, LMDBChainFactory
 from bami.plexus.backbone.datastore.database import ChainTopic, DBManager
 from bami.plexus.backbone.datastore.frontiers import Frontier, FrontierDiff
 from bami.plexus.backbone.utils import (
     Dot,
     encode_raw,
+    Links,
     Ranges,
     ShortKey,
     wrap_iterate,
@@ -71,6 +75,26 @@ class TestDBManager:
             self.dbms.get_block_blob_by_dot(self.chain_id, self.block_dot)
             == self.block_blob
         )
+        assert self.dbms.get_block_hash_and_blob_by_dot(
+            self.chain_id, self.block_dot
+        ) == (self.test_hash, self.block_blob)
+
+    def test_blob_cache_size(self, monkeypatch, std_vals):
+        monkeypatch.setattr(MockBlockStore, "get_hash_by_dot", lambda _, dot: dot)
+        monkeypatch.setattr(MockBlockStore, "get_block_by_hash", lambda _, h: h[-10:])
+        dbms = DBManager(self.chain_factory, self.block_store, blob_cache_size=25)
+
+        dots = [Dot((i, ShortKey("808080"))) for i in range(3)]
+        for dot in dots:
+            dbms.get_block_blob_by_dot(self.chain_id, dot)
+        assert dbms.blob_cache.currsize == 20
+        assert dbms.blob_cache_misses == 3
+
+        # The first blob was evicted
+        dbms.get_block_blob_by_dot(self.chain_id, dots[2])
+        assert dbms.blob_cache_hits == 1
+        dbms.get_block_blob_by_dot(self.chain_id, dots[0])
+        assert dbms.blob_cache_misses == 4
 
     def test_last_frontiers(self, monkeypatch, std_vals):
         new_frontier = Frontier(terminal=((3, b"2123"),), holes=(), inconsistencies=())
@@ -235,6 +259,97 @@ def test_hot_start_db(tmpdir):
     tmp_val.remove()
 
 
+def test_start_from_checkpoint(tmpdir, monkeypatch):
+    block_store = LMDBLockStore(str(tmpdir))
+    dbms = DBManager(ChainFactory(), block_store)
+    blocks = [FakeBlock()]
+    com_id = blocks[0].com_id
+    for _ in range(2):
+        blocks.append(FakeBlock(com_id=com_id, links=Links((blocks[-1].com_dot,))))
+    dbms.add_block(blocks[0].pack(), blocks[0])
+    dbms.checkpoint()
+    assert not dbms.dirty_chains
+    dbms.add_block(blocks[1].pack(), blocks[1])
+    dbms.checkpoint()
+    # Not yet checkpointed, must be replayed on start
+    dbms.block_store.add_block(blocks[2].hash, blocks[2].pack())
+    dbms.close()
+
+    replayed = []
+    monkeypatch.setattr(
+        DBManager,
+        "_add_block",
+        lambda self, blob, block, persist=True: replayed.append(block.hash),
+    )
+    DBManager(ChainFactory(), LMDBLockStore(str(tmpdir))).close()
+    assert replayed == [blocks[2].hash]
+    monkeypatch.undo()
+
+    dbms2 = DBManager(ChainFactory(), LMDBLockStore(str(tmpdir)))
+    chain = dbms2.get_chain(com_id)
+    assert chain.frontier.terminal == (blocks[2].com_dot,)
+    assert not chain.frontier.holes
+    dbms2.close()
+
+
+def test_start_from_checkpoint_deltas(tmpdir, create_batches):
+    blocks = create_batches(num_batches=1, num_blocks=300)[0]
+    block_store = LMDBLockStore(str(tmpdir))
+    dbms = DBManager(ChainFactory(), block_store)
+    for i in range(0, len(blocks), 100):
+        dbms.add_blocks([(blk.pack(), blk) for blk in blocks[i : i + 100]])
+        dbms.checkpoint()
+    com_id = blocks[0].com_id
+    chain = dbms.get_chain(com_id)
+    # Only the first checkpoint stores the full state
+    assert len(block_store.load_chain_deltas(com_id)) == 2
+    block_store.close()
+
+    dbms2 = DBManager(ChainFactory(), LMDBLockStore(str(tmpdir)))
+    restored = dbms2.get_chain(com_id)
+    assert restored.frontier == chain.frontier
+    assert restored.versions == chain.versions
+    assert restored.back_pointers == chain.back_pointers
+    dbms2.close()
+
+
+def test_restart_lmdb_chains(tmpdir, create_batches):
+    blocks = create_batches(num_batches=1, num_blocks=3000)[0]
+    block_store = LMDBLockStore(str(tmpdir))
+    dbms = DBManager(LMDBChainFactory(block_store), block_store)
+    for i in range(0, len(blocks), 10):
+        dbms.add_blocks([(blk.pack(), blk) for blk in blocks[i : i + 10]])
+    com_id = blocks[0].com_id
+    front = dbms.get_chain(com_id).frontier
+    # Stopped before a checkpoint: the blocks are replayed on start, within the default map size
+    block_store.close()
+
+    block_store2 = LMDBLockStore(str(tmpdir))
+    dbms2 = DBManager(LMDBChainFactory(block_store2), block_store2)
+    assert dbms2.get_chain(com_id).frontier == front
+    assert dbms2.get_chain(com_id).versions[3000] == {blocks[-1].short_hash}
+    dbms2.close()
+
+
+def test_add_blocks_lmdb_chains_one_write(tmpdir, create_batches):
+    blocks = create_batches(num_batches=1, num_blocks=100)[0]
+    block_store = LMDBLockStore(str(tmpdir))
+    dbms = DBManager(LMDBChainFactory(block_store), block_store)
+    writes = block_store._writes
+    dbms.add_blocks([(blk.pack(), blk) for blk in blocks[:50]])
+    # The blocks and the chain entries are written in the same transaction
+    assert block_store._writes == writes + 1
+
+    stored = []
+    add_block = block_store.add_block
+    block_store.add_block = lambda *args: stored.append(args) or add_block(*args)
+    dbms.add_blocks([(blk.pack(), blk) for blk in blocks])
+    # Stored blocks are not persisted again
+    assert len(stored) == 50
+    assert dbms.get_chain(blocks[0].com_id).versions[100] == {blocks[-1].short_hash}
+    dbms.close()
+
+
 class TestIntegrationDBManager:
     @pytest.fixture(autouse=True)
     def setUp(self, tmpdir) -> None:
@@ -247,7 +362,7 @@ class TestIntegrationDBManager:
 
     @pytest.fixture(autouse=True)
     def setUp2(self, tmpdir) -> None:
-        tmp_val = tmpdir
+        tmp_val = tmpdir.mkdir("dbms2")
         self.block_store2 = LMDBLockStore(str(tmp_val))
         self.chain_factory2 = ChainFactory()
         self.dbms2 = DBManager(self.chain_factory2, self.block_store2)
@@ -277,6 +392,26 @@ class TestIntegrationDBManager:
             == packed_block
         )
 
+    def test_blob_cache(self):
+        test_block = FakeBlock()
+        packed_block = test_block.pack()
+        self.dbms.add_block(packed_block, test_block)
+
+        # Populated on add
+        assert (
+            self.dbms.get_block_blob_by_dot(test_block.com_id, test_block.com_dot)
+            == packed_block
+        )
+        assert self.dbms.blob_cache_hits == 1 and self.dbms.blob_cache_misses == 0
+
+        self.dbms.blob_cache.clear()
+        for _ in range(2):
+            assert (
+                self.dbms.get_block_blob_by_dot(test_block.com_id, test_block.com_dot)
+                == packed_block
+            )
+        assert self.dbms.blob_cache_hits == 2 and self.dbms.blob_cache_misses == 1
+
     def test_add_notify_block_one_chain(self, create_batches, insert_function):
         self.val_dots = []
 
@@ -313,6 +448,26 @@ class TestIntegrationDBManager:
 
         assert len(self.val_dots) == 200
 
+    def test_add_blocks_notify_once(self, create_batches):
+        self.notified = []
+
+        def chain_dots_tester(chain_id, dots):
+            self.notified.append(dots)
+
+        blks = create_batches(num_batches=1, num_blocks=100)
+        com_id = blks[0][0].com_id
+        self.dbms.add_observer(com_id, chain_dots_tester)
+
+        self.dbms.add_blocks((blk.pack(), blk) for blk in reversed(blks[0]))
+        assert len(self.notified) == 1
+        assert [dot[0] for dot in self.notified[0]] == list(range(1, 101))
+        assert self.dbms.get_chain(com_id).frontier == Frontier(
+            Links((blks[0][-1].com_dot,)), (), ()
+        )
+        for blk in blks[0]:
+            assert self.dbms.has_block(blk.hash)
+            assert self.dbms.get_block_blob_by_dot(com_id, blk.com_dot) == blk.pack()
+
     def test_blocks_by_frontier_diff(self, create_batches, insert_function):
         # init chain
         blks = create_batches(num_batches=2, num_blocks=100)
@@ -330,6 +485,140 @@ class TestIntegrationDBManager:
         )
         assert len(blobs) == 41
 
+    def test_block_indexes(self):
+        self.dbms.indexed = True
+        key = default_eccrypto.generate_key("curve25519")
+        com_id = FakeBlock().com_id
+        blks = []
+        previous = links = None
+        for i in range(10):
+            blk = FakeBlock(
+                key=key,
+                previous=previous,
+                links=links,
+                com_id=com_id,
+                block_type=b"spend" if i % 2 else b"claim",
+            )
+            previous = Links(((blk.sequence_number, blk.short_hash),))
+            links = Links(((blk.com_seq_num, blk.short_hash),))
+            blks.append(blk)
+        self.dbms.add_blocks((blk.pack(), blk) for blk in reversed(blks))
+        # Blocks of another peer are not returned
+        other = FakeBlock(com_id=com_id, block_type=b"spend")
+        self.dbms.add_block(other.pack(), other)
+
+        public_key = key.pub().key_to_bin()
+        blobs = list(self.dbms.iterate_blocks_by_public_key(public_key))
+        assert blobs == [blk.pack() for blk in blks]
+        blobs = list(self.dbms.iterate_blocks_by_public_key(public_key, 3, 5))
+        assert blobs == [blk.pack() for blk in blks[2:5]]
+
+        blobs = list(self.dbms.iterate_blocks_by_community(com_id, start_seq=9))
+        assert blobs == [blks[8].pack(), blks[9].pack()]
+
+        spends = [
+            PlexusBlock.unpack(b) for b in self.dbms.iterate_blocks_by_type(b"spend")
+        ]
+        assert {blk.hash for blk in spends} == {
+            blk.hash for blk in blks[1::2] + [other]
+        }
+        assert [blk.timestamp for blk in spends] == sorted(
+            blk.timestamp for blk in spends
+        )
+        since = blks[-1].timestamp + 1
+        assert list(self.dbms.iterate_blocks_by_type(b"spend", since)) == []
+
+    def test_no_block_indexes(self):
+        blk = FakeBlock()
+        self.dbms.add_block(blk.pack(), blk)
+        assert list(self.dbms.iterate_blocks_by_public_key(blk.public_key)) == []
+
+    def test_prune(self, tmpdir, create_batches):
+        blks = create_batches(num_batches=1, num_blocks=20)[0]
+        com_id = blks[0].com_id
+        self.dbms.indexed = True
+        self.dbms.add_blocks((blk.pack(), blk) for blk in blks)
+        frontier = self.dbms.get_chain(com_id).frontier
+
+        # Blocks are deleted once pruned in both their personal and community chain
+        assert self.dbms.prune({com_id: 11}) == 0
+        finalized = {blk.public_key: 2 for blk in blks[:10]}
+        assert self.dbms.prune(finalized) == 10
+        assert [self.dbms.has_block(blk.hash) for blk in blks] == [False] * 10 + [
+            True
+        ] * 10
+        assert not list(self.dbms.iterate_blocks_by_public_key(blks[0].public_key))
+
+        # Pruned blocks are not served anymore
+        blobs = self.dbms.get_block_blobs_by_frontier_diff(
+            com_id, FrontierDiff(Ranges(((1, 20),)), {}), set()
+        )
+        assert blobs == [blk.pack() for blk in blks[10:]]
+
+        self.dbms.close()
+        self.dbms = DBManager(ChainFactory(), LMDBLockStore(str(tmpdir)))
+        assert self.dbms.get_chain(com_id).pruned_seq_num == 11
+        assert self.dbms.get_chain(com_id).frontier == frontier
+
+    def test_blocks_page(self, create_batches, insert_function):
+        blks = create_batches(num_batches=1, num_blocks=100)
+        com_id = blks[0][0].com_id
+
+        wrap_iterate(insert_function(self.dbms, blks[0][:50]))
+        wrap_iterate(insert_function(self.dbms2, blks[0][:5]))
+
+        front = self.dbms.get_chain(com_id).frontier
+        front_diff = self.dbms2.get_chain(com_id).reconcile(front)
+        all_blobs = self.dbms.get_block_blobs_by_frontier_diff(
+            com_id, front_diff, set()
+        )
+        assert len(all_blobs) == 45
+
+        pages = []
+        while front_diff is not None:
+            page, front_diff = self.dbms.get_block_blobs_page(
+                com_id, front_diff, set(), max_bytes=10**6, max_count=10
+            )
+            assert 0 < len(page) <= 10
+            pages.append(page)
+        assert len(pages) == 5
+        assert [blob for page in pages for blob in page] == all_blobs
+
+    def test_blocks_page_max_bytes(self, create_batches, insert_function):
+        blks = create_batches(num_batches=1, num_blocks=10)
+        com_id = blks[0][0].com_id
+        wrap_iterate(insert_function(self.dbms, list(blks[0])))
+
+        front_diff = FrontierDiff(Ranges(((1, 10),)), {})
+        page, remaining = self.dbms.get_block_blobs_page(
+            com_id, front_diff, set(), max_bytes=1, max_count=10
+        )
+        # At least one block is sent, even if it exceeds the budget
+        assert page == [blks[0][0].pack()]
+        assert remaining == FrontierDiff(Ranges(((2, 10),)), {})
+
+        page, remaining = self.dbms.get_block_blobs_page(
+            com_id, front_diff, set(), max_bytes=10**6, max_count=10
+        )
+        assert page == [blk.pack() for blk in blks[0]]
+        assert remaining is None
+
+    def test_blocks_page_huge_range(self, create_batches, insert_function):
+        blks = create_batches(num_batches=1, num_blocks=20)
+        com_id = blks[0][0].com_id
+        wrap_iterate(insert_function(self.dbms, list(blks[0])))
+
+        # The cost does not depend on the size of the requested range
+        front_diff = FrontierDiff(Ranges(((15, 10**12),)), {})
+        page, remaining = self.dbms.get_block_blobs_page(
+            com_id, front_diff, set(), max_bytes=10**6, max_count=2
+        )
+        assert page == [blk.pack() for blk in blks[0][14:16]]
+        # Only the sequence numbers the chain has are left to request
+        assert remaining == FrontierDiff(Ranges(((17, 20),)), {})
+        blobs = self.dbms.get_block_blobs_by_frontier_diff(com_id, front_diff, set())
+        assert blobs == [blk.pack() for blk in blks[0][14:]]
+
     def reconcile_round(self, com_id):
         front = self.dbms.get_chain(com_id).frontier
         front_diff = self.dbms2.get_chain(com_id).reconcile(front)
@@ -1,9 +1,13 @@
 from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.messaging.serialization import PackError
+import pytest
+
 from bami.plexus.backbone.block import (
     EMPTY_PK,
     EMPTY_SIG,
     GENESIS_SEQ,
     PlexusBlock,
+    PlexusBlockView,
     UNKNOWN_SEQ,
 )
 from bami.plexus.backbone.utils import (
@@ -220,3 +224,55 @@ class TestChainBlock:
         block = FakeBlock()
 
         assert block.__hash__(), block.hash_number
+
+    def test_unpack_reuses_blob(self):
+        blk = FakeBlock()
+        blk_bytes = blk.pack()
+        blk2 = PlexusBlock.unpack(blk_bytes + b"trailing", blk.serializer)
+        assert blk2.pack() == blk_bytes
+        assert blk2.hash == blk.hash
+
+    def test_pack_cache(self):
+        blk = FakeBlock()
+        assert blk.pack() is blk.pack()
+        assert blk.pack(signature=False) == blk.serializer.pack_serializable(
+            blk.to_block_payload(signature=False)
+        )
+
+        # Setting a packed attribute drops the cached bytes
+        blk.com_seq_num = 42
+        assert blk.pack() == blk.serializer.pack_serializable(blk.to_block_payload())
+        assert PlexusBlock.unpack(blk.pack()).com_seq_num == 42
+
+    def test_slots(self):
+        with pytest.raises(AttributeError):
+            PlexusBlock().unknown = 42
+
+
+class TestBlockView:
+    def test_fields(self):
+        blk = FakeBlock()
+        view = PlexusBlockView(blk.pack())
+
+        for field in PlexusBlock.Data._fields:
+            if field != "insert_time":
+                assert getattr(view, field) == getattr(blk, field)
+        assert view.hash == blk.hash
+        assert view.com_dot == blk.com_dot
+        assert view.pers_dot == blk.pers_dot
+        assert view.pack() == blk.pack()
+        assert view.pack(signature=False) == blk.pack(signature=False)
+        assert view == blk
+        assert blk == view
+        assert hash(view) == hash(blk)
+        assert view.to_block() == blk
+        assert view.block_invariants_valid()
+
+    def test_known_hash(self):
+        blk = FakeBlock()
+        view = PlexusBlockView(memoryview(blk.pack()), b"known")
+        assert view.hash == b"known"
+
+    def test_truncated(self):
+        with pytest.raises(PackError):
+            PlexusBlockView(FakeBlock().pack()[:-1])
@@ -91,3 +91,76 @@ async def test_send_incorrect_block(monkeypatch, mocker, set_vals_by_key):
     spy.assert_called_once()
     spy2.assert_called_once()
     assert spy2.spy_return is False
+
+
+@pytest.mark.asyncio
+async def test_receive_blocks_in_order(monkeypatch, set_vals_by_key):
+    blocks = [FakeBlock(transaction=b"test") for _ in range(10)]
+    for blk in blocks:
+        set_vals_by_key.nodes[0].overlay.send_block(
+            blk, [set_vals_by_key.nodes[1].overlay.my_peer]
+        )
+    persisted = []
+    monkeypatch.setattr(
+        MockDBManager, "add_block", lambda _, __, blk: persisted.append(blk.hash)
+    )
+    monkeypatch.setattr(MockDBManager, "has_block", lambda _, __: False)
+    await deliver_messages()
+    assert persisted == [blk.hash for blk in blocks]
+
+
+@pytest.mark.asyncio
+async def test_drop_duplicate_blocks(monkeypatch, mocker, set_vals_by_key):
+    blk = FakeBlock(transaction=b"test")
+    sender = set_vals_by_key.nodes[0].overlay
+    receiver = set_vals_by_key.nodes[1].overlay
+    sender.send_block(blk.pack(), [receiver.my_peer])
+    sender.send_block(blk.pack(), [receiver.my_peer])
+    sender.send_block(blk, [receiver.my_peer])
+    monkeypatch.setattr(MockDBManager, "add_block", lambda _, __, ___: None)
+    monkeypatch.setattr(MockDBManager, "has_block", lambda _, __: False)
+    spy = mocker.spy(PlexusBlock, "unpack")
+    await deliver_messages()
+
+    # Duplicates of the raw block are dropped before decoding
+    spy.assert_called_once()
+    assert receiver.recent_blocks.peer_duplicates[sender.my_peer.mid] == 2
+    assert receiver.recent_blocks.chain_duplicates[blk.com_id] == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("num_nodes", [3])
+async def test_relay_broadcast_block(monkeypatch, mocker, set_vals_by_key):
+    blk = FakeBlock(transaction=b"test")
+    sender, relay, other = (node.overlay for node in set_vals_by_key.nodes)
+    monkeypatch.setattr(MockDBManager, "add_block", lambda _, __, ___: None)
+    monkeypatch.setattr(MockDBManager, "has_block", lambda _, __: False)
+    spy = mocker.spy(relay, "send_block")
+    sender.send_block(blk, [relay.my_peer], ttl=2)
+    await deliver_messages()
+
+    # Relayed with one hop less, to the peers other than the sender
+    spy.assert_called_once_with(blk, [other.my_peer], 1)
+    assert blk.hash in other.recent_blocks.recent
+
+
+def test_relay_once(mocker, set_vals_by_key):
+    blk = FakeBlock(transaction=b"test")
+    overlay = set_vals_by_key.nodes[0].overlay
+    spy = mocker.spy(overlay, "send_block")
+    overlay.process_broadcast_block(blk, 1)
+    spy.assert_not_called()
+
+    overlay.process_broadcast_block(blk, 3)
+    overlay.process_broadcast_block(blk, 3, set_vals_by_key.nodes[1].overlay.my_peer)
+    spy.assert_called_once_with(blk, [set_vals_by_key.nodes[1].overlay.my_peer], 2)
+
+
+def test_validate_persist_block(monkeypatch, set_vals_by_key):
+    blk = FakeBlock(transaction=b"test")
+    overlay = set_vals_by_key.nodes[0].overlay
+    monkeypatch.setattr(MockDBManager, "add_block", lambda _, __, ___: None)
+    monkeypatch.setattr(MockDBManager, "has_block", lambda _, __: False)
+    assert overlay.validate_persist_block(blk) is True
+    monkeypatch.setattr(MockDBManager, "has_block", lambda _, __: True)
+    assert overlay.validate_persist_block(blk) is False
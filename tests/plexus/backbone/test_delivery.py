@@ -0,0 +1,104 @@
+from unittest.mock import Mock
+
+from bami.plexus.backbone.delivery import OrderedDelivery
+from bami.plexus.backbone.utils import Links
+
+from tests.plexus.conftest import FakeBlock
+
+
+def create_chain(num_blocks: int):
+    blocks = [FakeBlock()]
+    for _ in range(num_blocks - 1):
+        blocks.append(
+            FakeBlock(com_id=blocks[0].com_id, links=Links((blocks[-1].com_dot,)))
+        )
+    return blocks[0].com_id, blocks
+
+
+def test_deliver_in_batches():
+    chain_id, blocks = create_chain(5)
+    delivery = OrderedDelivery(Mock(), batch_size=2)
+    delivered, batches = [], []
+    delivery.add_block_callback(chain_id, delivered.append)
+    delivery.add_batch_callback(chain_id, batches.append)
+    for block in blocks:
+        delivery.remember(block)
+    delivery.put(chain_id, [block.com_dot for block in blocks])
+    assert delivery.backlog(chain_id) == 5
+
+    assert delivery.deliver(chain_id, 3) == 3
+    assert delivery.backlog(chain_id) == 2
+    assert delivery.deliver(chain_id) == 2
+    assert delivered == blocks
+    assert batches == [blocks[:2], blocks[2:3], blocks[3:]]
+    # The decoded blocks are delivered without reading the store
+    delivery.load_block.assert_not_called()
+
+
+def test_load_unknown_block():
+    chain_id, blocks = create_chain(2)
+    delivery = OrderedDelivery(lambda _, dot: blocks[dot[0] - 1])
+    delivered = []
+    delivery.add_block_callback(chain_id, delivered.append)
+    delivery.remember(blocks[1])
+    delivery.put(chain_id, [block.com_dot for block in blocks])
+    delivery.deliver(chain_id)
+    assert delivered == blocks
+
+
+def test_reentrant_delivery():
+    chain_id, blocks = create_chain(3)
+    delivery = OrderedDelivery(Mock(), batch_size=1)
+    delivered = []
+
+    def on_block(block):
+        delivered.append(block)
+        if block is blocks[0]:
+            # A block that becomes consistent during the delivery is delivered after it
+            delivery.put(chain_id, [blocks[2].com_dot])
+            assert delivery.deliver(chain_id) == 0
+
+    delivery.add_block_callback(chain_id, on_block)
+    for block in blocks:
+        delivery.remember(block)
+    delivery.put(chain_id, [blocks[0].com_dot, blocks[1].com_dot])
+    assert delivery.deliver(chain_id) == 3
+    assert delivered == blocks
+    assert delivery.pending_chains() == []
+
+
+def test_failing_subscriber():
+    chain_id, blocks = create_chain(3)
+    delivery = OrderedDelivery(Mock(), batch_size=2)
+    delivered, batches = [], []
+
+    def failing(block):
+        raise ValueError
+
+    delivery.add_block_callback(chain_id, failing)
+    delivery.add_block_callback(chain_id, delivered.append)
+    delivery.add_batch_callback(chain_id, batches.append)
+    for block in blocks:
+        delivery.remember(block)
+    delivery.put(chain_id, [block.com_dot for block in blocks])
+    # The other subscribers still receive every block
+    assert delivery.deliver(chain_id) == 3
+    assert delivered == blocks
+    assert batches == [blocks[:2], blocks[2:]]
+
+
+def test_load_block_fails():
+    chain_id, blocks = create_chain(3)
+
+    def load_block(_, dot):
+        if dot == blocks[1].com_dot:
+            raise KeyError(dot)
+        return blocks[dot[0] - 1]
+
+    delivery = OrderedDelivery(load_block)
+    delivered = []
+    delivery.add_block_callback(chain_id, delivered.append)
+    delivery.put(chain_id, [block.com_dot for block in blocks])
+    assert delivery.deliver(chain_id) == 2
+    assert delivered == [blocks[0], blocks[2]]
+    assert delivery.backlog(chain_id) == 0
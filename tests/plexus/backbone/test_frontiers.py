@@ -1,8 +1,11 @@
 from copy import copy
+from dataclasses import FrozenInstanceError, replace
 
+from ipv8.messaging.serialization import PackError
 import pytest
 from bami.plexus.backbone.datastore.frontiers import Frontier, FrontierDiff
-from bami.plexus.backbone.utils import Links, Ranges
+from bami.plexus.backbone.exceptions import UnknownFrontierBaseException
+from bami.plexus.backbone.utils import encode_raw, Links, Ranges
 
 
 class StdVals:
@@ -38,11 +41,87 @@ def test_frontier_diff_bytes_convert(val):
     assert FrontierDiff.from_bytes(f.to_bytes()) == f
 
 
+@pytest.mark.parametrize("val", [StdVals, InconVals])
+def test_legacy_bytes_convert(val):
+    f = Frontier(val.terminal, val.holes, val.incon)
+    raw = encode_raw({b"t": f.terminal, b"h": f.holes, b"i": f.inconsistencies})
+    assert Frontier.from_bytes(raw) == f
+
+    f_diff = FrontierDiff(val.holes, val.conflicts)
+    raw = encode_raw({b"m": f_diff.missing, b"c": f_diff.conflicts})
+    assert FrontierDiff.from_bytes(raw) == f_diff
+
+
+def test_compact_large_seq_nums():
+    f = Frontier(
+        Links(((10**12, b"test2"), (5, b"test1"), (10**12 + 1, b"test2"))),
+        Ranges(((6, 2**40),)),
+        Links(((2**40 + 1, b"test1"),)),
+    )
+    assert Frontier.from_bytes(f.to_bytes()) == f
+
+
+@pytest.mark.parametrize("val", [StdVals, InconVals])
+def test_frontier_delta_convert(val):
+    base = Frontier(val.terminal, val.holes, val.incon)
+    f = Frontier(Links(((6, b"test2"), (7, b"test1"))), Ranges(()), val.incon)
+    delta = f.to_bytes(base)
+    assert len(delta) < len(f.to_bytes())
+    assert Frontier.from_bytes(delta, base) == f
+
+
+def test_unchanged_frontier_delta():
+    base = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
+    delta = base.to_bytes(base)
+    # Version, base fingerprint, changed sections and an empty hash table
+    assert len(delta) == 7
+    assert Frontier.from_bytes(delta, base) == base
+
+
+def test_frontier_delta_unknown_base():
+    base = Frontier(StdVals.terminal, StdVals.holes, StdVals.incon)
+    other = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
+    delta = other.to_bytes(base)
+    with pytest.raises(UnknownFrontierBaseException):
+        Frontier.from_bytes(delta)
+    with pytest.raises(UnknownFrontierBaseException):
+        Frontier.from_bytes(delta, other)
+
+
+def test_malformed_frontier():
+    f = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
+    raw = f.to_bytes()
+    for malformed in (b"", b"\x07", raw[:-1], raw[:3], b"\x81\xff", encode_raw(5)):
+        with pytest.raises(PackError):
+            Frontier.from_bytes(malformed)
+    # Delta that refers to a hash index past the table
+    with pytest.raises(PackError):
+        Frontier.from_bytes(b"\x02" + f.fingerprint() + b"\x01\x00\x01\x00\x05", f)
+
+
+def test_malformed_frontier_diff():
+    raw = FrontierDiff(InconVals.holes, InconVals.conflicts).to_bytes()
+    for malformed in (b"", b"\x07", raw[:-1], b"\x01\x00\x00\x01\x00\x09\x00"):
+        with pytest.raises(PackError):
+            FrontierDiff.from_bytes(malformed)
+
+
+def test_inverted_peer_ranges():
+    inverted = ((9, 3), (15, 16))
+    with pytest.raises(PackError):
+        Frontier.from_bytes(
+            encode_raw({b"t": ((16, b"val"),), b"h": inverted, b"i": ()})
+        )
+    with pytest.raises(PackError):
+        FrontierDiff.from_bytes(encode_raw({b"m": inverted, b"c": {}}))
+    with pytest.raises(PackError):
+        FrontierDiff.from_bytes(encode_raw({b"m": (5,), b"c": {}}))
+
+
 def test_compare_frontiers():
     val = StdVals
     f = Frontier(val.terminal, val.holes, val.incon)
-    f2 = copy(f)
-    f2.terminal = Links(((6, b"test2"),))
+    f2 = replace(f, terminal=Links(((6, b"test2"),)))
 
     assert f != f2
     assert f2 > f
@@ -50,3 +129,26 @@ def test_compare_frontiers():
     inc_f = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
     assert f > inc_f
     assert f2 > inc_f
+
+
+def test_frontier_immutable():
+    f = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
+    with pytest.raises(FrozenInstanceError):
+        f.terminal = StdVals.terminal
+    assert copy(f) == f
+    assert f.max_seq_num == 5
+    assert f.num_holes == 4
+
+
+def test_frontier_hash():
+    f = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
+    f2 = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
+    assert f == f2 and hash(f) == hash(f2)
+    assert f != replace(f, holes=Ranges(((1, 3),)))
+    assert len({f, f2}) == 1
+
+
+def test_unchanged_delta_returns_base():
+    base = Frontier(InconVals.terminal, InconVals.holes, InconVals.incon)
+    received = Frontier.from_bytes(base.to_bytes())
+    assert Frontier.from_bytes(base.to_bytes(base), received) is received
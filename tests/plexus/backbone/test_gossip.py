@@ -1,12 +1,21 @@
-from asyncio.queues import Queue
 from typing import Iterable
 
 from bami.plexus.backbone.datastore.frontiers import Frontier, FrontierDiff
 from bami.plexus.backbone.gossip import (
+    bundle_frontiers,
+    FrontierScheduler,
+    GossipController,
     GossipFrontiersMixin,
     NextPeerSelectionStrategy,
+    PeerKnowledgeIndex,
 )
-from bami.plexus.backbone.payload import BlocksRequestPayload, FrontierPayload
+from bami.plexus.backbone.payload import (
+    BlocksRequestPayload,
+    BlocksResponseCursorPayload,
+    FrontierPayload,
+    MultiFrontierPayload,
+)
+from bami.plexus.backbone.utils import decode_raw
 from ipv8.peer import Peer
 import pytest
 
@@ -20,8 +29,23 @@ class MockNextPeerSelection(NextPeerSelectionStrategy):
 
 
 class FakeGossipCommunity(MockedCommunity, GossipFrontiersMixin):
-    def incoming_frontier_queue(self, subcom_id: bytes) -> Queue:
-        pass
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = FrontierScheduler()
+        self.controller = GossipController(max_fanout=5)
+        self.chains = {}
+
+    @property
+    def frontier_scheduler(self) -> FrontierScheduler:
+        return self.scheduler
+
+    @property
+    def gossip_controller(self) -> GossipController:
+        return self.controller
+
+    @property
+    def gossip_chains(self):
+        return self.chains
 
     @property
     def gossip_strategy(self) -> NextPeerSelectionStrategy:
@@ -54,7 +78,7 @@ def test_init_correctly(set_vals_by_key):
 @pytest.mark.asyncio
 async def test_one_gossip_round(set_vals_by_key, monkeypatch, mocker):
     monkeypatch.setattr(MockDBManager, "get_chain", lambda _, __: MockChain())
-    front = Frontier(((1, "val1"),), (), ())
+    front = Frontier(((1, b"val1"),), (), ())
     monkeypatch.setattr(MockChain, "frontier", front)
     monkeypatch.setattr(
         MockNextPeerSelection,
@@ -72,8 +96,8 @@ async def test_one_gossip_round(set_vals_by_key, monkeypatch, mocker):
     monkeypatch.setattr(MockSettings, "frontier_gossip_fanout", 5)
     monkeypatch.setattr(
         MockDBManager,
-        "get_block_blobs_by_frontier_diff",
-        lambda _, c_id, f_diff, __: [b"blob1"],
+        "get_block_blobs_page",
+        lambda _, c_id, f_diff, __, max_bytes, max_count: ([b"blob1"], None),
     )
 
     spy = mocker.spy(set_vals_by_key.nodes[0].overlay, "send_packet")
@@ -81,3 +105,320 @@ async def test_one_gossip_round(set_vals_by_key, monkeypatch, mocker):
         set_vals_by_key.community_id
     )
     spy.assert_called()
+
+
+def test_scheduler_coalesce(set_vals_by_key):
+    peer = set_vals_by_key.nodes[1].overlay.my_peer
+    scheduler = FrontierScheduler()
+    assert not scheduler.put(b"chain", peer, Frontier(((1, b"val1"),), (), ()), True)
+
+    scheduler.add_chain(b"chain")
+    scheduler.put(b"chain", peer, Frontier(((1, b"val1"),), (), ()), True)
+    newest = Frontier(((2, b"val2"),), (), ())
+    scheduler.put(b"chain", peer, newest, False)
+    assert scheduler.schedule(0, lambda chain_id, frontier: 0) == [
+        (b"chain", peer.public_key.key_to_bin())
+    ]
+    # Only the newest frontier is kept, and the peer still gets a response
+    assert scheduler.pop(b"chain", peer.public_key.key_to_bin()) == (peer, newest, True)
+    assert scheduler.schedule(0, lambda chain_id, frontier: 0) == []
+
+
+def test_scheduler_priority(set_vals_by_key):
+    peers = [node.overlay.my_peer for node in set_vals_by_key.nodes]
+    scheduler = FrontierScheduler()
+    for chain_id in (b"chain1", b"chain2", b"chain3"):
+        scheduler.add_chain(chain_id)
+    scheduler.put(b"chain1", peers[0], Frontier(((5, b"val"),), (), ()), False)
+    scheduler.put(b"chain2", peers[0], Frontier(((3, b"val"),), (), ()), False)
+    scheduler.put(b"chain2", peers[1], Frontier(((9, b"val"),), (), ()), False)
+    scheduler.put(b"chain3", peers[1], Frontier(((7, b"val"),), (), ()), False)
+    scheduler.pause(b"chain3", 10)
+
+    def lag(chain_id, frontier):
+        return max(frontier.terminal)[0]
+
+    # One frontier per chain: the one the chain lags most behind
+    assert scheduler.schedule(5, lag) == [
+        (b"chain2", peers[1].public_key.key_to_bin()),
+        (b"chain1", peers[0].public_key.key_to_bin()),
+    ]
+    assert len(scheduler.schedule(10, lag)) == 3
+
+
+def test_process_frontiers_budget(set_vals_by_key, monkeypatch, mocker):
+    overlay = set_vals_by_key.nodes[0].overlay
+    peer = set_vals_by_key.nodes[1].overlay.my_peer
+    monkeypatch.setattr(MockDBManager, "get_chain", lambda _, __: None)
+    monkeypatch.setattr(
+        MockDBManager,
+        "reconcile",
+        lambda _, c_id, frontier, pub_key: FrontierDiff(((1, 10),), {}),
+    )
+    monkeypatch.setattr(MockSettings, "frontier_max_requested_blocks", 10)
+    for chain_id in (b"chain1", b"chain2"):
+        overlay.frontier_scheduler.add_chain(chain_id)
+        overlay.frontier_scheduler.put(
+            chain_id, peer, Frontier(((10, b"val"),), (), ()), False
+        )
+    spy = mocker.spy(overlay, "send_packet")
+
+    # The first request spends the budget of the tick
+    overlay.process_frontiers()
+    assert spy.call_count == 1
+    # The chain that requested blocks is paused, the other one goes next
+    overlay.process_frontiers()
+    assert spy.call_count == 2
+    overlay.process_frontiers()
+    assert spy.call_count == 2
+
+
+def test_process_frontiers_congested(set_vals_by_key, monkeypatch, mocker):
+    overlay = set_vals_by_key.nodes[0].overlay
+    peer = set_vals_by_key.nodes[1].overlay.my_peer
+    monkeypatch.setattr(MockDBManager, "get_chain", lambda _, __: None)
+    monkeypatch.setattr(
+        MockDBManager,
+        "reconcile",
+        lambda _, c_id, frontier, pub_key: FrontierDiff(((1, 10),), {}),
+    )
+    overlay.frontier_scheduler.add_chain(b"chain")
+    overlay.frontier_scheduler.put(
+        b"chain", peer, Frontier(((10, b"val"),), (), ()), False
+    )
+    spy = mocker.spy(overlay, "send_packet")
+
+    # No blocks are requested while the delivery of the chain is behind
+    monkeypatch.setattr(overlay, "is_delivery_congested", lambda _: True)
+    overlay.process_frontiers()
+    spy.assert_not_called()
+    monkeypatch.setattr(overlay, "is_delivery_congested", lambda _: False)
+    overlay.process_frontiers()
+    spy.assert_called_once()
+
+
+def test_malformed_frontier_dropped(set_vals_by_key, mocker):
+    overlay = set_vals_by_key.nodes[0].overlay
+    peer = set_vals_by_key.nodes[1].overlay.my_peer
+    overlay.frontier_scheduler.add_chain(b"chain")
+    spy = mocker.spy(overlay.frontier_scheduler, "put")
+
+    overlay.process_raw_frontier(peer, b"chain", b"\x01\x05", True)
+    spy.assert_not_called()
+    frontier = Frontier(((10, b"val"),), (), ())
+    overlay.process_raw_frontier(peer, b"chain", frontier.to_bytes(), True)
+    spy.assert_called_once_with(b"chain", peer, frontier, True)
+
+
+def test_gossip_backoff():
+    controller = GossipController(
+        min_interval=1, max_interval=4, backoff=2, min_fanout=2, max_fanout=6
+    )
+    controller.add_chain(b"chain")
+    frontier = Frontier(((1, b"val1"),), (), ())
+    assert controller.is_due(b"chain", 0)
+
+    controller.on_round(b"chain", frontier, 0)
+    assert controller.metrics()[b"chain"] == (1, 6)
+    # The frontier did not change since the last round
+    controller.on_round(b"chain", frontier, 1)
+    assert controller.metrics()[b"chain"] == (2, 3)
+    assert not controller.is_due(b"chain", 2)
+    assert controller.is_due(b"chain", 3)
+    controller.on_round(b"chain", frontier, 3)
+    controller.on_round(b"chain", frontier, 7)
+    assert controller.metrics()[b"chain"] == (4, 2)
+
+    # Activity on the chain restores the rate on the next tick
+    controller.on_activity(b"chain")
+    assert controller.is_due(b"chain", 8)
+    controller.on_round(b"chain", frontier, 8)
+    assert controller.metrics()[b"chain"] == (1, 6)
+    controller.on_round(b"chain", Frontier(((2, b"val2"),), (), ()), 9)
+    assert controller.metrics()[b"chain"] == (1, 6)
+
+
+def test_fixed_gossip_rate():
+    controller = GossipController(
+        min_interval=1, max_interval=1, min_fanout=6, max_fanout=6
+    )
+    controller.add_chain(b"chain")
+    frontier = Frontier(((1, b"val1"),), (), ())
+    for now in range(5):
+        assert controller.is_due(b"chain", now)
+        controller.on_round(b"chain", frontier, now)
+    assert controller.metrics()[b"chain"] == (1, 6)
+
+
+def test_reconcile_activity(set_vals_by_key, monkeypatch):
+    overlay = set_vals_by_key.nodes[0].overlay
+    peer = set_vals_by_key.nodes[1].overlay.my_peer
+    frontier = Frontier(((1, b"val1"),), (), ())
+    monkeypatch.setattr(MockDBManager, "get_chain", lambda _, __: None)
+    monkeypatch.setattr(
+        MockDBManager,
+        "reconcile",
+        lambda _, c_id, frontier, pub_key: FrontierDiff(((1, 1),), {}),
+    )
+    overlay.gossip_controller.add_chain(b"chain")
+    overlay.gossip_controller.on_round(b"chain", frontier, 0)
+    overlay.gossip_controller.on_round(b"chain", frontier, 1)
+    assert overlay.gossip_controller.metrics()[b"chain"][0] > 0.5
+
+    overlay.process_frontier(b"chain", peer, frontier, False)
+    overlay.gossip_controller.on_round(b"chain", frontier, 2)
+    assert overlay.gossip_controller.metrics()[b"chain"] == (0.5, 5)
+
+
+def test_peer_knowledge_index(set_vals_by_key):
+    peers = [node.overlay.my_peer for node in set_vals_by_key.nodes]
+    index = PeerKnowledgeIndex()
+    index.sync_peers(peers, 0)
+    # Nothing to share yet
+    assert index.sample_behind(5) == []
+
+    index.update_local(Frontier(((2, b"val2"),), (), ()))
+    assert set(index.sample_behind(5)) == set(peers)
+    index.update_peer(peers[0], Frontier(((2, b"val2"),), (), ()))
+    assert index.sample_behind(5) == [peers[1]]
+    # The peer is classified by its last frontier, even if it is not newer than the previous
+    index.update_peer(peers[0], Frontier(((1, b"val1"),), (), ()))
+    assert set(index.sample_behind(5)) == set(peers)
+    index.update_peer(peers[0], Frontier(((2, b"val2"),), (), ()))
+    index.update_peer(peers[1], Frontier(((3, b"val3"),), ((1, 1),), ()))
+    assert index.sample_behind(5) == [peers[1]]
+    # A peer that was behind is re-evaluated when the local frontier changes
+    index.update_local(Frontier(((2, b"val2"),), ((1, 1),), ()))
+    assert index.sample_behind(5) == []
+
+    index.update_local(Frontier(((3, b"val3"),), (), ()))
+    assert set(index.sample_behind(5)) == set(peers)
+    assert len(index.sample_behind(1)) == 1
+
+    # The peers that left the sub-community are dropped
+    index.sync_peers(peers[:1], 1)
+    assert index.sample_behind(5) == [peers[0]]
+
+
+def test_bundle_frontiers():
+    frontiers = [(b"chain%d" % i, b"f" * 50) for i in range(10)]
+    bundles = bundle_frontiers(frontiers, 200)
+    assert all(len(bundle) <= 200 for bundle in bundles)
+    assert len(bundles) == 4
+    assert [entry for b in bundles for entry in decode_raw(b)] == frontiers
+    # A frontier over the budget is sent alone
+    assert len(bundle_frontiers([(b"chain", b"f" * 300)] + frontiers[:1], 200)) == 2
+
+
+@pytest.mark.asyncio
+async def test_bundled_gossip_round(set_vals_by_key, monkeypatch, mocker):
+    overlay = set_vals_by_key.nodes[0].overlay
+    monkeypatch.setattr(MockDBManager, "get_chain", lambda _, __: MockChain())
+    monkeypatch.setattr(MockChain, "frontier", Frontier(((1, b"val1"),), (), ()))
+    monkeypatch.setattr(MockSettings, "frontier_bundle_max_bytes", 1200, False)
+    monkeypatch.setattr(
+        MockNextPeerSelection,
+        "get_next_gossip_peers",
+        lambda _, subcom, chain_id, frontier, fanout: [
+            p.overlay.my_peer for p in set_vals_by_key.nodes[1:]
+        ],
+    )
+    for subcom_id in (b"chain1", b"chain2", b"chain3"):
+        overlay.gossip_chains[subcom_id] = (subcom_id, b"")
+        overlay.gossip_chains[b"w" + subcom_id] = (subcom_id, b"w")
+    spy = mocker.spy(overlay, "send_packet")
+
+    # One packet for the frontiers of all chains
+    overlay.frontier_gossip_bundle_task()
+    spy.assert_called_once()
+    payload = spy.call_args[0][1]
+    assert isinstance(payload, MultiFrontierPayload)
+    assert len(decode_raw(payload.frontiers)) == 6
+
+
+def test_receive_bundle(set_vals_by_key):
+    overlay = set_vals_by_key.nodes[0].overlay
+    peer = set_vals_by_key.nodes[1].overlay.my_peer
+    overlay.frontier_scheduler.add_chain(b"chain1")
+    overlay.frontier_scheduler.add_chain(b"chain2")
+    frontiers = [
+        (b"chain1", Frontier(((1, b"val1"),), (), ())),
+        (b"chain2", Frontier(((2, b"val2"),), (), ())),
+    ]
+    bundle = bundle_frontiers([(c, f.to_bytes()) for c, f in frontiers], 1200)[0]
+
+    overlay.received_multi_frontier.__wrapped__(
+        overlay, peer, MultiFrontierPayload(bundle)
+    )
+    peer_id = peer.public_key.key_to_bin()
+    for chain_id, frontier in frontiers:
+        assert overlay.frontier_scheduler.pop(chain_id, peer_id) == (
+            peer,
+            frontier,
+            True,
+        )
+
+
+def test_scheduler_continue_request():
+    scheduler = FrontierScheduler()
+    conflicts = {(4, b"val4"): {}, (6, b"val6"): {5: (b"val5",)}}
+    scheduler.request_sent(b"chain", b"peer", FrontierDiff(((1, 10),), conflicts))
+    # Not a request to this peer
+    assert not scheduler.continue_request(
+        b"chain", b"other", FrontierDiff(((5, 10),), conflicts)
+    )
+
+    cursor = FrontierDiff(((5, 8),), {(6, b"val6"): {}})
+    assert scheduler.continue_request(b"chain", b"peer", cursor) == FrontierDiff(
+        ((5, 8),), {(6, b"val6"): {5: (b"val5",)}}
+    )
+    # The same cursor does not move past the start of the continued request
+    assert not scheduler.continue_request(b"chain", b"peer", cursor)
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        # Outside of the request
+        FrontierDiff(((5, 11),), {}),
+        FrontierDiff(((5, 8),), {(7, b"val7"): {}}),
+        # Does not move past the start of the request
+        FrontierDiff(((1, 10),), {}),
+        FrontierDiff((), {}),
+    ],
+)
+def test_scheduler_invalid_cursor(cursor):
+    scheduler = FrontierScheduler()
+    request = FrontierDiff(((1, 10),), {(4, b"val4"): {}})
+    scheduler.request_sent(b"chain", b"peer", request)
+    assert not scheduler.continue_request(b"chain", b"peer", cursor)
+    # The request is not continued after an invalid cursor
+    assert not scheduler.continue_request(
+        b"chain", b"peer", FrontierDiff(((5, 10),), {})
+    )
+
+
+def test_received_blocks_response_cursor(set_vals_by_key, mocker):
+    overlay = set_vals_by_key.nodes[0].overlay
+    peer = set_vals_by_key.nodes[1].overlay.my_peer
+    overlay.frontier_scheduler.add_chain(b"chain")
+    spy = mocker.spy(overlay, "send_packet")
+
+    def receive_cursor(cursor: FrontierDiff) -> None:
+        overlay.received_blocks_response_cursor.__wrapped__(
+            overlay, peer, BlocksResponseCursorPayload(b"chain", cursor.to_bytes())
+        )
+
+    receive_cursor(FrontierDiff(((5, 10),), {}))
+    spy.assert_not_called()
+
+    overlay.frontier_scheduler.request_sent(
+        b"chain", peer.public_key.key_to_bin(), FrontierDiff(((1, 10),), {})
+    )
+    receive_cursor(FrontierDiff(((5, 10),), {}))
+    spy.assert_called_once()
+    payload = spy.call_args[0][1]
+    assert isinstance(payload, BlocksRequestPayload)
+    assert FrontierDiff.from_bytes(payload.frontier_diff) == FrontierDiff(
+        ((5, 10),), {}
+    )
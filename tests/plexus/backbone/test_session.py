@@ -0,0 +1,105 @@
+from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.peer import Peer
+
+from bami.plexus.backbone.session import REPLAY_WINDOW, ReplayWindow, SessionKeys
+
+
+def create_peer(curve: str = "curve25519") -> Peer:
+    return Peer(default_eccrypto.generate_key(curve))
+
+
+def test_handshake():
+    alice, bob = create_peer(), create_peer()
+    alice_keys, bob_keys = SessionKeys(alice.key), SessionKeys(bob.key, lifetime=10)
+
+    nonce = alice_keys.start(bob, 0)
+    # A single request waits for the response
+    assert alice_keys.start(bob, 1) is None
+    assert alice_keys.get_send_key(bob, 1) is None
+
+    assert bob_keys.accept(alice, nonce, 1, 1)
+    assert not alice_keys.complete(bob, b"x" * 32, 1)
+    assert alice_keys.complete(bob, nonce, 1)
+    key = alice_keys.get_send_key(bob, 1)
+    assert key == bob_keys.get_receive_key(alice.mid)[1]
+    # The other direction has its own key
+    assert bob_keys.get_send_key(alice, 1) is None
+    assert alice_keys.get_receive_key(bob.mid) is None
+
+
+def test_key_expires():
+    alice, bob = create_peer(), create_peer()
+    alice_keys, bob_keys = SessionKeys(alice.key, lifetime=10), SessionKeys(bob.key)
+    nonce = alice_keys.start(bob, 0)
+    bob_keys.accept(alice, nonce, 0, 0)
+    alice_keys.complete(bob, nonce, 0)
+
+    assert alice_keys.get_send_key(bob, 9)
+    assert alice_keys.get_send_key(bob, 10) is None
+    # A new key replaces the expired one
+    new_nonce = alice_keys.start(bob, 10)
+    assert new_nonce != nonce
+    bob_keys.accept(alice, new_nonce, 10, 10)
+    alice_keys.complete(bob, new_nonce, 10)
+    assert alice_keys.get_send_key(bob, 11) == bob_keys.get_receive_key(alice.mid)[1]
+
+
+def test_unsupported_keys():
+    alice, bob = create_peer(), create_peer("very-low")
+    alice_keys = SessionKeys(alice.key)
+    assert alice_keys.start(bob, 0) is None
+    assert not alice_keys.accept(bob, b"x" * 32, 0, 0)
+    assert SessionKeys(bob.key).start(alice, 0) is None
+
+
+def test_reject_replayed_request():
+    alice, bob = create_peer(), create_peer()
+    alice_keys, bob_keys = SessionKeys(alice.key), SessionKeys(bob.key)
+    old_nonce = alice_keys.start(bob, 0)
+    assert bob_keys.accept(alice, old_nonce, 100, 100)
+    nonce = alice_keys.start(bob, 10)
+    assert bob_keys.accept(alice, nonce, 110, 110)
+    alice_keys.complete(bob, nonce, 110)
+    key = bob_keys.get_receive_key(alice.mid)[1]
+
+    # A captured request does not reset the key, whether replayed soon or late
+    assert not bob_keys.accept(alice, nonce, 110, 111)
+    assert not bob_keys.accept(alice, old_nonce, 100, 112)
+    assert not bob_keys.accept(alice, old_nonce, 100, 1000)
+    assert bob_keys.get_receive_key(alice.mid)[1] == key
+    assert alice_keys.get_send_key(bob, 111) == key
+    # A request from the future is rejected too
+    assert not bob_keys.accept(alice, alice_keys.start(bob, 20), 500, 120)
+
+
+def test_replay_window():
+    window = ReplayWindow()
+    assert window.accept(100)
+    assert not window.accept(100)
+    # Reordered packets are accepted once
+    assert window.accept(103)
+    assert window.accept(101)
+    assert not window.accept(101)
+    assert window.accept(102)
+    assert window.accept(103 + REPLAY_WINDOW)
+    assert not window.accept(103)
+    assert window.accept(104)
+
+
+def test_rejected_key():
+    alice, bob = create_peer(), create_peer()
+    alice_keys, bob_keys = SessionKeys(alice.key), SessionKeys(bob.key)
+    nonce = alice_keys.start(bob, 0)
+    bob_keys.accept(alice, nonce, 0, 0)
+    alice_keys.complete(bob, nonce, 0)
+    counter = alice_keys.next_counter(bob)
+    assert alice_keys.next_counter(bob) == counter + 1
+
+    # Counters not sent with the key do not drop it
+    assert not alice_keys.rejected(bob, counter + 2)
+    assert not alice_keys.rejected(bob, counter - 1)
+    assert alice_keys.rejected(bob, counter)
+    assert alice_keys.get_send_key(bob, 1) is None
+    # A rejection is sent once per request timeout
+    assert bob_keys.should_reject(alice.mid, 0)
+    assert not bob_keys.should_reject(alice.mid, 1)
@@ -1,6 +1,11 @@
 from ipv8.keyvault.crypto import default_eccrypto
 import pytest
-from bami.plexus.backbone.sub_community import IPv8SubCommunity, SubCommunityMixin
+from bami.plexus.backbone.sub_community import (
+    IPv8SubCommunity,
+    LightSubCommunity,
+    SubCommunityMixin,
+)
+from ipv8.peer import Peer
 from ipv8.test.mocking.ipv8 import MockIPv8
 
 from tests.plexus.mocking.community import (
@@ -20,6 +25,18 @@ def test_is_sub(monkeypatch):
     assert f.is_subscribed(b"test1")
 
 
+@pytest.mark.asyncio
+async def test_get_peer():
+    peer = Peer(default_eccrypto.generate_key(u"curve25519"))
+    subcom_key = default_eccrypto.generate_key(u"curve25519").pub().key_to_bin()
+    ipv8 = MockIPv8(u"curve25519", IPv8SubCommunity, subcom_id=subcom_key)
+    for subcom in (LightSubCommunity(subcom_key), ipv8.overlay):
+        assert subcom.get_peer(peer.public_key.key_to_bin()) is None
+        subcom.add_peer(peer)
+        assert subcom.get_peer(peer.public_key.key_to_bin()) is peer
+    await ipv8.stop()
+
+
 # Test sub to multiple comms
 
 
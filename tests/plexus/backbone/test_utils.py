@@ -4,12 +4,15 @@ from unittest.mock import Mock
 from bami.plexus.backbone.utils import (
     decode_links,
     decode_raw,
+    DuplicateFilter,
     EMPTY_PK,
     EMPTY_SIG,
     encode_links,
     encode_raw,
     expand_ranges,
     GENESIS_HASH,
+    IndexedSet,
+    IntervalSet,
     KEY_LEN,
     Links,
     ranges,
@@ -41,6 +44,94 @@ def test_expand_ranges(ranges_fixture: Mock):
     assert decompressed == ranges_fixture[0]
 
 
+def test_ranges_interval_set(ranges_fixture: Mock):
+    assert ranges(IntervalSet(ranges_fixture[1])) == ranges_fixture[1]
+
+
+def test_interval_set_add_remove():
+    vals = IntervalSet()
+    vals.add_range(10, 20)
+    vals.add_range(30, 40)
+    vals.add(21)
+    vals.add_range(25, 29)
+    assert vals.ranges() == ((10, 21), (25, 40))
+    vals.add_range(22, 24)
+    assert vals.ranges() == ((10, 40),)
+
+    vals.discard(15)
+    vals.discard_range(30, 50)
+    vals.remove(10)
+    assert vals.ranges() == ((11, 14), (16, 29))
+    assert 11 in vals and 15 not in vals and 10 not in vals and 30 not in vals
+    assert len(vals) == 18
+    with pytest.raises(KeyError):
+        vals.remove(15)
+
+
+def test_interval_set_large_gap():
+    vals = IntervalSet()
+    vals.add_range(1, 10 ** 12)
+    vals.discard(5)
+    assert vals.ranges() == ((1, 4), (6, 10 ** 12))
+    assert 10 ** 12 in vals and 10 ** 12 + 1 not in vals
+
+
+def test_interval_set_arithmetic():
+    vals = IntervalSet(((1, 100),))
+    assert vals - IntervalSet(((1, 10), (50, 60))) == IntervalSet(((11, 49), (61, 100)))
+    assert vals - {1, 2, 3} == set(range(4, 101))
+    assert {0, 1, 2} - vals == {0}
+    assert vals & IntervalSet(((0, 5), (90, 10**9))) == IntervalSet(((1, 5), (90, 100)))
+
+
+def test_expand_inverted_ranges():
+    vals = expand_ranges(((9, 3), (15, 16)))
+    assert len(vals) == 2
+    assert list(vals) == [15, 16]
+
+
+def test_duplicate_filter():
+    recent = DuplicateFilter(2)
+    assert not recent.is_duplicate(b"hash1", b"peer1")
+    recent.add(b"hash1", b"chain1")
+    recent.add(b"hash2", b"chain1")
+    assert recent.is_duplicate(b"hash1", b"peer1")
+    assert recent.is_duplicate(b"hash1", b"peer2")
+    assert recent.is_duplicate(b"hash2", b"peer1")
+    assert recent.peer_duplicates == {b"peer1": 2, b"peer2": 1}
+    assert recent.chain_duplicates == {b"chain1": 3}
+
+    # The least recently seen hash is evicted first
+    recent.add(b"hash3", b"chain2")
+    assert recent.is_duplicate(b"hash2", b"peer1")
+    assert not recent.is_duplicate(b"hash1", b"peer1")
+    recent.discard(b"hash2")
+    assert not recent.is_duplicate(b"hash2", b"peer1")
+
+
+def test_duplicate_counters_bounded():
+    recent = DuplicateFilter(10, max_counters=2)
+    recent.add(b"hash1", b"chain1")
+    for peer_id in (b"peer1", b"peer2", b"peer3"):
+        assert recent.is_duplicate(b"hash1", peer_id)
+    assert recent.peer_duplicates == {b"peer2": 1, b"peer3": 1}
+
+
+def test_indexed_set():
+    vals = IndexedSet()
+    for val in range(5):
+        vals.add(val)
+    vals.add(3)
+    assert len(vals) == 5
+    vals.discard(1)
+    vals.discard(4)
+    vals.discard(7)
+    assert set(vals) == {0, 2, 3}
+    assert 2 in vals and 1 not in vals
+    assert sorted(vals.sample(10)) == [0, 2, 3]
+    assert len(set(vals.sample(2)) & {0, 2, 3}) == 2
+
+
 @pytest.fixture(
     params=[GENESIS_HASH, EMPTY_SIG, EMPTY_PK], ids=["genesis", "empty_sig", "empty_pk"]
 )
@@ -0,0 +1,44 @@
+from ipv8.keyvault.crypto import default_eccrypto
+import pytest
+
+from bami.plexus.backbone.block import PlexusBlock
+from bami.plexus.backbone.verification import BlockVerifier
+
+from tests.plexus.conftest import FakeBlock
+
+
+@pytest.fixture
+def verifier():
+    block_verifier = BlockVerifier(num_workers=2)
+    yield block_verifier
+    block_verifier.close()
+
+
+@pytest.mark.asyncio
+async def test_verify(verifier):
+    blocks = [FakeBlock() for _ in range(5)]
+    invalid = FakeBlock()
+    invalid.sign(default_eccrypto.generate_key("curve25519"))
+
+    await verifier.verify(blocks + [invalid])
+    assert all(verifier.results[blk.hash] for blk in blocks)
+    assert verifier.results[invalid.hash] is False
+    assert not verifier.is_valid(invalid)
+
+
+@pytest.mark.asyncio
+async def test_verify_once(monkeypatch, verifier):
+    verified = []
+    original = PlexusBlock.block_invariants_valid
+
+    def block_invariants_valid(block):
+        verified.append(block.hash)
+        return original(block)
+
+    monkeypatch.setattr(PlexusBlock, "block_invariants_valid", block_invariants_valid)
+    blk = FakeBlock()
+    # The same block received from several peers
+    await verifier.verify([blk, PlexusBlock.unpack(blk.pack())])
+    await verifier.verify([blk])
+    assert verifier.is_valid(blk)
+    assert verified == [blk.hash]
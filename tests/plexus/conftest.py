@@ -9,7 +9,12 @@ from ipv8.keyvault.crypto import default_eccrypto
 from ipv8.keyvault.private.libnaclkey import LibNaCLSK
 
 from bami.plexus.backbone.block import EMPTY_SIG, PlexusBlock
-from bami.plexus.backbone.datastore.chain_store import BaseChain, Chain
+from bami.plexus.backbone.datastore.block_store import LMDBLockStore
+from bami.plexus.backbone.datastore.chain_store import (
+    BaseChain,
+    ChainFactory,
+    LMDBChainFactory,
+)
 from bami.plexus.backbone.datastore.database import BaseDB
 from bami.plexus.backbone.utils import (
     encode_links,
@@ -183,9 +188,19 @@ def insert_function(request):
     return param
 
 
+@pytest.fixture(params=["memory", "lmdb"])
+def chain_factory(request, tmpdir):
+    if request.param == "lmdb":
+        block_store = LMDBLockStore(str(tmpdir))
+        yield LMDBChainFactory(block_store)
+        block_store.close()
+    else:
+        yield ChainFactory()
+
+
 @pytest.fixture
-def chain():
-    return Chain()
+def chain(chain_factory):
+    return chain_factory.create_chain(b"chain_id")
 
 
 insert_function_copy = insert_function
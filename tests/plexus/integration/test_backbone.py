@@ -1,3 +1,5 @@
+from asyncio import sleep
+import time
 from typing import Dict
 
 import pytest
@@ -5,6 +7,7 @@ import pytest
 from bami.plexus.backbone.block import PlexusBlock
 from bami.plexus.backbone.blockresponse import BlockResponseMixin, BlockResponse
 from bami.plexus.backbone.community import PlexusCommunity
+from bami.plexus.backbone.settings import BamiSettings
 from bami.plexus.backbone.sub_community import BaseSubCommunity, LightSubCommunity
 from bami.plexus.backbone.utils import decode_raw, encode_raw
 from tests.plexus.mocking.base import deliver_messages
@@ -22,6 +25,65 @@ class SimpleCommunity(PlexusCommunity):
         pass
 
 
+class BundledGossipCommunity(SimpleCommunity):
+    """
+    Basic community that gossips the frontiers of its chains in bundles.
+    """
+
+    def __init__(self, *args, **kwargs):
+        settings = BamiSettings()
+        settings.frontier_gossip_bundled = True
+        super().__init__(*args, settings=settings, **kwargs)
+
+
+class AdaptiveGossipCommunity(SimpleCommunity):
+    """
+    Basic community that adapts the gossip rate of its chains to their activity.
+    """
+
+    def __init__(self, *args, **kwargs):
+        settings = BamiSettings()
+        settings.frontier_gossip_adaptive = True
+        super().__init__(*args, settings=settings, **kwargs)
+
+
+class SessionAuthCommunity(SimpleCommunity):
+    """
+    Basic community that authenticates the gossip messages with session keys.
+    """
+
+    def __init__(self, *args, **kwargs):
+        settings = BamiSettings()
+        settings.session_auth = True
+        super().__init__(*args, settings=settings, **kwargs)
+
+
+class PagedResponseCommunity(SimpleCommunity):
+    """
+    Basic community that responds to a blocks request with pages of two blocks.
+    """
+
+    def __init__(self, *args, **kwargs):
+        settings = BamiSettings()
+        settings.block_response_max_count = 2
+        super().__init__(*args, settings=settings, **kwargs)
+
+
+class AsyncDeliveryCommunity(SimpleCommunity):
+    """
+    Basic community that delivers the blocks in order in a task, and records them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        settings = BamiSettings()
+        settings.async_block_delivery = True
+        super().__init__(*args, settings=settings, **kwargs)
+        self.delivered = []
+
+    def received_block_in_order(self, block: PlexusBlock) -> None:
+        self.delivered.append(block)
+
+
 class BlockResponseCommunity(BlockResponseMixin, SimpleCommunity):
     """
     Basic community with block response functionality enabled.
@@ -92,6 +154,180 @@ async def test_simple_frontier_reconciliation_after_partition(set_vals_by_key):
     assert frontier1 == frontier2
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("overlay_class", [PagedResponseCommunity])
+@pytest.mark.parametrize("num_nodes", [2])
+async def test_paged_blocks_response(set_vals_by_key, mocker):
+    """
+    Test whether a truncated blocks response is continued until all blocks are synchronized.
+    """
+    community_id = set_vals_by_key.community_id
+    node0, node1 = (node.overlay for node in set_vals_by_key.nodes)
+    for _ in range(5):
+        node0.create_signed_block(com_id=community_id)
+
+    spy = mocker.spy(node1.frontier_scheduler, "continue_request")
+    node0.frontier_gossip_sync_task(community_id)
+    node1.frontier_gossip_sync_task(community_id)
+    await deliver_messages()
+
+    # Two cursors: after the blocks 1-2, and after the blocks 3-4
+    assert spy.call_count == 2
+    assert node1.persistence.get_chain(community_id).frontier.terminal[0][0] == 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("overlay_class", [BundledGossipCommunity])
+@pytest.mark.parametrize("num_nodes", [2])
+async def test_bundled_frontier_reconciliation(set_vals_by_key):
+    """
+    Test whether missing blocks are synchronized with bundled frontier gossip.
+    """
+    community_id = set_vals_by_key.community_id
+    for _ in range(3):
+        set_vals_by_key.nodes[0].overlay.create_signed_block(com_id=community_id)
+
+    for node in set_vals_by_key.nodes:
+        assert community_id in node.overlay.gossip_chains
+        node.overlay.frontier_gossip_bundle_task()
+
+    await deliver_messages()
+
+    frontier1 = set_vals_by_key.nodes[0].overlay.persistence.get_chain(community_id)
+    frontier2 = set_vals_by_key.nodes[1].overlay.persistence.get_chain(community_id)
+    assert frontier2.frontier.terminal[0][0] == 3
+    assert frontier1.frontier == frontier2.frontier
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("overlay_class", [SessionAuthCommunity])
+@pytest.mark.parametrize("num_nodes", [2])
+async def test_session_auth_reconciliation(set_vals_by_key, mocker):
+    """
+    Test whether missing blocks are synchronized with messages authenticated by session keys.
+    """
+    community_id = set_vals_by_key.community_id
+    node0, node1 = (node.overlay for node in set_vals_by_key.nodes)
+    # The first frontiers are signed, and start the sessions
+    node0.create_signed_block(com_id=community_id)
+    node0.frontier_gossip_sync_task(community_id)
+    await deliver_messages()
+    assert node0.session_keys.get_send_key(node1.my_peer, time.monotonic())
+    # The chain of node1 is not reconciled while the requested blocks arrive
+    await sleep(node1.settings.frontier_gossip_collect_time)
+
+    for _ in range(2):
+        node0.create_signed_block(com_id=community_id)
+    spy = mocker.spy(node1.session_keys, "get_receive_key")
+    node0.frontier_gossip_sync_task(community_id)
+    node1.frontier_gossip_sync_task(community_id)
+    await deliver_messages()
+
+    # The frontier and the blocks of node0 are authenticated with its session key
+    assert spy.call_count >= 3
+    assert spy.spy_return is not None
+    assert node1.persistence.get_chain(community_id).frontier.terminal[0][0] == 3
+    assert (
+        node0.persistence.get_chain(community_id).frontier
+        == node1.persistence.get_chain(community_id).frontier
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("overlay_class", [SessionAuthCommunity])
+@pytest.mark.parametrize("num_nodes", [2])
+async def test_session_lost_by_receiver(set_vals_by_key):
+    """
+    Test whether a sender stops using a session key the receiver lost, e.g. on a restart.
+    """
+    community_id = set_vals_by_key.community_id
+    node0, node1 = (node.overlay for node in set_vals_by_key.nodes)
+    node0.create_signed_block(com_id=community_id)
+    node0.frontier_gossip_sync_task(community_id)
+    await deliver_messages()
+    assert node0.session_keys.get_send_key(node1.my_peer, time.monotonic())
+
+    node1.session_keys.receive_keys.clear()
+    node0.create_signed_block(com_id=community_id)
+    node0.frontier_gossip_sync_task(community_id)
+    await deliver_messages()
+    # The rejected key is dropped: the next frontier is signed, and starts a new session
+    assert not node0.session_keys.get_send_key(node1.my_peer, time.monotonic())
+    node0.frontier_gossip_sync_task(community_id)
+    await deliver_messages()
+    assert node1.session_keys.get_receive_key(node0.my_peer.mid)
+    assert node0.session_keys.get_send_key(node1.my_peer, time.monotonic())
+    assert node1.persistence.get_chain(community_id).frontier.terminal[0][0] == 2
+
+
+@pytest.mark.parametrize("overlay_class", [SimpleCommunity, AdaptiveGossipCommunity])
+@pytest.mark.parametrize("num_nodes", [2])
+def test_gossip_schedule(set_vals_by_key, overlay_class):
+    """
+    Test whether a quiet chain backs off only with the adaptive gossip rate.
+    """
+    community_id = set_vals_by_key.community_id
+    node = set_vals_by_key.nodes[0].overlay
+    node.create_signed_block(com_id=community_id)
+    for _ in range(3):
+        node.frontier_gossip_sync_task(community_id)
+    interval, fanout = node.gossip_controller.metrics()[community_id]
+    settings = node.settings
+    if overlay_class is AdaptiveGossipCommunity:
+        assert interval > settings.frontier_gossip_interval
+        assert fanout < settings.frontier_gossip_fanout
+    else:
+        assert interval == settings.frontier_gossip_interval
+        assert fanout == settings.frontier_gossip_fanout
+
+
+@pytest.mark.parametrize("overlay_class", [SimpleCommunity])
+@pytest.mark.parametrize("num_nodes", [1])
+def test_block_view_stored_hash(set_vals_by_key):
+    """
+    Test whether a block view loaded from the store takes the hash the block is stored under.
+    """
+    community_id = set_vals_by_key.community_id
+    node = set_vals_by_key.nodes[0].overlay
+    blk = node.create_signed_block(com_id=community_id)
+
+    view = node.get_block_view_by_dot(community_id, blk.com_dot)
+    # The hash is set on load, not computed from the blob on first access
+    assert vars(view)["hash"] == blk.hash
+    assert view == blk and blk == view
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("overlay_class", [AsyncDeliveryCommunity])
+@pytest.mark.parametrize("num_nodes", [2])
+async def test_async_block_delivery(set_vals_by_key, mocker):
+    """
+    Test whether the synchronized blocks are delivered in order, after they are persisted.
+    """
+    community_id = set_vals_by_key.community_id
+    node0, node1 = (node.overlay for node in set_vals_by_key.nodes)
+    batches = []
+    node1.subscribe_in_order_blocks(community_id, batches.append)
+    blocks = [node0.create_signed_block(com_id=community_id) for _ in range(3)]
+    # The blocks of node0 are delivered once its task runs
+    assert node0.block_delivery.backlog(community_id) == 3
+    assert not node0.delivered
+
+    spy = mocker.spy(node1, "get_block_view_by_dot")
+    node0.frontier_gossip_sync_task(community_id)
+    node1.frontier_gossip_sync_task(community_id)
+    await deliver_messages()
+
+    for node in (node0, node1):
+        assert [blk.hash for blk in node.delivered] == [blk.hash for blk in blocks]
+        assert node.block_delivery.backlog(community_id) == 0
+    assert [blk.hash for batch in batches for blk in batch] == [
+        blk.hash for blk in blocks
+    ]
+    # The pulled blocks are delivered as decoded on arrival
+    spy.assert_not_called()
+
+
 @pytest.mark.asyncio
 @pytest.mark.parametrize("overlay_class", [BlockResponseCommunity])
 @pytest.mark.parametrize("num_nodes", [2])
@@ -1,4 +1,3 @@
-from asyncio.queues import Queue
 from typing import Any, Dict, Iterable, Optional, Type, Union
 
 from bami.plexus.backbone.block import PlexusBlock
@@ -126,6 +125,62 @@ class MockSettings(object):
     def frontier_gossip_fanout(self):
         return 5
 
+    @property
+    def frontier_delta_encoding(self):
+        return True
+
+    @property
+    def frontier_max_deltas(self):
+        return 10
+
+    @property
+    def block_response_max_bytes(self):
+        return 256 * 1024
+
+    @property
+    def block_response_max_count(self):
+        return 200
+
+    @property
+    def verification_workers(self):
+        return 2
+
+    @property
+    def verification_batch_size(self):
+        return 256
+
+    @property
+    def verification_cache_size(self):
+        return 1000
+
+    @property
+    def duplicate_filter_size(self):
+        return 1000
+
+    @property
+    def push_gossip_fanout(self):
+        return 9
+
+    @property
+    def push_gossip_chain_fanout(self):
+        return {}
+
+    @property
+    def push_gossip_seen_size(self):
+        return 1000
+
+    @property
+    def push_gossip_seen_time(self):
+        return 60.0
+
+    @property
+    def frontier_max_reconciliations(self):
+        return 100
+
+    @property
+    def frontier_max_requested_blocks(self):
+        return 2000
+
 
 class MockedCommunity(Community, CommunityRoutines):
     community_id = Peer(default_eccrypto.generate_key(u"very-low")).mid
@@ -163,9 +218,6 @@ class MockedCommunity(Community, CommunityRoutines):
 class FakeBackCommunity(PlexusCommunity, BlockResponseMixin):
     community_id = b"\x00" * 20
 
-    def incoming_frontier_queue(self, subcom_id: bytes) -> Queue:
-        pass
-
     def create_subcom(self, *args, **kwargs) -> BaseSubCommunity:
         pass
 
@@ -1,4 +1,6 @@
-from typing import Iterator, Optional, Iterable, Set, Tuple
+import sys
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Iterable, Set, Tuple
 
 from bami.plexus.backbone.block import PlexusBlock
 from bami.plexus.backbone.datastore.block_store import BaseBlockStore
@@ -9,11 +11,11 @@ from bami.plexus.backbone.datastore.chain_store import (
     BaseChainFactory,
 )
 from bami.plexus.backbone.datastore.database import BaseDB
-from bami.plexus.backbone.utils import Dot, Links, ShortKey
+from bami.plexus.backbone.utils import Dot, IntervalSet, Links, ShortKey
 
 
 class MockBlockStore(BaseBlockStore):
-    def iterate_blocks(self) -> Iterator[Tuple[bytes, bytes]]:
+    def iterate_blocks(self, buffers: bool = False) -> Iterator[Tuple[bytes, bytes]]:
         return []
 
     def add_extra(self, block_hash: bytes, extra: bytes) -> None:
@@ -25,12 +27,28 @@ class MockBlockStore(BaseBlockStore):
     def close(self) -> None:
         pass
 
+    async def compact(self) -> bool:
+        return False
+
     def add_block(self, block_hash: bytes, block_blob: bytes) -> None:
         pass
 
+    def delete_block(self, block_hash: bytes) -> None:
+        pass
+
+    def delete_dot(self, dot: bytes) -> None:
+        pass
+
+    def delete_index_key(self, index: bytes, key: bytes, block_hash: bytes) -> None:
+        pass
+
     def get_block_by_hash(self, block_hash: bytes) -> Optional[bytes]:
         pass
 
+    @contextmanager
+    def get_block_buffer(self, block_hash: bytes) -> Iterator[Optional[memoryview]]:
+        yield None
+
     def add_tx(self, block_hash: bytes, tx_blob: bytes) -> None:
         pass
 
@@ -43,6 +61,38 @@ class MockBlockStore(BaseBlockStore):
     def get_tx_by_hash(self, block_hash: bytes) -> Optional[bytes]:
         pass
 
+    @contextmanager
+    def write_batch(self) -> Iterator[None]:
+        yield
+
+    @contextmanager
+    def read_batch(self) -> Iterator[None]:
+        yield
+
+    def iterate_blocks_since(
+        self, position: int, buffers: bool = False
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        return []
+
+    def add_index_key(self, index: bytes, key: bytes, block_hash: bytes) -> None:
+        pass
+
+    def iterate_index(
+        self, index: bytes, prefix: bytes, start: bytes = b"", end: bytes = None
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        return []
+
+    def save_checkpoint(
+        self, chain_states: Dict[bytes, bytes], chain_deltas: Dict[bytes, bytes] = None
+    ) -> None:
+        pass
+
+    def load_checkpoint(self) -> Optional[Tuple[Dict[bytes, bytes], int]]:
+        pass
+
+    def load_chain_deltas(self, chain_id: bytes) -> List[bytes]:
+        return []
+
 
 class MockDBManager(BaseDB):
     def get_last_reconcile_point(self, chain_id: bytes, peer_id: bytes) -> int:
@@ -67,11 +117,65 @@ class MockDBManager(BaseDB):
     def get_last_frontier(self, chain_id: bytes, peer_id: bytes) -> Frontier:
         pass
 
+    def store_sent_frontier(
+        self, chain_id: bytes, peer_id: bytes, frontier: Frontier, num_deltas: int
+    ) -> None:
+        pass
+
+    def get_sent_frontier(
+        self, chain_id: bytes, peer_id: bytes
+    ) -> Tuple[Optional[Frontier], int]:
+        return None, 0
+
+    def store_received_frontier(
+        self, chain_id: bytes, peer_id: bytes, frontier: Frontier
+    ) -> None:
+        pass
+
+    def get_received_frontier(
+        self, chain_id: bytes, peer_id: bytes
+    ) -> Optional[Frontier]:
+        pass
+
     def get_block_blobs_by_frontier_diff(
         self, chain_id: bytes, frontier_diff: FrontierDiff, vals_to_request: Set
     ) -> Iterable[bytes]:
         pass
 
+    def iterate_blocks_by_public_key(
+        self, public_key: bytes, start_seq: int = 1, end_seq: int = None
+    ) -> Iterator[bytes]:
+        return []
+
+    def iterate_blocks_by_community(
+        self, com_id: bytes, start_seq: int = 1, end_seq: int = None
+    ) -> Iterator[bytes]:
+        return []
+
+    def iterate_blocks_by_type(
+        self, block_type: bytes, start_time: int = 0, end_time: int = None
+    ) -> Iterator[bytes]:
+        return []
+
+    def get_block_blobs_page(
+        self,
+        chain_id: bytes,
+        frontier_diff: FrontierDiff,
+        vals_to_request: Set,
+        max_bytes: int,
+        max_count: int,
+    ) -> Tuple[List[bytes], Optional[FrontierDiff]]:
+        pass
+
+    def checkpoint(self) -> None:
+        pass
+
+    def prune(self, finalized: Dict[bytes, int]) -> int:
+        return 0
+
+    async def compact(self) -> bool:
+        return False
+
     def close(self) -> None:
         pass
 
@@ -89,14 +193,32 @@ class MockDBManager(BaseDB):
     def add_block(self, block: PlexusBlock, block_serializer) -> None:
         pass
 
+    def add_blocks(self, blocks: Iterable[Tuple[bytes, PlexusBlock]]) -> None:
+        pass
+
     def get_block_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
         pass
 
+    def get_block_hash_and_blob_by_dot(
+        self, chain_id: bytes, block_dot: Dot
+    ) -> Optional[Tuple[bytes, bytes]]:
+        pass
+
     def get_tx_blob_by_dot(self, chain_id: bytes, block_dot: Dot) -> Optional[bytes]:
         pass
 
 
 class MockChain(BaseChain):
+    def prune(self, seq_num: int) -> List[Dot]:
+        return []
+
+    def known_seq_nums(self) -> IntervalSet:
+        return IntervalSet(((1, sys.maxsize),))
+
+    @property
+    def pruned_seq_num(self) -> int:
+        return 1
+
     @property
     def terminal(self) -> Links:
         pass
@@ -112,6 +234,9 @@ class MockChain(BaseChain):
     ) -> Dot:
         pass
 
+    def add_blocks(self, blocks: Iterable[Tuple[Links, int, bytes]]) -> List[Dot]:
+        pass
+
     def reconcile(self, frontier: Frontier, lrp: int = None) -> FrontierDiff:
         pass
 
@@ -129,7 +254,13 @@ class MockChain(BaseChain):
     def get_prev_links(self, block_dot: Dot) -> Optional[Links]:
         pass
 
+    def to_bytes(self) -> bytes:
+        pass
+
 
 class MockChainFactory(BaseChainFactory):
-    def create_chain(self, **kwargs) -> BaseChain:
+    def create_chain(self, chain_id: bytes, **kwargs) -> BaseChain:
+        return MockChain()
+
+    def load_chain(self, chain_id: bytes, chain_state: bytes, **kwargs) -> BaseChain:
         return MockChain()